@@ -1,11 +1,46 @@
+import os
+import time
 import streamlit as st
 import sqlite3
-from connection import create_connection, init_db
+import metrics
+from connection import get_connection, transaction, init_db
+from blob_store import load_encrypted_file
+from upgrade_metadata import start_background_upgrade
+from migrate_blobs import start_background_migration, migration_running, count_inline_rows
+from upload_jobs import (enqueue_upload, fetch_jobs, start_workers, JOB_WORKERS,
+                         JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED)
+from decrypt_cache import cached_decrypt_metadata, cached_decrypt_file, invalidate_artwork, cache_stats
+from artwork_files import decrypt_range, sniff_file_header, PREVIEW_BYTES
+from watermark_index import match_watermark
+from phash_index import match_similar, PHASH_MAX_DISTANCE
+from derivatives import delete_derivatives, release_blobs, load_derivative
+from search_index import search_artworks, delete_search_tokens, matches_query, SEARCH_LIMIT
 from crypto_utils import *
 
-# Initialize database
+# Worker antrian upload lokal (ARTCRYPT_JOB_WORKERS=0 → worker dijalankan terpisah: python upload_jobs.py).
+# Di-fork sebelum pool koneksi dibuka; worker membuka koneksi & init_db sendiri
+if JOB_WORKERS > 0:
+    start_workers(JOB_WORKERS)
+
+# Initialize database (sekali per proses; rerun berikutnya langsung return)
 init_db()
 
+# Opsional: upgrade metadata lama ke envelope v2 di background
+if os.environ.get('ARTCRYPT_AUTO_UPGRADE_METADATA') == '1':
+    start_background_upgrade()
+
+# File inline lama (file_data di tabel artworks) memperlambat setiap baca kolom setelahnya:
+# dipindahkan ke blob store di background (ARTCRYPT_AUTO_MIGRATE_BLOBS=0 → manual: python migrate_blobs.py)
+AUTO_MIGRATE_BLOBS = os.environ.get('ARTCRYPT_AUTO_MIGRATE_BLOBS', '1') == '1'
+if AUTO_MIGRATE_BLOBS:
+    start_background_migration()
+
+# Opsional (ARTCRYPT_METRICS=1): export metrics berkala ke ARTCRYPT_METRICS_FILE
+metrics.start_exporter()
+# Username yang boleh membuka halaman Performance
+ADMIN_USERS = {u.strip() for u in os.environ.get('ARTCRYPT_ADMIN_USERS', '').split(',') if u.strip()}
+TRACE_HISTORY = 10
+
 st.set_page_config(page_title="ArtCrypt", page_icon="🎨")
 st.title("🎨 ArtCrypt - Platform Kriptografi Karya Digital")
 
@@ -17,7 +52,26 @@ if 'username' not in st.session_state:
 
 def main():
     """Main application function"""
+    if not metrics.ENABLED:
+        show_app()
+        return
     
+    # Trace per request: semua operasi ter-timer selama run ini disimpan di session state
+    started = time.perf_counter()
+    with metrics.trace() as spans:
+        try:
+            show_app()
+        finally:
+            traces = st.session_state.setdefault('perf_traces', [])
+            traces.append({
+                'time': time.strftime('%H:%M:%S'),
+                'page': st.session_state.get('nav_menu'),
+                'total_ms': round((time.perf_counter() - started) * 1000, 3),
+                'spans': spans,
+            })
+            del traces[:-TRACE_HISTORY]
+
+def show_app():
     # Authentication section
     if not st.session_state.user_id:
         show_auth_section()
@@ -37,11 +91,11 @@ def show_auth_section():
             
             if login_btn:
                 if username and password:
-                    conn = create_connection()
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT id, username_encrypted, password_encrypted FROM users")
-                    user_id = verify_user(username, password, cursor.fetchall())
-                    conn.close()
+                    with get_connection() as conn:
+                        # Lookup O(1) via HMAC username (unique index), satu dekripsi password
+                        cursor = conn.execute("SELECT id, password_encrypted FROM users WHERE username_lookup = ?",
+                                              (username_lookup_hash(username),))
+                        user_id = verify_user_row(password, cursor.fetchone())
                     
                     if user_id:
                         st.session_state.user_id = user_id
@@ -64,19 +118,17 @@ def show_auth_section():
             if register_btn:
                 if new_user and new_pass and confirm_pass:
                     if new_pass == confirm_pass:
-                        conn = create_connection()
-                        cursor = conn.cursor()
                         try:
                             user_enc = encrypt_username(new_user)
                             pass_enc = encrypt_password(new_pass)
-                            cursor.execute("INSERT INTO users (username_encrypted, password_encrypted) VALUES (?, ?)", 
-                                         (user_enc, pass_enc))
-                            conn.commit()
+                            user_lookup = username_lookup_hash(new_user)
+                            with transaction() as conn:
+                                # Unique index pada username_lookup menolak username duplikat
+                                conn.execute("INSERT INTO users (username_encrypted, password_encrypted, username_lookup) VALUES (?, ?, ?)", 
+                                             (user_enc, pass_enc, user_lookup))
                             st.success("✅ Registrasi berhasil! Silakan login.")
                         except sqlite3.IntegrityError:
                             st.error("❌ Username sudah ada!")
-                        finally:
-                            conn.close()
                     else:
                         st.error("❌ Password tidak cocok!")
                 else:
@@ -87,12 +139,15 @@ def show_dashboard():
     st.sidebar.success(f"👋 Welcome, **{st.session_state.username}**!")
     
     # Navigation - TAMBAH MENU VERIFIKASI
-    menu = st.sidebar.radio("📋 Navigasi", [
+    pages = [
         "🏠 Dashboard", 
         "📤 Upload Karya", 
         "🖼️ Galeri Karya",
         "🔍 Verifikasi Karya"
-    ])
+    ]
+    if metrics.ENABLED and st.session_state.username in ADMIN_USERS:
+        pages.append("📈 Performance")
+    menu = st.sidebar.radio("📋 Navigasi", pages, key="nav_menu")
     
     if menu == "🏠 Dashboard":
         show_home_dashboard()
@@ -102,6 +157,8 @@ def show_dashboard():
         show_gallery_section()
     elif menu == "🔍 Verifikasi Karya":
         show_verification_section()
+    elif menu == "📈 Performance":
+        show_performance_section()
     
     # Logout button
     if st.sidebar.button("🚪 Logout"):
@@ -113,26 +170,16 @@ def show_home_dashboard():
     """Show home dashboard"""
     st.header("🏠 Dashboard Overview")
     
-    conn = create_connection()
-    cursor = conn.cursor()
-    
-    # Get user artworks count
-    cursor.execute("SELECT COUNT(*) FROM artworks WHERE user_id = ?", (st.session_state.user_id,))
-    artworks_count = cursor.fetchone()[0]
-    
-    # Get total file size
-    cursor.execute("SELECT file_data FROM artworks WHERE user_id = ?", (st.session_state.user_id,))
-    artworks = cursor.fetchall()
-    total_size = sum(len(art[0]) for art in artworks if art[0])
+    # Semua metrik dari satu query agregat (index user_id, file_type; tanpa membaca file_data)
+    with get_connection() as conn:
+        artworks_count, total_size, watermarked_count = conn.execute('''
+            SELECT COUNT(*),
+                   COALESCE(SUM(blob_size), 0),
+                   COALESCE(SUM(file_type LIKE 'image%' AND watermark_data IS NOT NULL), 0)
+            FROM artworks WHERE user_id = ?
+        ''', (st.session_state.user_id,)).fetchone()
     total_size_mb = total_size / (1024 * 1024)
     
-    # Get images with watermark count
-    cursor.execute("SELECT COUNT(*) FROM artworks WHERE user_id = ? AND file_type LIKE 'image%' AND watermark_data IS NOT NULL", 
-                   (st.session_state.user_id,))
-    watermarked_count = cursor.fetchone()[0]
-    
-    conn.close()
-    
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
@@ -156,173 +203,435 @@ def show_home_dashboard():
     st.write("""
     ArtCrypt adalah platform untuk melindungi karya digital Anda dengan enkripsi multi-layer:
     - **🔐 Autentikasi**: Camellia CBC + HMAC-SHA384 untuk login yang aman
-    - **📝 Metadata**: Caesar Cipher + AES-128-GCM + Camellia CBC
+    - **📝 Metadata**: AES-256-GCM (envelope v2; data lama Caesar + AES-128-GCM + Camellia CBC tetap terbaca)
     - **📁 File**: AES-128-CTR + Camellia CBC untuk enkripsi file
     - **🖼️ Watermark**: True Bit Plane Slicing untuk gambar
     """)
 
+def show_performance_section():
+    """Admin: statistik operasi, operasi lambat, trace request terakhir sesi ini, dan export metrics"""
+    st.header("📈 Performance")
+    inline_rows = count_inline_rows()
+    if inline_rows and migration_running():
+        st.info(f"🔄 {inline_rows} artwork masih menyimpan file inline di database; migrasi ke blob store "
+                f"sedang berjalan di background (galeri & dashboard melambat sampai selesai).")
+    elif inline_rows and not AUTO_MIGRATE_BLOBS:
+        st.warning(f"⚠️ {inline_rows} artwork masih menyimpan file inline di database (galeri & dashboard "
+                   f"melambat). Migrasi otomatis nonaktif (ARTCRYPT_AUTO_MIGRATE_BLOBS=0): "
+                   f"jalankan `python migrate_blobs.py`.")
+    elif inline_rows:
+        st.warning(f"⚠️ {inline_rows} artwork masih menyimpan file inline di database dan migrasi background "
+                   f"berhenti (lihat log server). Jalankan `python migrate_blobs.py`.")
+    snapshot = metrics.registry.snapshot()
+    counters = snapshot['counters']
+    
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Terenkripsi", f"{counters.get('bytes_encrypted', 0) / (1024 * 1024):.2f} MB")
+    col2.metric("Terdekripsi", f"{counters.get('bytes_decrypted', 0) / (1024 * 1024):.2f} MB")
+    col3.metric("Blob Dibaca", f"{counters.get('bytes_read', 0) / (1024 * 1024):.2f} MB")
+    col4.metric("Blob Ditulis", f"{counters.get('bytes_written', 0) / (1024 * 1024):.2f} MB")
+    
+    st.subheader(f"🐢 Operasi Lambat (≥ {metrics.SLOW_MS:g} ms)")
+    if snapshot['slow']:
+        st.dataframe(list(reversed(snapshot['slow'])), use_container_width=True)
+    else:
+        st.info("Belum ada operasi lambat.")
+    
+    st.subheader("⏱️ Statistik per Operasi")
+    st.dataframe(sorted(
+        ({'op': name, 'count': op['count'], 'mean_ms': round(op['mean_ms'], 3),
+          'max_ms': round(op['max_ms'], 3), 'total_ms': round(op['total_ms'], 3)}
+         for name, op in snapshot['ops'].items()),
+        key=lambda row: -row['total_ms']), use_container_width=True)
+    
+    st.subheader("🧭 Trace Request Terakhir (sesi ini)")
+    for trace in reversed(st.session_state.get('perf_traces', [])):
+        with st.expander(f"{trace['time']} · {trace['page'] or '-'} · {trace['total_ms']:.1f} ms · "
+                         f"{len(trace['spans'])} operasi"):
+            st.dataframe(trace['spans'], use_container_width=True)
+    
+    st.subheader("💾 Cache Dekripsi")
+    st.json(cache_stats())
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.download_button("📥 Prometheus", metrics.export_prometheus(snapshot),
+                           file_name="artcrypt_metrics.prom", mime="text/plain", use_container_width=True)
+    with col2:
+        st.download_button("📥 JSON", metrics.export_json(snapshot),
+                           file_name="artcrypt_metrics.json", mime="application/json", use_container_width=True)
+    with col3:
+        if st.button("🔄 Reset Statistik", use_container_width=True):
+            metrics.registry.reset()
+            st.rerun()
+
 def show_upload_section():
     """Show artwork upload section"""
     st.header("📤 Upload Karya Baru")
     
+    mode = st.radio("Mode Upload", ["📄 Satu File", "📚 Batch (banyak file)"], horizontal=True)
+    if mode == "📄 Satu File":
+        show_single_upload_form()
+    else:
+        show_batch_upload_form()
+    
+    show_upload_jobs()
+
+def select_watermark_preset(key):
+    """Pilihan preset watermark gambar → list bit planes"""
+    preset = st.selectbox("💧 Preset Watermark (gambar)", list(WATERMARK_PRESETS),
+                          index=list(WATERMARK_PRESETS).index(DEFAULT_WATERMARK_PRESET),
+                          format_func=lambda name: WATERMARK_PRESETS[name]['label'], key=key)
+    return WATERMARK_PRESETS[preset]['bit_planes']
+
+def show_single_upload_form():
+    """Upload satu file dengan judul & deskripsi sendiri"""
     with st.form("upload_form"):
         title = st.text_input("🎨 Judul Karya")
         description = st.text_area("📝 Deskripsi", height=100)
         file = st.file_uploader("📁 Pilih File", 
                               type=['pdf', 'docx', 'jpg', 'jpeg', 'png', 'gif', 'mp3', 'wav'])
+        bit_planes = select_watermark_preset("single_watermark_preset")
         
         submitted = st.form_submit_button("🚀 Upload Karya")
         
         if submitted:
             if title and file:
-                conn = create_connection()
-                cursor = conn.cursor()
-                
                 try:
-                    # Encrypt metadata
-                    title_enc = encrypt_metadata(title)
-                    desc_enc = encrypt_metadata(description)
-                    
-                    # Process file
-                    file_data = file.getvalue()
-                    file_enc = encrypt_file(file_data)
-                    
-                    # Watermark for images
-                    watermark = None
-                    if file.type.startswith('image'):
-                        watermark_text = f"ArtCrypt-{st.session_state.user_id}-{title}"
-                        watermarked_bytes = embed_watermark(file, watermark_text)
-                        
-                        # Re-encrypt the watermarked image
-                        file_enc = encrypt_file(watermarked_bytes)
-                        
-                        # Encrypt watermark metadata
-                        watermark = encrypt_metadata(watermark_text)
-                    
-                    # Save to database
-                    cursor.execute('''
-                        INSERT INTO artworks (user_id, title_encrypted, description_encrypted, 
-                                            file_data, file_type, watermark_data)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (st.session_state.user_id, title_enc, desc_enc, file_enc, file.type, watermark))
-                    
-                    conn.commit()
-                    st.success("✅ Karya berhasil diupload!")
+                    # Watermark & enkripsi dikerjakan worker; form langsung kembali.
+                    # getbuffer(): memoryview buffer upload (tanpa salinan seperti getvalue())
+                    job_id, created = enqueue_upload(st.session_state.user_id, title, description,
+                                                     file.type, file.getbuffer(), bit_planes)
+                    if created:
+                        st.success(f"✅ Karya masuk antrian (job #{job_id}). Status dapat dipantau di bawah.")
+                    else:
+                        st.info(f"ℹ️ Upload yang sama sudah ada di antrian (job #{job_id}).")
                     
                 except Exception as e:
                     st.error(f"❌ Error: {str(e)}")
-                finally:
-                    conn.close()
             else:
                 st.warning("⚠️ Harap isi judul dan pilih file!")
 
+def show_batch_upload_form():
+    """Upload banyak file sekaligus: satu job antrian per file, diproses paralel oleh worker"""
+    with st.form("batch_upload_form"):
+        description = st.text_area("📝 Deskripsi (dipakai untuk semua file)", height=100)
+        files = st.file_uploader("📁 Pilih File (boleh banyak)",
+                                 type=['pdf', 'docx', 'jpg', 'jpeg', 'png', 'gif', 'mp3', 'wav'],
+                                 accept_multiple_files=True)
+        st.caption("Judul setiap karya diambil dari nama file.")
+        bit_planes = select_watermark_preset("batch_watermark_preset")
+        
+        submitted = st.form_submit_button("🚀 Upload Batch")
+        
+        if submitted:
+            if not files:
+                st.warning("⚠️ Harap pilih minimal satu file!")
+                return
+            
+            queued = 0
+            for f in files:
+                try:
+                    _, created = enqueue_upload(st.session_state.user_id, os.path.splitext(f.name)[0],
+                                                description, f.type, f.getbuffer(), bit_planes)
+                    queued += created
+                except Exception as e:
+                    st.error(f"❌ {f.name}: {str(e)}")
+            if queued:
+                st.success(f"✅ {queued} karya masuk antrian. Status dapat dipantau di bawah.")
+            if queued < len(files):
+                st.info(f"ℹ️ {len(files) - queued} file sudah ada di antrian atau gagal dimasukkan.")
+
+JOB_POLL_SECONDS = 2
+JOB_STATUS_LABELS = {
+    JOB_QUEUED: "⏳ Antri",
+    JOB_RUNNING: "⚙️ Diproses",
+    JOB_DONE: "✅ Selesai",
+    JOB_FAILED: "❌ Gagal",
+}
+
+def show_upload_jobs():
+    """Status job upload terbaru milik user (diperbarui berkala tanpa menjalankan ulang seluruh halaman)"""
+    jobs = fetch_jobs(st.session_state.user_id)
+    if not jobs:
+        return
+    
+    st.subheader("📋 Status Upload")
+    active = sum(job['status'] in (JOB_QUEUED, JOB_RUNNING) for job in jobs)
+    if active:
+        st.caption(f"{active} job sedang antri/diproses")
+    st.dataframe([{
+        'Job': job['id'],
+        'Judul': job['title'],
+        'Status': JOB_STATUS_LABELS.get(job['status'], job['status']),
+        'Percobaan': f"{job['attempts']}/{job['max_attempts']}",
+        'Ukuran': f"{(job['input_size'] or 0) / 1024:.1f} KB",
+        'Artwork': job['artwork_id'],
+        'Byte per Tahap': ' · '.join(f"{stage} {size / 1024:.0f} KB"
+                                     for stage, size in job['stage_bytes'].items()),
+        'Error': job['error'] or '',
+        'Diperbarui': job['updated_at'],
+    } for job in jobs], use_container_width=True, hide_index=True)
+    
+    if not hasattr(st, 'fragment'):
+        st.button("🔄 Refresh Status")
 
+# Streamlit ≥ 1.37: polling status hanya me-rerun fragment ini
+if hasattr(st, 'fragment'):
+    show_upload_jobs = st.fragment(run_every=JOB_POLL_SECONDS)(show_upload_jobs)
+
+
+GALLERY_PAGE_SIZE = 10
+
+def fetch_gallery_page(user_id, before_id=None, limit=GALLERY_PAGE_SIZE):
+    """Keyset pagination (id DESC): hanya kolom ringan, tanpa file_data. Return (rows, has_next)."""
+    with get_connection() as conn:
+        if before_id is None:
+            cursor = conn.execute('''
+                SELECT id, title_encrypted, file_type, watermark_data IS NOT NULL, wrapped_key
+                FROM artworks WHERE user_id = ? ORDER BY id DESC LIMIT ?
+            ''', (user_id, limit + 1))
+        else:
+            cursor = conn.execute('''
+                SELECT id, title_encrypted, file_type, watermark_data IS NOT NULL, wrapped_key
+                FROM artworks WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?
+            ''', (user_id, before_id, limit + 1))
+        rows = cursor.fetchall()
+    return rows[:limit], len(rows) > limit
+
+def fetch_artwork_detail(art_id, user_id):
+    """Ambil data lengkap satu karya (on-demand) milik user"""
+    with get_connection() as conn:
+        return conn.execute('''
+            SELECT description_encrypted, file_data, blob_ref, watermark_data, wrapped_key, watermark_config
+            FROM artworks WHERE id = ? AND user_id = ?
+        ''', (art_id, user_id)).fetchone()
+
+def delete_artwork(art_id, user_id):
+    """Hapus karya + blob-nya (jika tidak dipakai artwork lain). Return True jika terhapus."""
+    with transaction() as conn:
+        cursor = conn.cursor()
+        row = cursor.execute("SELECT blob_ref FROM artworks WHERE id = ? AND user_id = ?",
+                             (art_id, user_id)).fetchone()
+        if not row:
+            return False
+        derivative_refs = delete_derivatives(conn, art_id)
+        delete_search_tokens(conn, art_id)
+        cursor.execute("DELETE FROM artworks WHERE id = ? AND user_id = ?", (art_id, user_id))
+        deleted = cursor.rowcount > 0
+    
+    invalidate_artwork(user_id, art_id)
+    
+    # Hapus blob (file & turunan) setelah commit
+    if deleted:
+        release_blobs([row[0], *derivative_refs])
+    return deleted
+
+def search_gallery(user_id, query):
+    """Cari karya: blind index → kandidat → dekripsi judul/deskripsi kandidat saja → verifikasi"""
+    ids = search_artworks(user_id, query)
+    if not ids:
+        return []
+    with get_connection() as conn:
+        rows = conn.execute(f'''
+            SELECT id, title_encrypted, file_type, watermark_data IS NOT NULL, wrapped_key, description_encrypted
+            FROM artworks WHERE user_id = ? AND id IN ({', '.join('?' * len(ids))}) ORDER BY id DESC
+        ''', (user_id, *ids)).fetchall()
+    
+    hits = []
+    for art_id, title_enc, file_type, has_watermark, wrapped_key, desc_enc in rows:
+        try:
+            title = cached_decrypt_metadata(user_id, art_id, 'title', title_enc, wrapped_key)
+            description = cached_decrypt_metadata(user_id, art_id, 'description', desc_enc, wrapped_key)
+        except Exception:
+            continue
+        if matches_query(query, title, description):
+            hits.append((art_id, title_enc, file_type, has_watermark, wrapped_key))
+    return hits
 
 def show_gallery_section():
-    """Show artwork gallery with delete button"""
+    """Show artwork gallery (paginated, lazy decrypt) with delete button"""
     st.header("🖼️ Galeri Karya Saya")
     
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, title_encrypted, description_encrypted, file_data, file_type, watermark_data
-        FROM artworks WHERE user_id = ? ORDER BY id DESC
-    ''', (st.session_state.user_id,))
+    user_id = st.session_state.user_id
+    if 'gallery_cursors' not in st.session_state:
+        # Stack cursor keyset: elemen terakhir = batas id halaman aktif (None = halaman pertama)
+        st.session_state.gallery_cursors = [None]
+    if 'gallery_loaded' not in st.session_state:
+        st.session_state.gallery_loaded = set()
     
-    artworks = cursor.fetchall()
+    with get_connection() as conn:
+        total = conn.execute("SELECT COUNT(*) FROM artworks WHERE user_id = ?", (user_id,)).fetchone()[0]
     
-    if not artworks:
+    if not total:
         st.info("📝 Belum ada karya yang diupload. Mulai upload karya pertama Anda!")
-        conn.close()
         return
     
     # Tampilkan jumlah karya
-    st.success(f"📊 Anda memiliki {len(artworks)} karya")
+    st.success(f"📊 Anda memiliki {total} karya")
+    
+    # Pencarian via blind index: hanya karya yang cocok yang didekripsi
+    query = st.text_input("🔎 Cari Judul/Deskripsi", key="gallery_search",
+                          placeholder="mis. lukisan senja")
+    if query.strip():
+        started = time.perf_counter()
+        results = search_gallery(user_id, query)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        st.caption(f"{len(results)} hasil untuk “{query}” ({elapsed_ms:.0f} ms)"
+                   + (f" — ditampilkan maksimal {SEARCH_LIMIT}" if len(results) >= SEARCH_LIMIT else ""))
+        if not results:
+            st.info("🔍 Tidak ada karya yang cocok.")
+        for art_id, title_enc, file_type, has_watermark, wrapped_key in results:
+            show_gallery_item(user_id, art_id, title_enc, file_type, has_watermark, wrapped_key)
+        return
     
-    for art_id, title_enc, desc_enc, file_data, file_type, watermark in artworks:
-        try:
-            # Decrypt metadata
-            title = decrypt_metadata(title_enc)
-            description = decrypt_metadata(desc_enc)
-            
-            # Decrypt file
-            file_decrypted = decrypt_file(file_data)
+    cursors = st.session_state.gallery_cursors
+    artworks, has_next = fetch_gallery_page(user_id, cursors[-1])
+    if not artworks and len(cursors) > 1:
+        # Halaman kosong (mis. setelah hapus): kembali ke halaman sebelumnya
+        cursors.pop()
+        st.rerun()
+    
+    page = len(cursors)
+    total_pages = (total + GALLERY_PAGE_SIZE - 1) // GALLERY_PAGE_SIZE
+    st.caption(f"Halaman {page} dari {total_pages}")
+    
+    # Hanya judul yang didekripsi di awal
+    for art_id, title_enc, file_type, has_watermark, wrapped_key in artworks:
+        show_gallery_item(user_id, art_id, title_enc, file_type, has_watermark, wrapped_key)
+    
+    # Navigasi halaman
+    col1, col2 = st.columns(2)
+    with col1:
+        if page > 1 and st.button("⬅️ Sebelumnya", use_container_width=True, key="gallery_prev"):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        if has_next and st.button("Berikutnya ➡️", use_container_width=True, key="gallery_next"):
+            cursors.append(artworks[-1][0])
+            st.rerun()
+
+def show_gallery_item(user_id, art_id, title_enc, file_type, has_watermark, wrapped_key):
+    """Satu karya di galeri: judul, thumbnail, tombol muat & hapus"""
+    try:
+        title = cached_decrypt_metadata(user_id, art_id, 'title', title_enc, wrapped_key)
+    except Exception as e:
+        st.error(f"❌ Error memuat karya ID {art_id}: {str(e)}")
+        return
+    
+    with st.expander(f"🎨 {title}", expanded=art_id in st.session_state.gallery_loaded):
+        st.write(f"**📄 Tipe File:** {file_type}")
+        if file_type.startswith('image') and art_id not in st.session_state.gallery_loaded:
+            thumb = load_derivative(user_id, art_id, 'thumb', wrapped_key)
+            if thumb:
+                st.image(thumb, width=160)
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if art_id not in st.session_state.gallery_loaded:
+                if st.button("📂 Muat Karya", use_container_width=True, key=f"load_{art_id}"):
+                    st.session_state.gallery_loaded.add(art_id)
+                    st.rerun()
+        
+        with col2:
+            # TOMBOL HAPUS - dengan key yang unik
+            if st.button("🗑️ Hapus Karya", 
+                       use_container_width=True,
+                       key=f"delete_{art_id}",
+                       type="secondary"):
+                try:
+                    if delete_artwork(art_id, user_id):
+                        st.session_state.gallery_loaded.discard(art_id)
+                        st.success(f"✅ Karya '{title}' berhasil dihapus!")
+                        st.rerun()  # Refresh halaman
+                    else:
+                        st.error("❌ Gagal menghapus karya")
+                except Exception as e:
+                    st.error(f"❌ Error: {str(e)}")
+        
+        if art_id in st.session_state.gallery_loaded:
+            show_artwork_detail(art_id, title, file_type, has_watermark)
+
+def show_artwork_detail(art_id, title, file_type, has_watermark):
+    """Detail satu karya: file, pratinjau, watermark & download didekripsi hanya saat dibuka"""
+    try:
+        detail = fetch_artwork_detail(art_id, st.session_state.user_id)
+        if not detail:
+            st.error("❌ Karya tidak ditemukan.")
+            return
+        desc_enc, file_data, blob_ref, watermark, wrapped_key, watermark_config = detail
+        
+        user_id = st.session_state.user_id
+        description = cached_decrypt_metadata(user_id, art_id, 'description', desc_enc, wrapped_key)
+        load_file = lambda: cached_decrypt_file(user_id, art_id,
+                                                lambda: load_encrypted_file(file_data, blob_ref),
+                                                wrapped_key)
+        
+        st.write(f"**📝 Deskripsi:** {description}")
+        
+        # File display section
+        if file_type.startswith('image'):
+            # Tampilkan preview terenkripsi (turunan kecil); file asli hanya jika belum ada preview
+            preview = load_derivative(user_id, art_id, 'preview', wrapped_key)
+            st.image(preview or load_file(), use_container_width=True)
             
-            with st.expander(f"🎨 {title}", expanded=False):
-                st.write(f"**📝 Deskripsi:** {description}")
-                st.write(f"**📄 Tipe File:** {file_type}")
+            # Watermark verification untuk gambar (hanya jika diminta, butuh file asli)
+            if has_watermark and st.checkbox("🔍 Verifikasi Watermark", key=f"verify_{art_id}"):
+                wm_text = cached_decrypt_metadata(user_id, art_id, 'watermark', watermark, wrapped_key)
+                # Config tersimpan: baca tepat payload_len bit; baris lama: cukup len+1 karakter
+                extracted_wm = extract_stored_watermark(load_file(), watermark_config,
+                                                        max_len=len(wm_text) + 1)
                 
-                # File display section
-                if file_type.startswith('image'):
-                    # Tampilkan gambar
-                    st.image(file_decrypted, use_container_width=True)
-                    
-                    # Watermark verification untuk gambar
-                    if watermark:
-                        wm_text = decrypt_metadata(watermark)
-                        extracted_wm = extract_watermark_from_bytes(file_decrypted)
-                        
-                        st.write("---")
-                        st.subheader("🔍 Verifikasi Watermark")
-                        
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            st.write(f"**Watermark Terenkripsi:**")
-                            st.code(wm_text)
-                        
-                        with col2:
-                            st.write(f"**Watermark Terekstrak:**")
-                            st.code(extracted_wm)
-                        
-                        # Verifikasi
-                        if wm_text == extracted_wm:
-                            st.success("✅ **KARYA ASLI** - Watermark valid dan sesuai!")
-                        else:
-                            st.error("❌ **KARYA TIDAK VALID** - Watermark tidak cocok!")
-                            st.warning("⚠️ Kemungkinan karya telah dimodifikasi atau bukan karya asli!")
-                else:
-                    # Untuk file non-gambar
-                    st.info(f"📁 File {file_type.split('/')[-1].upper()}")
-                
-                # Tombol Download dan Hapus dalam kolom yang sama
                 col1, col2 = st.columns(2)
-                
                 with col1:
-                    # Download button untuk semua file
-                    file_extension = file_type.split('/')[-1] if '/' in file_type else 'file'
-                    st.download_button(
-                        label="📥 Download File",
-                        data=file_decrypted,
-                        file_name=f"{title}.{file_extension}",
-                        mime=file_type,
-                        use_container_width=True,
-                        key=f"download_{art_id}"
-                    )
+                    st.write(f"**Watermark Terenkripsi:**")
+                    st.code(wm_text)
                 
                 with col2:
-                    # TOMBOL HAPUS - dengan key yang unik
-                    if st.button("🗑️ Hapus Karya", 
-                               use_container_width=True,
-                               key=f"delete_{art_id}",
-                               type="secondary"):
-                        try:
-                            # Hapus dari database
-                            cursor.execute("DELETE FROM artworks WHERE id = ? AND user_id = ?", 
-                                         (art_id, st.session_state.user_id))
-                            conn.commit()
-                            
-                            if cursor.rowcount > 0:
-                                st.success(f"✅ Karya '{title}' berhasil dihapus!")
-                                st.rerun()  # Refresh halaman
-                            else:
-                                st.error("❌ Gagal menghapus karya")
-                        except Exception as e:
-                            st.error(f"❌ Error: {str(e)}")
+                    st.write(f"**Watermark Terekstrak:**")
+                    st.code(extracted_wm)
+                
+                # Verifikasi
+                if wm_text == extracted_wm:
+                    st.success("✅ **KARYA ASLI** - Watermark valid dan sesuai!")
+                else:
+                    st.error("❌ **KARYA TIDAK VALID** - Watermark tidak cocok!")
+                    st.warning("⚠️ Kemungkinan karya telah dimodifikasi atau bukan karya asli!")
+        else:
+            # Untuk file non-gambar: pratinjau dari range awal saja (tanpa dekripsi penuh)
+            st.info(f"📁 File {file_type.split('/')[-1].upper()}")
+            if file_type.startswith('audio'):
+                st.audio(decrypt_range(art_id, 0, PREVIEW_BYTES, user_id), format=file_type)
+                st.caption("🎧 Pratinjau bagian awal file")
+            elif file_type.startswith('video'):
+                st.video(decrypt_range(art_id, 0, PREVIEW_BYTES, user_id), format=file_type)
+                st.caption("🎬 Pratinjau bagian awal file")
+            elif file_type == 'application/pdf':
+                header = sniff_file_header(art_id, user_id)
+                if header.startswith(b'%PDF-'):
+                    pdf_version = header.split(b'\n')[0].decode('latin-1').strip()
+                    st.caption(f"📄 {pdf_version}")
+                else:
+                    st.warning("⚠️ Header file bukan PDF yang valid")
+        
+        # File asli baru didekripsi penuh saat download diminta
+        if not st.checkbox("📦 Siapkan Download", key=f"prepare_{art_id}"):
+            return
+        file_decrypted = load_file()
         
-        except Exception as e:
-            st.error(f"❌ Error memuat karya ID {art_id}: {str(e)}")
+        # Download button untuk semua file
+        file_extension = file_type.split('/')[-1] if '/' in file_type else 'file'
+        st.download_button(
+            label="📥 Download File",
+            data=file_decrypted,
+            file_name=f"{title}.{file_extension}",
+            mime=file_type,
+            use_container_width=True,
+            key=f"download_{art_id}"
+        )
     
-    conn.close()
+    except Exception as e:
+        st.error(f"❌ Error memuat karya ID {art_id}: {str(e)}")
 
 def show_verification_section():
     """NEW: Show artwork verification section"""
@@ -333,18 +642,91 @@ def show_verification_section():
     - Karya yang diduga modifikasi/palsu yang Anda upload
     """)
     
-    conn = create_connection()
-    cursor = conn.cursor()
+    mode = st.radio("Mode Verifikasi", ["🎯 1:1 (pilih karya asli)", "🔎 1:N (cari otomatis)"],
+                    horizontal=True)
+    if mode == "🎯 1:1 (pilih karya asli)":
+        show_verification_one_to_one()
+    else:
+        show_verification_search()
+
+def show_verification_search():
+    """
+    Verifikasi 1:N: watermark diekstrak sekali lalu dicari via index HMAC, tanpa memilih karya asli.
+    Jika watermark tidak ditemukan (gambar di-resize/kompresi ulang) → karya termirip via pHash.
+    """
+    st.subheader("Upload Gambar yang Dicurigai")
+    uploaded_files = st.file_uploader(
+        "Pilih satu atau beberapa gambar:",
+        type=['jpg', 'jpeg', 'png', 'gif'],
+        accept_multiple_files=True,
+        key="verification_search_upload"
+    )
     
-    # Get user's watermarked artworks
-    cursor.execute('''
-        SELECT id, title_encrypted, watermark_data 
-        FROM artworks 
-        WHERE user_id = ? AND file_type LIKE 'image%' AND watermark_data IS NOT NULL
-        ORDER BY id DESC
-    ''', (st.session_state.user_id,))
+    if not uploaded_files or not st.button("🔎 Cari Pemilik Karya", use_container_width=True):
+        return
     
-    watermarked_artworks = cursor.fetchall()
+    user_id = st.session_state.user_id
+    with st.spinner("Mencocokkan watermark..."):
+        for uploaded_file in uploaded_files:
+            st.markdown("---")
+            col1, col2 = st.columns([1, 2])
+            with col1:
+                st.image(uploaded_file.getvalue(), caption=uploaded_file.name, use_container_width=True)
+            with col2:
+                try:
+                    matches = match_watermark(uploaded_file.getvalue(), user_id)
+                except Exception as e:
+                    st.error(f"❌ Error: {str(e)}")
+                    continue
+                
+                if matches:
+                    for match, title, thumb in load_match_titles(user_id, matches):
+                        st.success(f"✅ **KARYA ASLI TERVERIFIKASI**: {title} (ID {match['artwork_id']})")
+                        if thumb:
+                            st.image(thumb, width=160)
+                        st.caption(f"Bit planes: {match['bit_planes']}")
+                        st.code(match['watermark'])
+                    continue
+                
+                st.error("❌ **Watermark tidak ditemukan atau rusak**")
+                try:
+                    similar = match_similar(uploaded_file.getvalue(), user_id)
+                except Exception as e:
+                    st.error(f"❌ Error pHash: {str(e)}")
+                    continue
+                if not similar:
+                    st.info(f"🧬 Tidak ada karya yang mirip secara visual (jarak pHash ≤ {PHASH_MAX_DISTANCE})")
+                    continue
+                st.warning("🧬 **Karya asli termirip secara visual** (perceptual hash, tahan resize/kompresi ulang):")
+                for match, title, thumb in load_match_titles(user_id, similar):
+                    st.write(f"**{title}** (ID {match['artwork_id']}) — jarak {match['distance']}/64, "
+                             f"kemiripan {match['similarity']:.0%}")
+                    if thumb:
+                        st.image(thumb, width=160)
+
+def load_match_titles(user_id, matches):
+    """Judul (dekripsi via cache) + thumbnail untuk hasil verifikasi 1:N; artwork yang sudah dihapus dilewati"""
+    with get_connection() as conn:
+        rows = {row[0]: row[1:] for row in conn.execute(
+            f"SELECT id, title_encrypted, wrapped_key FROM artworks WHERE id IN ({', '.join('?' * len(matches))})",
+            [m['artwork_id'] for m in matches])}
+    for match in matches:
+        if match['artwork_id'] not in rows:
+            continue
+        title_enc, wrapped_key = rows[match['artwork_id']]
+        title = cached_decrypt_metadata(user_id, match['artwork_id'], 'title', title_enc, wrapped_key)
+        yield match, title, load_derivative(user_id, match['artwork_id'], 'thumb', wrapped_key)
+
+def show_verification_one_to_one():
+    """Verifikasi 1:1: bandingkan gambar upload dengan satu karya asli pilihan user"""
+    # Koneksi hanya dipegang selama query (dikembalikan ke pool sebelum render widget)
+    with get_connection() as conn:
+        watermarked_artworks = conn.execute('''
+            SELECT id, title_encrypted, watermark_data, wrapped_key
+            FROM artworks 
+            WHERE user_id = ? AND file_type LIKE 'image%' AND watermark_data IS NOT NULL
+            ORDER BY id DESC
+        ''', (st.session_state.user_id,)).fetchall()
     
     if not watermarked_artworks:
         st.warning("""
@@ -355,7 +737,6 @@ def show_verification_section():
         2. Pastikan file berformat gambar (JPG, PNG, dll)
         3. Sistem akan otomatis menambahkan watermark
         """)
-        conn.close()
         return
     
     # Step 1: Pilih karya asli dari database
@@ -363,16 +744,15 @@ def show_verification_section():
     
     # Buat pilihan dropdown
     artwork_options = {}
-    for art_id, title_enc, watermark_data in watermarked_artworks:
+    for art_id, title_enc, watermark_data, wrapped_key in watermarked_artworks:
         try:
-            title = decrypt_metadata(title_enc)
+            title = cached_decrypt_metadata(st.session_state.user_id, art_id, 'title', title_enc, wrapped_key)
             artwork_options[art_id] = title
         except:
             continue
     
     if not artwork_options:
         st.error("❌ Tidak ada karya yang dapat dipilih.")
-        conn.close()
         return
     
     selected_artwork_id = st.selectbox(
@@ -382,26 +762,29 @@ def show_verification_section():
     )
     
     # Dapatkan data karya yang dipilih
-    cursor.execute('''
-        SELECT title_encrypted, description_encrypted, file_data, watermark_data
-        FROM artworks WHERE id = ?
-    ''', (selected_artwork_id,))
-    
-    original_art = cursor.fetchone()
+    with get_connection() as conn:
+        original_art = conn.execute('''
+            SELECT title_encrypted, description_encrypted, file_data, watermark_data, blob_ref, wrapped_key,
+                   watermark_config
+            FROM artworks WHERE id = ?
+        ''', (selected_artwork_id,)).fetchone()
     
     if not original_art:
         st.error("❌ Karya tidak ditemukan.")
-        conn.close()
         return
     
-    title_enc, desc_enc, file_data, watermark_data = original_art
+    title_enc, desc_enc, file_data, watermark_data, blob_ref, wrapped_key, watermark_config = original_art
     
     # Decrypt data karya asli
     try:
-        original_title = decrypt_metadata(title_enc)
-        original_description = decrypt_metadata(desc_enc)
-        original_image = decrypt_file(file_data)
-        original_watermark = decrypt_metadata(watermark_data)
+        user_id = st.session_state.user_id
+        original_title = cached_decrypt_metadata(user_id, selected_artwork_id, 'title', title_enc, wrapped_key)
+        original_description = cached_decrypt_metadata(user_id, selected_artwork_id, 'description', desc_enc, wrapped_key)
+        # Preview terenkripsi cukup untuk ditampilkan; file asli hanya jika belum ada preview
+        original_image = load_derivative(user_id, selected_artwork_id, 'preview', wrapped_key) or \
+            cached_decrypt_file(user_id, selected_artwork_id,
+                                lambda: load_encrypted_file(file_data, blob_ref), wrapped_key)
+        original_watermark = cached_decrypt_metadata(user_id, selected_artwork_id, 'watermark', watermark_data, wrapped_key)
         
         # Tampilkan informasi karya asli
         col1, col2 = st.columns(2)
@@ -415,7 +798,6 @@ def show_verification_section():
         
     except Exception as e:
         st.error(f"❌ Error memuat karya asli: {str(e)}")
-        conn.close()
         return
     
     # Step 2: Upload karya yang diduga modifikasi
@@ -442,7 +824,9 @@ def show_verification_section():
             with st.spinner("Memproses verifikasi..."):
                 try:
                     # Extract watermark dari gambar yang diupload
-                    extracted_watermark = extract_watermark_from_bytes(suspect_image_data)
+                    extracted_watermark = extract_stored_watermark(
+                        suspect_image_data, watermark_config, max_len=len(original_watermark) + 1
+                    )
                     
                     # Tampilkan perbandingan
                     col1, col2 = st.columns(2)
@@ -493,8 +877,6 @@ def show_verification_section():
                 
                 except Exception as e:
                     st.error(f"❌ Error selama verifikasi: {str(e)}")
-    
-    conn.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,439 @@
+import argparse
+import json
+import mimetypes
+import os
+import re
+import tarfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from connection import create_connection, get_connection, transaction, init_db
+from crypto_utils import (decrypt_metadata, encrypt_metadata, decrypt_file, encrypt_file,
+                          extract_stored_watermark, WATERMARK_PRESETS, DEFAULT_WATERMARK_PRESET)
+from key_manager import artwork_key, new_data_key, needs_rewrap, rewrap_data_key, load_key_file
+from blob_store import get_blob_store, load_encrypted_file, release_blob
+from upload_pipeline import run_batch_upload
+from watermark_index import candidate_lookups, find_by_lookups
+from phash_index import suspect_hash, find_similar
+from derivatives import build_derivatives, save_derivatives, release_blobs
+
+SUPPORTED_EXTENSIONS = {'.pdf', '.docx', '.jpg', '.jpeg', '.png', '.gif', '.mp3', '.wav'}
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif'}
+DEFAULT_BATCH_SIZE = 50
+
+# === CHECKPOINT ===
+def load_checkpoint(path, job):
+    """Baca checkpoint JSON; abaikan jika milik job lain"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        state = json.load(f)
+    if state.get('job') != job:
+        raise SystemExit(f"❌ Checkpoint {path} milik job '{state.get('job')}', bukan '{job}'")
+    return state
+
+def save_checkpoint(path, job, state):
+    """Tulis checkpoint secara atomik (temp + rename)"""
+    if not path:
+        return
+    state = dict(state, job=job, updated_at=time.strftime('%Y-%m-%d %H:%M:%S'))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+def iter_rows(query, params, batch_size):
+    """Stream hasil query per fetchmany(batch_size); koneksi dipegang selama iterasi"""
+    conn = create_connection()
+    try:
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+def safe_filename(text):
+    return re.sub(r'[^\w.-]+', '_', text).strip('_') or 'karya'
+
+def extension_for(file_type):
+    return mimetypes.guess_extension(file_type or '') or '.' + (file_type or 'file').split('/')[-1]
+
+# === IMPORT ===
+def cmd_import(args):
+    """Import seluruh file di pohon direktori sebagai karya milik satu user"""
+    state = load_checkpoint(args.checkpoint, 'import')
+    done = set(state.get('done', []))
+    failed = dict(state.get('failed', {}))
+
+    paths = []
+    for root, _, names in os.walk(args.directory):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, args.directory)
+            if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS and rel not in done:
+                paths.append((rel, path))
+    print(f"📥 {len(paths)} file akan diimport ({len(done)} sudah dari checkpoint)")
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for start in range(0, len(paths), args.batch_size):
+            batch = paths[start:start + args.batch_size]
+            items = []
+            for rel, path in batch:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                items.append({
+                    'name': rel,
+                    'title': os.path.splitext(os.path.basename(rel))[0],
+                    'description': args.description,
+                    'file_type': mimetypes.guess_type(path)[0] or 'application/octet-stream',
+                    'data': data,
+                    'bit_planes': WATERMARK_PRESETS[args.watermark_preset]['bit_planes'],
+                })
+            saved, errors = run_batch_upload(args.user_id, items, executor=executor)
+            for rel, _ in batch:
+                if rel in errors:
+                    failed[rel] = errors[rel]
+                else:
+                    done.add(rel)
+                    failed.pop(rel, None)
+            save_checkpoint(args.checkpoint, 'import', {'done': sorted(done), 'failed': failed})
+            print(f"  ✅ {start + len(batch)}/{len(paths)} (batch: {saved} tersimpan, {len(errors)} gagal)")
+
+    print(f"✅ Import selesai: {len(done)} file, {len(failed)} gagal")
+    return 0 if not failed else 1
+
+# === EXPORT ===
+def _export_one(row, out_dir):
+    """Worker: dekripsi satu karya. Tulis ke out_dir jika ada, selain itu kembalikan bytes."""
+    art_id, user_id, wrapped_key, title_enc, file_type, file_data, blob_ref = row
+    key = artwork_key(user_id, wrapped_key)
+    title = decrypt_metadata(title_enc, key)
+    data = decrypt_file(load_encrypted_file(file_data, blob_ref), key)
+    name = f"{art_id}_{safe_filename(title)}{extension_for(file_type)}"
+    if out_dir:
+        with open(os.path.join(out_dir, name), 'wb') as f:
+            f.write(data)
+        return art_id, name, len(data), None
+    return art_id, name, len(data), data
+
+def cmd_export(args):
+    """Export library terdekripsi milik user ke direktori atau tarball"""
+    as_tar = args.output.endswith(('.tar', '.tar.gz', '.tgz'))
+    if as_tar and args.output.endswith(('.tar.gz', '.tgz')) and args.checkpoint:
+        raise SystemExit("❌ Resume tidak didukung untuk tarball terkompresi; gunakan .tar atau direktori")
+
+    state = load_checkpoint(args.checkpoint, 'export')
+    last_id = state.get('last_id', 0)
+    exported = state.get('exported', 0)
+
+    out_dir = None
+    tar = None
+    tar_file = None
+    if as_tar and args.output.endswith(('.tar.gz', '.tgz')):
+        tar = tarfile.open(args.output, 'w:gz')
+    elif as_tar:
+        # Resume: potong ke akhir member terakhir dari batch yang sudah di-checkpoint,
+        # jadi member batch yang terputus (crash) tidak tertulis dua kali
+        if last_id and 'tar_offset' not in state:
+            raise SystemExit("❌ Checkpoint tidak menyimpan posisi tarball; ulangi export tanpa checkpoint lama")
+        tar_file = open(args.output, 'r+b' if last_id else 'wb')
+        tar_file.seek(state.get('tar_offset', 0))
+        tar_file.truncate()
+        tar = tarfile.open(fileobj=tar_file, mode='w')
+    else:
+        out_dir = args.output
+        os.makedirs(out_dir, exist_ok=True)
+
+    query = '''
+        SELECT id, user_id, wrapped_key, title_encrypted, file_type, file_data, blob_ref
+        FROM artworks WHERE user_id = ? AND id > ? ORDER BY id
+    '''
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            for rows in iter_rows(query, (args.user_id, last_id), args.batch_size):
+                for art_id, name, size, data in executor.map(_export_one, rows, [out_dir] * len(rows)):
+                    if tar is not None:
+                        info = tarfile.TarInfo(name)
+                        info.size = size
+                        info.mtime = int(time.time())
+                        tar.addfile(info, BytesIO(data))
+                    exported += 1
+                    print(f"  📄 {name} ({size:,} bytes)")
+                last_id = rows[-1][0]
+                checkpoint = {'last_id': last_id, 'exported': exported}
+                if tar_file is not None:
+                    tar_file.flush()
+                    os.fsync(tar_file.fileno())
+                    checkpoint['tar_offset'] = tar.offset
+                save_checkpoint(args.checkpoint, 'export', checkpoint)
+    finally:
+        if tar is not None:
+            tar.close()
+        if tar_file is not None:
+            tar_file.close()
+
+    print(f"✅ Export selesai: {exported} karya → {args.output}")
+    return 0
+
+# === RE-ENCRYPT ===
+def _reencrypt_one(row, legacy_key):
+    """
+    Worker: dekripsi dengan key lama → enkripsi dengan data key baru → blob baru (+ turunan baru).
+    Return (art_id, hasil, None) atau (art_id, None, error); blob yang sudah ditulis dibersihkan jika gagal.
+    """
+    art_id, user_id, wrapped_key, title_enc, desc_enc, watermark, phash_enc, file_type, file_data, blob_ref = row
+    new_ref = None
+    try:
+        old_key = artwork_key(user_id, wrapped_key) or legacy_key
+        new_key, new_wrapped = new_data_key(user_id)
+        title = encrypt_metadata(decrypt_metadata(title_enc, key=old_key), key=new_key)
+        desc = encrypt_metadata(decrypt_metadata(desc_enc, key=old_key), key=new_key)
+        if watermark is not None:
+            watermark = encrypt_metadata(decrypt_metadata(watermark, key=old_key), key=new_key)
+        if phash_enc is not None:
+            phash_enc = encrypt_metadata(decrypt_metadata(phash_enc, key=old_key), key=new_key)
+        plaintext = decrypt_file(load_encrypted_file(file_data, blob_ref), key=old_key)
+        file_enc = encrypt_file(plaintext, key=new_key)
+        new_ref = get_blob_store().put(file_enc)
+        # Turunan dienkripsi dengan data key artwork, jadi ikut dibuat ulang
+        derivatives = build_derivatives(plaintext, new_key) if file_type.startswith('image') else []
+    except Exception as e:
+        release_blob(new_ref)
+        return art_id, None, str(e)
+    return art_id, (title, desc, watermark, phash_enc, new_ref, len(file_enc), new_wrapped, derivatives), None
+
+def _new_blob_refs(result):
+    """Blob baru yang ditulis worker untuk satu hasil re-encrypt (file + turunan)"""
+    return [result[4], *(d['blob_ref'] for d in result[7])]
+
+def _save_reencrypted(conn, rows, results, failed):
+    """
+    UPDATE hasil re-encrypt satu batch (dalam transaksi milik pemanggil).
+    Return (jumlah diperbarui, blob lama yang diganti, blob baru yang tidak terpakai).
+    """
+    updated = 0
+    old_refs = []
+    unused_refs = []
+    for row, (art_id, result, error) in zip(rows, results):
+        if error is not None:
+            failed.append({'id': art_id, 'error': error})
+            print(f"  ❌ ID {art_id}: {error}")
+            continue
+        title, desc, wm, phash, new_ref, size, new_wrapped, derivatives = result
+        old_wrapped, old_title, old_desc, old_ref = row[2], row[3], row[4], row[9]
+        # App tetap berjalan: baris yang diubah/dihapus sejak SELECT tidak ditimpa
+        cursor = conn.execute('''
+            UPDATE artworks SET title_encrypted = ?, description_encrypted = ?,
+                watermark_data = ?, phash_encrypted = ?, blob_ref = ?, blob_size = ?,
+                wrapped_key = ?, file_data = NULL
+            WHERE id = ? AND blob_ref IS ? AND wrapped_key IS ?
+              AND title_encrypted IS ? AND description_encrypted IS ?
+        ''', (title, desc, wm, phash, new_ref, size, new_wrapped,
+              art_id, old_ref, old_wrapped, old_title, old_desc))
+        if cursor.rowcount == 0:
+            print(f"  ⏭️ ID {art_id}: berubah selama re-encrypt, dilewati")
+            unused_refs += _new_blob_refs(result)
+            continue
+        old_refs.append(old_ref)
+        if derivatives:
+            old_refs += save_derivatives(conn, art_id, derivatives)
+        updated += 1
+    return updated, old_refs, unused_refs
+
+def cmd_reencrypt(args):
+    """Re-encrypt metadata & file semua karya dengan data key baru per artwork"""
+    # Baris lama tanpa wrapped key memakai DATA_KEY (atau --old-key-file)
+    legacy_key = load_key_file(args.old_key_file) if args.old_key_file else None
+
+    state = load_checkpoint(args.checkpoint, 'reencrypt')
+    last_id = state.get('last_id', 0)
+    count = state.get('count', 0)
+    # Baris gagal (key salah, metadata/blob rusak) dicatat & dilewati, tidak menghentikan resume
+    failed = state.get('failed', [])
+
+    query = '''
+        SELECT id, user_id, wrapped_key, title_encrypted, description_encrypted,
+               watermark_data, phash_encrypted, file_type, file_data, blob_ref
+        FROM artworks WHERE id > ? ORDER BY id
+    '''
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for rows in iter_rows(query, (last_id,), args.batch_size):
+            results = list(executor.map(_reencrypt_one, rows, [legacy_key] * len(rows)))
+            try:
+                with transaction() as conn:
+                    updated, old_refs, unused_refs = _save_reencrypted(conn, rows, results, failed)
+            except BaseException:
+                # Batch di-rollback: semua blob baru dari worker tidak terpakai
+                for _, result, _ in results:
+                    if result is not None:
+                        release_blobs(_new_blob_refs(result))
+                raise
+            # Setelah commit: blob lama (diganti) & blob baru yang tidak terpakai dihapus
+            release_blobs(old_refs + unused_refs)
+
+            count += updated
+            last_id = rows[-1][0]
+            save_checkpoint(args.checkpoint, 'reencrypt', {'last_id': last_id, 'count': count, 'failed': failed})
+            print(f"  🔁 {count} karya di-re-encrypt (sampai ID {last_id})")
+
+    print(f"✅ Re-encrypt selesai: {count} karya, {len(failed)} gagal")
+    return 0 if not failed else 1
+
+# === REWRAP (rotasi master key) ===
+def cmd_rewrap(args):
+    """Bungkus ulang data key yang masih memakai master key lama (tanpa menyentuh blob)"""
+    state = load_checkpoint(args.checkpoint, 'rewrap')
+    last_id = state.get('last_id', 0)
+    count = state.get('count', 0)
+
+    query = "SELECT id, user_id, wrapped_key FROM artworks WHERE id > ? AND wrapped_key IS NOT NULL ORDER BY id"
+    for rows in iter_rows(query, (last_id,), args.batch_size):
+        updates = [(rewrap_data_key(user_id, wrapped), art_id)
+                   for art_id, user_id, wrapped in rows if needs_rewrap(wrapped)]
+        with transaction() as conn:
+            conn.executemany("UPDATE artworks SET wrapped_key = ? WHERE id = ?", updates)
+        count += len(updates)
+        last_id = rows[-1][0]
+        save_checkpoint(args.checkpoint, 'rewrap', {'last_id': last_id, 'count': count})
+
+    print(f"✅ Rewrap selesai: {count} data key dibungkus ulang dengan master key aktif")
+    return 0
+
+# === VERIFY-ALL ===
+def _verify_one(row):
+    """Worker: bandingkan watermark tersimpan dengan hasil ekstraksi dari file"""
+    art_id, user_id, wrapped_key, watermark, watermark_config, file_data, blob_ref = row
+    try:
+        key = artwork_key(user_id, wrapped_key)
+        expected = decrypt_metadata(watermark, key)
+        image = decrypt_file(load_encrypted_file(file_data, blob_ref), key)
+        extracted = extract_stored_watermark(image, watermark_config, max_len=len(expected) + 1)
+        return art_id, user_id, extracted == expected, None
+    except Exception as e:
+        return art_id, user_id, False, str(e)
+
+def cmd_verify_all(args):
+    """Verifikasi watermark semua gambar terwatermark"""
+    state = load_checkpoint(args.checkpoint, 'verify-all')
+    last_id = state.get('last_id', 0)
+    valid = state.get('valid', 0)
+    invalid = state.get('invalid', [])
+
+    query = '''
+        SELECT id, user_id, wrapped_key, watermark_data, watermark_config, file_data, blob_ref
+        FROM artworks
+        WHERE id > ? AND file_type LIKE 'image%' AND watermark_data IS NOT NULL ORDER BY id
+    '''
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for rows in iter_rows(query, (last_id,), args.batch_size):
+            for art_id, user_id, ok, error in executor.map(_verify_one, rows):
+                if ok:
+                    valid += 1
+                else:
+                    invalid.append({'id': art_id, 'user_id': user_id, 'error': error})
+                    print(f"  ❌ ID {art_id} (user {user_id}): {error or 'watermark tidak cocok'}")
+            last_id = rows[-1][0]
+            save_checkpoint(args.checkpoint, 'verify-all',
+                            {'last_id': last_id, 'valid': valid, 'invalid': invalid})
+
+    print(f"✅ Verifikasi selesai: {valid} valid, {len(invalid)} tidak valid")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'valid': valid, 'invalid': invalid}, f, indent=2)
+        print(f"📄 Laporan: {args.report}")
+    return 0 if not invalid else 1
+
+# === MATCH (verifikasi 1:N) ===
+def _candidates_for_path(path):
+    """Worker: ekstraksi watermark + pHash (CPU) saja; lookup DB dilakukan di proses utama"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        return path, candidate_lookups(data), suspect_hash(data), None
+    except Exception as e:
+        return path, {}, None, str(e)
+
+def cmd_match(args):
+    """Cari pemilik setiap gambar yang dicurigai via index watermark_lookup (fallback: pHash mirip)"""
+    paths = []
+    for root, _, names in os.walk(args.directory):
+        for name in sorted(names):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.join(root, name))
+    print(f"🔎 {len(paths)} gambar akan dicocokkan")
+
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor, get_connection() as conn:
+        for path, lookups, phash, error in executor.map(_candidates_for_path, paths, chunksize=8):
+            rel = os.path.relpath(path, args.directory)
+            matches = [] if error else find_by_lookups(conn, lookups, args.user_id)
+            # Watermark rusak (resize/kompresi ulang): cari karya asli yang mirip secara visual
+            similar = [] if error or matches else find_similar(conn, phash, args.user_id)
+            results.append({'file': rel, 'matches': matches, 'similar': similar, 'error': error})
+            if matches:
+                ids = ', '.join(str(m['artwork_id']) for m in matches)
+                print(f"  ✅ {rel} → artwork {ids}")
+            elif similar:
+                ids = ', '.join(f"{m['artwork_id']} (jarak {m['distance']})" for m in similar)
+                print(f"  🧬 {rel} → mirip artwork {ids}")
+            else:
+                print(f"  ❌ {rel}: {error or 'tidak ada yang cocok'}")
+
+    matched = sum(1 for r in results if r['matches'])
+    similar = sum(1 for r in results if r['similar'])
+    print(f"✅ Pencocokan selesai: {matched} cocok, {similar} mirip (pHash), "
+          f"{len(results) - matched - similar} tidak cocok")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"📄 Laporan: {args.report}")
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="ArtCrypt CLI: import, export, re-encrypt, verifikasi massal")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help="Jumlah worker process")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Baris per fetchmany/commit")
+    parser.add_argument('--checkpoint', help="File checkpoint JSON untuk resume")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('import', help="Import pohon direktori karya")
+    p.add_argument('directory')
+    p.add_argument('--user-id', type=int, required=True)
+    p.add_argument('--description', default='')
+    p.add_argument('--watermark-preset', choices=list(WATERMARK_PRESETS), default=DEFAULT_WATERMARK_PRESET,
+                   help="Preset bit plane watermark untuk gambar")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser('export', help="Export library terdekripsi ke direktori atau .tar/.tar.gz")
+    p.add_argument('output')
+    p.add_argument('--user-id', type=int, required=True)
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser('reencrypt', help="Re-encrypt semua karya dengan data key baru per artwork")
+    p.add_argument('--old-key-file', help="Key baris lama tanpa wrapped key (default: DATA_KEY)")
+    p.set_defaults(func=cmd_reencrypt)
+
+    p = sub.add_parser('rewrap', help="Rotasi master key: bungkus ulang data key (set ARTCRYPT_OLD_MASTER_KEYS)")
+    p.set_defaults(func=cmd_rewrap)
+
+    p = sub.add_parser('verify-all', help="Verifikasi watermark semua gambar")
+    p.add_argument('--report', help="Simpan laporan JSON")
+    p.set_defaults(func=cmd_verify_all)
+
+    p = sub.add_parser('match', help="Verifikasi 1:N: cari pemilik gambar yang dicurigai")
+    p.add_argument('directory')
+    p.add_argument('--user-id', type=int, help="Batasi ke karya milik satu user")
+    p.add_argument('--report', help="Simpan laporan JSON")
+    p.set_defaults(func=cmd_match)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    init_db()
+    return args.func(args)
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,31 @@
+from connection import get_connection
+from crypto_utils import decrypt_file_range
+from blob_store import open_encrypted_file
+from key_manager import artwork_key
+
+# Pratinjau audio/video: cukup beberapa MB pertama, bukan seluruh file
+PREVIEW_BYTES = 2 * 1024 * 1024
+
+def decrypt_range(artwork_id, offset, length, user_id=None):
+    """
+    Dekripsi length byte file artwork mulai dari offset.
+    Hanya chunk yang mencakup range yang dibaca dari blob store dan didekripsi.
+    user_id: jika diisi, artwork harus milik user tersebut.
+    """
+    query = "SELECT user_id, file_data, blob_ref, wrapped_key FROM artworks WHERE id = ?"
+    params = [artwork_id]
+    if user_id is not None:
+        query += " AND user_id = ?"
+        params.append(user_id)
+    with get_connection() as conn:
+        row = conn.execute(query, params).fetchone()
+    if row is None:
+        raise KeyError(f"Artwork {artwork_id} tidak ditemukan")
+
+    owner_id, file_data, blob_ref, wrapped_key = row
+    with open_encrypted_file(file_data, blob_ref) as reader:
+        return decrypt_file_range(reader, offset, length, artwork_key(owner_id, wrapped_key))
+
+def sniff_file_header(artwork_id, user_id=None, length=16):
+    """Beberapa byte pertama file (mis. cek '%PDF-'), tanpa dekripsi penuh"""
+    return decrypt_range(artwork_id, 0, length, user_id)
@@ -0,0 +1,324 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from crypto_utils import (camellia_encrypt_bytes, camellia_decrypt_bytes, encrypt_metadata, decrypt_metadata,
+                          encrypt_file, decrypt_file, embed_watermark_bitplane, extract_watermark_bitplane,
+                          encrypt_username, encrypt_password, username_lookup_hash, verify_user, verify_user_row)
+from phash_index import perceptual_hash, MultiIndexHash, brute_force_nearest, PHASH_MAX_DISTANCE
+
+KB = 1024
+MB = 1024 * 1024
+
+# Profil ukuran: quick untuk cek cepat, full untuk baseline lengkap (1 KB – 500 MB)
+PROFILES = {
+    'quick': {
+        'camellia_sizes': [1 * KB, 64 * KB, 1 * MB],
+        'metadata_sizes': [64, 1 * KB, 16 * KB],
+        'file_sizes': [1 * KB, 64 * KB, 1 * MB, 16 * MB],
+        'image_sizes': [256, 1024],
+        'user_counts': [10, 100, 1000],
+        'phash_counts': [10000, 100000],
+    },
+    'full': {
+        'camellia_sizes': [1 * KB, 64 * KB, 1 * MB, 16 * MB],
+        'metadata_sizes': [64, 1 * KB, 16 * KB, 256 * KB],
+        'file_sizes': [1 * KB, 64 * KB, 1 * MB, 16 * MB, 100 * MB, 500 * MB],
+        'image_sizes': [256, 1024, 4096],
+        'user_counts': [10, 100, 1000, 10000],
+        'phash_counts': [10000, 100000, 1000000],
+    },
+}
+BIT_PLANE_SETS = [[0], [0, 1, 2]]
+WATERMARK_TEXT = "ArtCrypt-1-Benchmark"
+SEED = 1234
+
+def human_size(n):
+    for unit, size in (('MB', MB), ('KB', KB)):
+        if n >= size:
+            return f"{n // size}{unit}"
+    return f"{n}B"
+
+# === CASES ===
+# Setiap case: nama unik, setup() → fungsi tanpa argumen, jumlah byte yang diproses (untuk throughput).
+# Payload dibuat di setup(), hanya untuk case yang lolos --filter, dan dilepas setelah case selesai.
+def _case(name, setup, nbytes=None, **params):
+    return {'name': name, 'setup': setup, 'bytes': nbytes, 'params': params}
+
+def _rng(*key):
+    """RNG deterministik per payload (tidak bergantung urutan case yang dijalankan)"""
+    return np.random.default_rng([SEED, *key])
+
+def _random_bytes(size):
+    return _rng(size).integers(0, 256, size, dtype=np.uint8).tobytes()
+
+def _image_png(side):
+    arr = _rng(side).integers(0, 256, (side, side, 3), dtype=np.uint8)
+    out = BytesIO()
+    Image.fromarray(arr).save(out, format='PNG', compress_level=1)
+    return out.getvalue()
+
+def _users_table(count):
+    """Tabel users in-memory (format sama dengan DB) untuk login legacy vs lookup"""
+    conn = sqlite3.connect(':memory:')
+    conn.execute('''
+        CREATE TABLE users (id INTEGER PRIMARY KEY, username_encrypted TEXT,
+                            password_encrypted TEXT, username_lookup TEXT UNIQUE)
+    ''')
+    password = encrypt_password('password')
+    conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?)", [
+        (i, encrypt_username(f"user{i}"), password, username_lookup_hash(f"user{i}"))
+        for i in range(1, count + 1)
+    ])
+    return conn
+
+def _phash_entries(count):
+    """count pHash acak (64 bit) + query near-duplicate (3 bit berbeda dari salah satu hash)"""
+    hashes = _rng(count).integers(0, 2 ** 64, count, dtype=np.uint64).tolist()
+    query = hashes[count // 2] ^ 0b10101
+    return [(h, (i, 1)) for i, h in enumerate(hashes)], query
+
+# === SETUP ===
+def _camellia_decrypt_setup(size):
+    encrypted = camellia_encrypt_bytes(_random_bytes(size))
+    return lambda: camellia_decrypt_bytes(encrypted)
+
+def _decrypt_metadata_setup(size):
+    encrypted = encrypt_metadata('a' * size)
+    return lambda: decrypt_metadata(encrypted)
+
+def _decrypt_file_setup(size):
+    encrypted = encrypt_file(_random_bytes(size))
+    return lambda: decrypt_file(encrypted)
+
+def _extract_watermark_setup(side, planes):
+    marked = embed_watermark_bitplane(BytesIO(_image_png(side)), WATERMARK_TEXT, planes)
+    return lambda: extract_watermark_bitplane(marked, planes)
+
+def _phash_index_setup(count, params):
+    entries, query = _phash_entries(count)
+    index = MultiIndexHash()
+    for value, item in entries:
+        index.add(value, item)
+    index.nearest(query, stats=params)
+    return lambda: index.nearest(query)
+
+def _phash_brute_force_setup(count):
+    entries, query = _phash_entries(count)
+    return lambda: brute_force_nearest(entries, query)
+
+def _verify_user_setup(count):
+    rows = _users_table(count).execute("SELECT id, username_encrypted, password_encrypted FROM users").fetchall()
+    target = f"user{count}"  # kasus terburuk: user terakhir
+    return lambda: verify_user(target, 'password', rows)
+
+def _login_lookup_setup(count):
+    conn = _users_table(count)
+    lookup = username_lookup_hash(f"user{count}")
+    return lambda: verify_user_row('password', conn.execute(
+        "SELECT id, password_encrypted FROM users WHERE username_lookup = ?", (lookup,)).fetchone())
+
+def build_cases(profile):
+    sizes = PROFILES[profile]
+
+    for size in sizes['camellia_sizes']:
+        yield _case(f"camellia_encrypt_bytes/{human_size(size)}",
+                    lambda s=size: (lambda d=_random_bytes(s): camellia_encrypt_bytes(d)), size)
+        yield _case(f"camellia_decrypt_bytes/{human_size(size)}", lambda s=size: _camellia_decrypt_setup(s), size)
+
+    for size in sizes['metadata_sizes']:
+        yield _case(f"encrypt_metadata/{human_size(size)}",
+                    lambda s=size: (lambda t='a' * s: encrypt_metadata(t)), size)
+        yield _case(f"decrypt_metadata/{human_size(size)}", lambda s=size: _decrypt_metadata_setup(s), size)
+
+    for size in sizes['file_sizes']:
+        yield _case(f"encrypt_file/{human_size(size)}",
+                    lambda s=size: (lambda d=_random_bytes(s): encrypt_file(d)), size)
+        yield _case(f"decrypt_file/{human_size(size)}", lambda s=size: _decrypt_file_setup(s), size)
+
+    for side in sizes['image_sizes']:
+        for planes in BIT_PLANE_SETS:
+            label = ''.join(map(str, planes))
+            yield _case(f"embed_watermark_bitplane/{side}px/planes{label}",
+                        lambda s=side, b=planes: (
+                            lambda p=_image_png(s): embed_watermark_bitplane(BytesIO(p), WATERMARK_TEXT, b)),
+                        side * side * 3, side=side, bit_planes=planes)
+            yield _case(f"extract_watermark_bitplane/{side}px/planes{label}",
+                        lambda s=side, b=planes: _extract_watermark_setup(s, b),
+                        side * side * 3, side=side, bit_planes=planes)
+
+    for side in sizes['image_sizes']:
+        yield _case(f"perceptual_hash/{side}px",
+                    lambda s=side: (lambda p=_image_png(s): perceptual_hash(p)), side * side * 3, side=side)
+
+    # Pencarian gambar mirip: multi-index hashing vs scan linear semua hash
+    for count in sizes['phash_counts']:
+        case = _case(f"phash_multi_index/{count}_hashes", None, hashes=count, max_distance=PHASH_MAX_DISTANCE)
+        # setup mengisi params['candidates'] (jumlah hash yang dicek per query)
+        case['setup'] = lambda c=count, p=case['params']: _phash_index_setup(c, p)
+        yield case
+        yield _case(f"phash_brute_force/{count}_hashes", lambda c=count: _phash_brute_force_setup(c),
+                    hashes=count, max_distance=PHASH_MAX_DISTANCE)
+
+    for count in sizes['user_counts']:
+        yield _case(f"verify_user/{count}_users", lambda c=count: _verify_user_setup(c), users=count)
+        yield _case(f"login_lookup/{count}_users", lambda c=count: _login_lookup_setup(c), users=count)
+
+# === RUNNER ===
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def run_case(case, min_repeats, max_repeats, budget_s):
+    """Setup payload → warmup → ulangi sampai budget waktu (min/max repeat) → satu run dengan tracemalloc"""
+    fn = case['setup']()
+    fn()
+
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < max_repeats:
+        t0 = time.perf_counter_ns()
+        fn()
+        timings.append((time.perf_counter_ns() - t0) / 1e6)
+        if len(timings) >= min_repeats and time.perf_counter() - started >= budget_s:
+            break
+
+    # Puncak alokasi Python/NumPy (di luar pengukuran waktu karena tracemalloc memperlambat)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    fn()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    timings.sort()
+    p50 = percentile(timings, 50)
+    result = {
+        'params': case['params'],
+        'repeats': len(timings),
+        'mean_ms': sum(timings) / len(timings),
+        'p50_ms': p50,
+        'p95_ms': percentile(timings, 95),
+        'p99_ms': percentile(timings, 99),
+        'peak_mem_mb': peak / MB,
+    }
+    if case['bytes']:
+        result['bytes'] = case['bytes']
+        result['throughput_mb_s'] = (case['bytes'] / MB) / (p50 / 1000) if p50 else 0.0
+    return result
+
+def run_benchmarks(profile, name_filter=None, min_repeats=3, max_repeats=50, budget_s=1.0):
+    results = {}
+    for case in build_cases(profile):
+        if name_filter and name_filter not in case['name']:
+            continue
+        result = run_case(case, min_repeats, max_repeats, budget_s)
+        results[case['name']] = result
+        throughput = f"{result['throughput_mb_s']:9.1f} MB/s" if 'throughput_mb_s' in result else ' ' * 14
+        print(f"  {case['name']:<48} p50 {result['p50_ms']:10.3f} ms  p95 {result['p95_ms']:10.3f} ms"
+              f"  {throughput}  peak {result['peak_mem_mb']:8.1f} MB")
+    return {
+        'meta': {
+            'profile': profile,
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+# === COMPARE ===
+def compare(baseline, current, threshold=0.2, mem_threshold=0.2):
+    """
+    Bandingkan dua hasil benchmark. Regresi: p50 atau peak memori naik melebihi threshold (rasio).
+    Return list nama case yang regresi.
+    """
+    regressions = []
+    for name, base in baseline['results'].items():
+        cur = current['results'].get(name)
+        if cur is None:
+            continue
+        time_ratio = cur['p50_ms'] / base['p50_ms'] if base['p50_ms'] else 1.0
+        # Memori < 1 MB terlalu berisik untuk dibandingkan secara rasio
+        mem_ratio = cur['peak_mem_mb'] / base['peak_mem_mb'] if base['peak_mem_mb'] >= 1 else 1.0
+        regressed = time_ratio > 1 + threshold or mem_ratio > 1 + mem_threshold
+        marker = '❌' if regressed else ('🚀' if time_ratio < 1 - threshold else '✅')
+        print(f"  {marker} {name:<48} p50 {base['p50_ms']:10.3f} → {cur['p50_ms']:10.3f} ms"
+              f" ({time_ratio:5.2f}x)  mem {base['peak_mem_mb']:7.1f} → {cur['peak_mem_mb']:7.1f} MB")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+def save_results(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"📄 Hasil disimpan: {path}")
+
+def cmd_run(args):
+    print(f"⏱️ Benchmark profil '{args.profile}'")
+    results = run_benchmarks(args.profile, args.filter, args.min_repeats, args.max_repeats, args.budget)
+    if args.output:
+        save_results(args.output, results)
+    if args.compare:
+        print(f"📊 Dibandingkan dengan {args.compare}")
+        regressions = compare(load_results(args.compare), results, args.threshold, args.mem_threshold)
+        if regressions:
+            print(f"❌ {len(regressions)} regresi melebihi threshold")
+            return 1
+        print("✅ Tidak ada regresi")
+    return 0
+
+def cmd_compare(args):
+    regressions = compare(load_results(args.baseline), load_results(args.current),
+                          args.threshold, args.mem_threshold)
+    if regressions:
+        print(f"❌ {len(regressions)} regresi melebihi threshold")
+        return 1
+    print("✅ Tidak ada regresi")
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark hot path crypto_utils (baseline JSON + deteksi regresi)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def add_thresholds(p):
+        p.add_argument('--threshold', type=float, default=0.2, help="Batas kenaikan p50 (0.2 = +20%%)")
+        p.add_argument('--mem-threshold', type=float, default=0.2, help="Batas kenaikan peak memori")
+
+    p = sub.add_parser('run', help="Jalankan benchmark")
+    p.add_argument('--profile', choices=list(PROFILES), default='quick')
+    p.add_argument('--filter', help="Hanya case yang namanya mengandung teks ini")
+    p.add_argument('--output', '-o', help="Simpan hasil JSON (baseline)")
+    p.add_argument('--compare', help="Bandingkan dengan baseline JSON; exit 1 jika regresi")
+    p.add_argument('--min-repeats', type=int, default=3)
+    p.add_argument('--max-repeats', type=int, default=50)
+    p.add_argument('--budget', type=float, default=1.0, help="Detik per case (setelah min repeat)")
+    add_thresholds(p)
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser('compare', help="Bandingkan dua file hasil")
+    p.add_argument('baseline')
+    p.add_argument('current')
+    add_thresholds(p)
+    p.set_defaults(func=cmd_compare)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+from metrics import timed
+
+BLOB_DIR = os.environ.get('ARTCRYPT_BLOB_DIR', 'blobs')
+COPY_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+class BlobStore:
+    """Interface blob store: key = SHA-256 (hex) dari isi blob terenkripsi (integritas + nama unik)"""
+
+    def open_writer(self):
+        raise NotImplementedError
+
+    def open(self, key):
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    @timed('blob.put', 'bytes_written', arg_index=1)
+    def put(self, data):
+        """Simpan bytes → key"""
+        writer = self.open_writer()
+        try:
+            writer.write(data)
+            return writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+
+    def put_stream(self, reader, chunk_size=COPY_CHUNK_SIZE):
+        """Salin stream (file-like) ke store per chunk → key"""
+        def fill(writer):
+            while True:
+                chunk = reader.read(chunk_size)
+                if not chunk:
+                    break
+                writer.write(chunk)
+        return self.put_with(fill)[0]
+
+    def put_with(self, fill):
+        """
+        fill(writer) menulis isi blob langsung ke writer (mis. enkripsi streaming),
+        tanpa menampung ciphertext utuh di memori. Return (key, ukuran blob).
+        """
+        writer = self.open_writer()
+        try:
+            fill(writer)
+            size = writer.size
+            return writer.commit(), size
+        except BaseException:
+            writer.abort()
+            raise
+
+    @timed('blob.get', 'bytes_read', measure='result')
+    def get(self, key):
+        """Baca seluruh blob → bytes"""
+        with self.open(key) as f:
+            return f.read()
+
+class LocalBlobWriter:
+    """Tulis ke file temp sambil menghitung hash; commit() = rename atomik ke path final"""
+
+    def __init__(self, store):
+        self.store = store
+        os.makedirs(store.tmp_dir, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=store.tmp_dir, suffix='.part')
+        self.file = os.fdopen(fd, 'wb')
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.hasher.update(data)
+        self.file.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def commit(self):
+        """Flush + fsync → rename ke path berdasarkan hash. Return key."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+        key = self.hasher.hexdigest()
+        final_path = self.store.path_for(key)
+        if os.path.exists(final_path):
+            # Key sama = isi identik (mis. put ulang ciphertext yang sama)
+            os.remove(self.tmp_path)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(self.tmp_path, final_path)
+        return key
+
+    def abort(self):
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+class LocalBlobStore(BlobStore):
+    """Backend filesystem lokal: root/ab/cd/<sha256>"""
+
+    def __init__(self, root=BLOB_DIR):
+        self.root = root
+        self.tmp_dir = os.path.join(root, 'tmp')
+
+    def path_for(self, key):
+        if len(key) != 64 or any(c not in '0123456789abcdef' for c in key):
+            raise ValueError(f"Blob key tidak valid: {key!r}")
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def open_writer(self):
+        return LocalBlobWriter(self)
+
+    def open(self, key):
+        return open(self.path_for(key), 'rb')
+
+    def exists(self, key):
+        return os.path.exists(self.path_for(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path_for(key))
+        except FileNotFoundError:
+            pass
+
+_default_store = None
+
+def get_blob_store():
+    """Blob store default (filesystem lokal di ARTCRYPT_BLOB_DIR)"""
+    global _default_store
+    if _default_store is None:
+        _default_store = LocalBlobStore()
+    return _default_store
+
+def load_encrypted_file(file_data, blob_ref, store=None):
+    """Ambil data file terenkripsi: dari blob store jika ada referensi, selain itu inline"""
+    if blob_ref:
+        return (store or get_blob_store()).get(blob_ref)
+    return file_data
+
+def open_encrypted_file(file_data, blob_ref, store=None):
+    """Seperti load_encrypted_file, tetapi return file-like seekable (blob tidak dibaca utuh)"""
+    if blob_ref:
+        return (store or get_blob_store()).open(blob_ref)
+    if isinstance(file_data, str):
+        file_data = file_data.encode()
+    return BytesIO(file_data)
+
+def release_blob(blob_ref, store=None):
+    """
+    Hapus blob milik baris yang dihapus/diganti. Ciphertext selalu memakai nonce acak,
+    jadi setiap upload menghasilkan blob unik (tidak ada dedup, tidak perlu hitung referensi).
+    """
+    if blob_ref:
+        (store or get_blob_store()).delete(blob_ref)
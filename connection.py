@@ -1,20 +1,312 @@
+import os
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
+import metrics
+
+DB_PATH = os.environ.get('ARTCRYPT_DB', 'artcrypt.db')
+POOL_SIZE = int(os.environ.get('ARTCRYPT_DB_POOL_SIZE', '8'))
+POOL_TIMEOUT = 30  # detik menunggu koneksi bebas
+BUSY_TIMEOUT_MS = 5000
+
+# PRAGMA per koneksi (WAL: pembaca tidak memblokir penulis)
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",     # ~16 MB page cache
+    "PRAGMA mmap_size = 268435456",   # 256 MB
+    "PRAGMA temp_store = MEMORY",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+)
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3.Connection yang close()-nya mengembalikan koneksi ke pool"""
+
+    pool = None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def really_close(self):
+        sqlite3.Connection.close(self)
+
+def _sql_timer(sql):
+    """Timer per jenis statement (sql.select, sql.insert, ...); detail = SQL ringkas untuk log lambat"""
+    statement = ' '.join(sql.split())
+    return metrics.timer('sql.' + statement.split(' ', 1)[0].lower(), statement[:160])
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        with _sql_timer(sql):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with _sql_timer(sql):
+            return super().executemany(sql, seq_of_parameters)
+
+class InstrumentedConnection(PooledConnection):
+    """PooledConnection yang mencatat durasi SQL (hanya dipakai jika ARTCRYPT_METRICS=1)"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+# Metrics nonaktif: koneksi biasa tanpa lapisan tambahan
+CONNECTION_CLASS = InstrumentedConnection if metrics.ENABLED else PooledConnection
+
+def _open_connection(path, factory=sqlite3.Connection):
+    conn = sqlite3.connect(path, check_same_thread=False,
+                           timeout=BUSY_TIMEOUT_MS / 1000, factory=factory)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+class ConnectionPool:
+    """Pool koneksi SQLite thread-safe (dipakai bersama oleh thread worker Streamlit)"""
+
+    def __init__(self, path=DB_PATH, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                conn = _open_connection(self.path, factory=CONNECTION_CLASS)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            conn.pool = self
+            return conn
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError("Pool koneksi database habis (timeout)")
+
+    def release(self, conn):
+        # Transaksi yang tidak di-commit tidak boleh bocor ke pemakai berikutnya
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.really_close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.really_close()
+            with self._lock:
+                self._created -= 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+# Koneksi SQLite tidak boleh dipakai lintas fork: child (worker upload) membuka pool sendiri.
+# Pool milik parent tetap direferensikan agar GC di child tidak menutup handle parent.
+_forked_pools = []
+
+def _reset_after_fork():
+    global _pool, _pool_lock, _init_lock, _init_done
+    if _pool is not None:
+        _forked_pools.append(_pool)
+    _pool = None
+    # Lock bisa sedang dipegang thread parent saat fork (thread itu tidak ada di child)
+    _pool_lock = threading.Lock()
+    _init_lock = threading.Lock()
+    _init_done = False
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
 
 def create_connection():
-    return sqlite3.connect('artcrypt.db', check_same_thread=False)
+    """Ambil koneksi dari pool; conn.close() mengembalikannya ke pool"""
+    return get_pool().acquire()
 
-def init_db():
+@contextmanager
+def get_connection():
+    """with get_connection() as conn: ... (selalu dikembalikan ke pool)"""
     conn = create_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+@contextmanager
+def transaction():
+    """with transaction() as conn: ... → commit jika sukses, rollback jika error, lalu close"""
+    conn = create_connection()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def _column_names(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in cursor.fetchall()}
+
+def _add_column(cursor, table, column, decl):
+    """ALTER TABLE ADD COLUMN jika kolom belum ada (migrasi DB lama)"""
+    if column not in _column_names(cursor, table):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def migrate_username_lookup(conn):
+    """Tambah kolom users.username_lookup (HMAC username) + unique index, lalu isi baris lama"""
+    from crypto_utils import camellia_decrypt_bytes, username_lookup_hash
+
+    cursor = conn.cursor()
+    _add_column(cursor, 'users', 'username_lookup', 'TEXT')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username_lookup
+        ON users (username_lookup)
+    ''')
+
+    # Backfill baris lama (satu kali dekripsi per user, hanya saat migrasi)
+    seen = set()
+    cursor.execute("SELECT username_lookup FROM users WHERE username_lookup IS NOT NULL")
+    seen.update(row[0] for row in cursor.fetchall())
+    cursor.execute("SELECT id, username_encrypted FROM users WHERE username_lookup IS NULL ORDER BY id")
+    for user_id, user_enc in cursor.fetchall():
+        try:
+            lookup = username_lookup_hash(camellia_decrypt_bytes(user_enc).decode())
+        except Exception:
+            continue
+        # Username duplikat lama: id terkecil yang dipertahankan (sama seperti urutan scan lama)
+        if lookup in seen:
+            continue
+        seen.add(lookup)
+        conn.execute("UPDATE users SET username_lookup = ? WHERE id = ?", (lookup, user_id))
+
+def migrate_artwork_sizes(conn):
+    """Isi blob_size (ukuran terenkripsi) & created_at untuk baris lama, cukup via SQL"""
+    conn.execute('''
+        UPDATE artworks SET blob_size = LENGTH(file_data)
+        WHERE blob_size IS NULL AND file_data IS NOT NULL
+    ''')
+    # Waktu upload baris lama tidak diketahui: pakai waktu migrasi
+    conn.execute("UPDATE artworks SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+
+def migrate_watermark_lookup(conn):
+    """Isi artworks.watermark_lookup (HMAC watermark plaintext) untuk baris lama, sekali saat migrasi"""
+    from crypto_utils import decrypt_metadata, watermark_lookup_hash
+    from key_manager import artwork_key
+
+    rows = conn.execute('''
+        SELECT id, user_id, wrapped_key, watermark_data FROM artworks
+        WHERE watermark_data IS NOT NULL AND watermark_lookup IS NULL
+    ''').fetchall()
+    updates = []
+    for art_id, user_id, wrapped_key, watermark in rows:
+        try:
+            text = decrypt_metadata(watermark, artwork_key(user_id, wrapped_key))
+        except Exception:
+            continue
+        updates.append((watermark_lookup_hash(text), art_id))
+    conn.executemany("UPDATE artworks SET watermark_lookup = ? WHERE id = ?", updates)
+
+def backfill_file_sizes(batch_size=50):
+    """Isi artworks.file_size (ukuran plaintext) untuk baris lama. Return jumlah baris."""
+    from crypto_utils import file_plaintext_size
+    from blob_store import load_encrypted_file
+    from key_manager import artwork_key
+
+    updated = 0
+    last_id = 0
+    while True:
+        with get_connection() as conn:
+            ids = [row[0] for row in conn.execute('''
+                SELECT id FROM artworks WHERE id > ? AND file_size IS NULL
+                ORDER BY id LIMIT ?
+            ''', (last_id, batch_size))]
+        if not ids:
+            return updated
+
+        sizes = []
+        for art_id in ids:
+            with get_connection() as conn:
+                user_id, wrapped_key, file_data, blob_ref = conn.execute(
+                    "SELECT user_id, wrapped_key, file_data, blob_ref FROM artworks WHERE id = ?", (art_id,)
+                ).fetchone()
+            try:
+                key = artwork_key(user_id, wrapped_key)
+                sizes.append((file_plaintext_size(load_encrypted_file(file_data, blob_ref), key), art_id))
+            except Exception as e:
+                print(f"  ⚠️ ID {art_id}: {e}")
+
+        with transaction() as conn:
+            conn.executemany("UPDATE artworks SET file_size = ? WHERE id = ?", sizes)
+        updated += len(sizes)
+        last_id = ids[-1]
+
+_init_lock = threading.Lock()
+_init_done = False
+
+def init_db(force=False):
+    """Buat/migrasi skema. Hanya dijalankan sekali per proses kecuali force=True."""
+    global _init_done
+    with _init_lock:
+        if _init_done and not force:
+            return
+        with transaction() as conn:
+            # Kunci tulis sejak awal: proses lain (worker upload) yang init bersamaan menunggu,
+            # jadi cek kolom → ALTER TABLE tidak balapan
+            conn.execute("BEGIN IMMEDIATE")
+            _create_schema(conn)
+        _init_done = True
+
+def _create_schema(conn):
     cursor = conn.cursor()
-    
+
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             username_encrypted TEXT UNIQUE,
-            password_encrypted TEXT
+            password_encrypted TEXT,
+            username_lookup TEXT
         )
     ''')
-    
+
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS artworks (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -24,9 +316,135 @@ def init_db():
             file_data BLOB,
             file_type TEXT,
             watermark_data TEXT,
+            blob_ref TEXT,
+            blob_size INTEGER,
+            file_size INTEGER,
+            created_at TEXT,
+            wrapped_key BLOB,
+            watermark_lookup TEXT,
+            watermark_config TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Blob store: file_data inline (lama) atau referensi SHA-256 ke blob store
+    _add_column(cursor, 'artworks', 'blob_ref', 'TEXT')
+    _add_column(cursor, 'artworks', 'blob_size', 'INTEGER')
+    # Blob tidak pernah dipakai bersama (nonce acak per upload): index hitung-referensi tidak diperlukan
+    cursor.execute("DROP INDEX IF EXISTS idx_artworks_blob_ref")
+
+    # Metadata ukuran & waktu: dashboard tidak perlu membaca file_data
+    _add_column(cursor, 'artworks', 'file_size', 'INTEGER')    # ukuran plaintext
+    _add_column(cursor, 'artworks', 'created_at', 'TEXT')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_artworks_user_type ON artworks (user_id, file_type)")
+    # Keyset pagination galeri (user_id = ? AND id < ? ORDER BY id DESC) tanpa temp B-tree
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_artworks_user_id ON artworks (user_id, id)")
+    migrate_artwork_sizes(conn)
+
+    # Data key per artwork (dibungkus KEK user); NULL = baris lama memakai DATA_KEY
+    _add_column(cursor, 'artworks', 'wrapped_key', 'BLOB')
+
+    # Index verifikasi 1:N: HMAC watermark plaintext → artwork
+    _add_column(cursor, 'artworks', 'watermark_lookup', 'TEXT')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_artworks_watermark_lookup ON artworks (watermark_lookup)")
+    migrate_watermark_lookup(conn)
+
+    # Turunan terenkripsi (thumbnail/preview) untuk galeri: blob terpisah per jenis
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS artwork_derivatives (
+            artwork_id INTEGER,
+            kind TEXT,
+            blob_ref TEXT,
+            blob_size INTEGER,
+            PRIMARY KEY (artwork_id, kind),
+            FOREIGN KEY (artwork_id) REFERENCES artworks (id)
+        )
+    ''')
+    cursor.execute("DROP INDEX IF EXISTS idx_artwork_derivatives_blob_ref")
+
+    # Config watermark per artwork (JSON: versi, bit planes, panjang payload); NULL = LSB + null terminator
+    _add_column(cursor, 'artworks', 'watermark_config', 'TEXT')
+
+    # Perceptual hash gambar (phash_index.py): pHash terenkripsi data key + bentuk ter-blind untuk multi-index.
+    # Index parsial covering: memuat multi-index tanpa membaca baris artwork (file_data inline)
+    _add_column(cursor, 'artworks', 'phash_encrypted', 'BLOB')
+    _add_column(cursor, 'artworks', 'phash_index', 'BLOB')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_artworks_phash ON artworks (id, user_id, phash_index)
+        WHERE phash_index IS NOT NULL
+    ''')
+    # Versi multi-index di memori: dinaikkan trigger (baca satu baris per pencarian, bukan scan index).
+    # inserts = baris baru ber-phash (dimuat inkremental), changes = update/hapus (bangun ulang)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS phash_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            inserts INTEGER NOT NULL DEFAULT 0,
+            changes INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO phash_version (id) VALUES (1)")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_artworks_phash_insert AFTER INSERT ON artworks
+        WHEN NEW.phash_index IS NOT NULL
+        BEGIN UPDATE phash_version SET inserts = inserts + 1 WHERE id = 1; END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_artworks_phash_update AFTER UPDATE OF phash_index, user_id ON artworks
+        WHEN OLD.phash_index IS NOT NEW.phash_index
+          OR (NEW.phash_index IS NOT NULL AND OLD.user_id IS NOT NEW.user_id)
+        BEGIN UPDATE phash_version SET changes = changes + 1 WHERE id = 1; END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_artworks_phash_delete AFTER DELETE ON artworks
+        WHEN OLD.phash_index IS NOT NULL
+        BEGIN UPDATE phash_version SET changes = changes + 1 WHERE id = 1; END
+    ''')
+
+    # Blind index pencarian judul/deskripsi (search_index.py): hanya token HMAC, tanpa plaintext
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS artwork_search_tokens (
+            token BLOB,
+            artwork_id INTEGER,
+            PRIMARY KEY (token, artwork_id),
+            FOREIGN KEY (artwork_id) REFERENCES artworks (id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_artwork_search_tokens_artwork ON artwork_search_tokens (artwork_id)")
+
+    # Antrian job upload (upload_jobs.py): input terenkripsi di blob store, metadata terenkripsi
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS upload_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            idempotency_key TEXT,
+            status TEXT,
+            file_type TEXT,
+            title_encrypted BLOB,
+            description_encrypted BLOB,
+            wrapped_key BLOB,
+            bit_planes TEXT,
+            input_ref TEXT,
+            input_size INTEGER,
+            stage_bytes TEXT,
+            attempts INTEGER DEFAULT 0,
+            max_attempts INTEGER,
+            run_after REAL,
+            locked_by TEXT,
+            locked_at REAL,
+            artwork_id INTEGER,
+            error TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            UNIQUE (user_id, idempotency_key),
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
     ''')
-    
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_upload_jobs_status ON upload_jobs (status, run_after)")
+    # Byte yang disalin/ditulis per tahap upload (JSON), untuk memantau jalur low-copy
+    _add_column(cursor, 'upload_jobs', 'stage_bytes', 'TEXT')
+
+    migrate_username_lookup(conn)
+
+if __name__ == "__main__":
+    init_db()
+    print(f"✅ file_size diisi untuk {backfill_file_sizes()} artwork")
@@ -1,19 +1,22 @@
 import base64
+import json
 import os
+import struct
+import unicodedata
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives import hashes, hmac
+from cryptography.hazmat.primitives import padding
 from Crypto.Cipher import AES
 from PIL import Image
 import numpy as np
 from io import BytesIO
-
-MASTER_KEY = b'0123456789ABCDEF0123456789ABCDEF'  # 32 bytes
+from metrics import timed
+from key_manager import AUTH_KEY, DATA_KEY, get_aesgcm, hmac_for
 
 # === CORE CAMELIA FUNCTIONS ===
-def camellia_encrypt_bytes(data):
+def camellia_encrypt_bytes(data, key=None):
     """Encrypt bytes using Camellia CBC → Base64"""
     iv = os.urandom(16)
-    cipher = Cipher(algorithms.Camellia(MASTER_KEY), modes.CBC(iv))
+    cipher = Cipher(algorithms.Camellia(key or AUTH_KEY), modes.CBC(iv))
     encryptor = cipher.encryptor()
     
     # PKCS7 padding
@@ -23,12 +26,12 @@ def camellia_encrypt_bytes(data):
     encrypted = encryptor.update(data) + encryptor.finalize()
     return base64.b64encode(iv + encrypted).decode()
 
-def camellia_decrypt_bytes(encrypted_data):
+def camellia_decrypt_bytes(encrypted_data, key=None):
     """Base64 decode → Camellia CBC decrypt → return bytes"""
     data = base64.b64decode(encrypted_data)
     iv, encrypted = data[:16], data[16:]
     
-    cipher = Cipher(algorithms.Camellia(MASTER_KEY), modes.CBC(iv))
+    cipher = Cipher(algorithms.Camellia(key or AUTH_KEY), modes.CBC(iv))
     decryptor = cipher.decryptor()
     
     decrypted = decryptor.update(encrypted) + decryptor.finalize()
@@ -44,31 +47,61 @@ def encrypt_username(username):
 def encrypt_password(password):
     """Password → HMAC-SHA384 → Camellia CBC encrypt → Base64"""
     # HMAC-SHA384
-    h = hmac.HMAC(MASTER_KEY, hashes.SHA384())
+    h = hmac_for(AUTH_KEY, 'sha384')
     h.update(password.encode())
     hash_pw = h.finalize()
     
     # Camellia CBC encrypt
     return camellia_encrypt_bytes(hash_pw)
 
+def normalize_username(username):
+    """Normalisasi username (Unicode NFC) sebelum di-hash untuk lookup"""
+    return unicodedata.normalize('NFC', username)
+
+def username_lookup_hash(username):
+    """Username → normalisasi → HMAC-SHA256 → hex (deterministik, untuk index lookup)"""
+    h = hmac_for(AUTH_KEY, 'sha256')
+    h.update(b'username-lookup:' + normalize_username(username).encode())
+    return h.finalize().hex()
+
+def watermark_lookup_hash(watermark_text):
+    """Watermark plaintext → HMAC-SHA256 → hex (index verifikasi 1:N tanpa dekripsi watermark_data)"""
+    h = hmac_for(AUTH_KEY, 'sha256')
+    h.update(b'watermark-lookup:' + watermark_text.encode())
+    return h.finalize().hex()
+
+@timed('auth.verify_password')
+def verify_password(input_pass, pass_enc):
+    """Password: HMAC input → compare with decrypted stored hash"""
+    h = hmac_for(AUTH_KEY, 'sha384')
+    h.update(input_pass.encode())
+    hash_input = h.finalize()
+    
+    # Decrypt stored password hash
+    decrypted_pass = camellia_decrypt_bytes(pass_enc)
+    return hash_input == decrypted_pass
+
+def verify_user_row(input_pass, user_row):
+    """Login via lookup: satu baris (id, password_encrypted) hasil query username_lookup"""
+    if not user_row:
+        return None
+    user_id, pass_enc = user_row
+    try:
+        if verify_password(input_pass, pass_enc):
+            return user_id
+    except Exception:
+        pass
+    return None
+
 def verify_user(input_user, input_pass, db_users):
-    """Login: Base64 decode → Camellia decrypt → compare"""
+    """Login (legacy, full scan): Base64 decode → Camellia decrypt → compare"""
     for user_id, user_enc, pass_enc in db_users:
         try:
             # Decrypt username
             decrypted_user = camellia_decrypt_bytes(user_enc).decode()
             
-            if decrypted_user == input_user:
-                # Verify password: HMAC input → compare with decrypted stored hash
-                h = hmac.HMAC(MASTER_KEY, hashes.SHA384())
-                h.update(input_pass.encode())
-                hash_input = h.finalize()
-                
-                # Decrypt stored password hash
-                decrypted_pass = camellia_decrypt_bytes(pass_enc)
-                
-                if hash_input == decrypted_pass:
-                    return user_id
+            if decrypted_user == input_user and verify_password(input_pass, pass_enc):
+                return user_id
         except Exception:
             continue
     return None
@@ -89,57 +122,95 @@ def caesar_decrypt(text, shift=3):
     """Caesar cipher decryption"""
     return caesar_encrypt(text, -shift)
 
-def aes_gcm_encrypt(data):
+def aes_gcm_encrypt(data, key=None):
     """AES-128-GCM encryption → Base64"""
     if isinstance(data, str):
         data = data.encode()
     
     iv = os.urandom(12)
-    cipher = AES.new(MASTER_KEY[:16], AES.MODE_GCM, nonce=iv)
+    cipher = AES.new((key or DATA_KEY)[:16], AES.MODE_GCM, nonce=iv)
     encrypted, tag = cipher.encrypt_and_digest(data)
     return base64.b64encode(iv + tag + encrypted).decode()
 
-def aes_gcm_decrypt(encrypted_data):
+def aes_gcm_decrypt(encrypted_data, key=None):
     """Base64 decode → AES-128-GCM decryption → bytes"""
     data = base64.b64decode(encrypted_data)
     iv, tag, encrypted = data[:12], data[12:28], data[28:]
-    cipher = AES.new(MASTER_KEY[:16], AES.MODE_GCM, nonce=iv)
+    cipher = AES.new((key or DATA_KEY)[:16], AES.MODE_GCM, nonce=iv)
     return cipher.decrypt_and_verify(encrypted, tag)
 
-def encrypt_metadata(text):
-    """Metadata: Caesar → AES-128-GCM → Camellia CBC → Base64"""
+def encrypt_metadata_legacy(text, key=None):
+    """Metadata (format lama): Caesar → AES-128-GCM → Camellia CBC → Base64"""
+    key = key or DATA_KEY
     # 1. Caesar Cipher
     caesar_text = caesar_encrypt(text)
     # 2. AES-128-GCM
-    aes_encrypted = aes_gcm_encrypt(caesar_text)
+    aes_encrypted = aes_gcm_encrypt(caesar_text, key)
     # 3. Camellia CBC
-    return camellia_encrypt_bytes(aes_encrypted.encode())
+    return camellia_encrypt_bytes(aes_encrypted.encode(), key)
 
-def decrypt_metadata(encrypted_data):
-    """Metadata: Base64 decode → Camellia CBC decrypt → AES-128-GCM decrypt → Caesar decrypt"""
+def decrypt_metadata_legacy(encrypted_data, key=None):
+    """Metadata (format lama): Base64 decode → Camellia CBC decrypt → AES-128-GCM decrypt → Caesar decrypt"""
+    key = key or DATA_KEY
     # 1. Camellia CBC decrypt
-    camellia_decrypted = camellia_decrypt_bytes(encrypted_data).decode()
+    camellia_decrypted = camellia_decrypt_bytes(encrypted_data, key).decode()
     # 2. AES-128-GCM decrypt
-    aes_decrypted = aes_gcm_decrypt(camellia_decrypted)
+    aes_decrypted = aes_gcm_decrypt(camellia_decrypted, key)
     # 3. Caesar decrypt
     return caesar_decrypt(aes_decrypted.decode())
 
+# === METADATA ENVELOPE (versioned) ===
+# Format v2 (BLOB): version (1) | suite (1) | nonce (12) | ciphertext + tag (16)
+# Header (version + suite) ikut diautentikasi sebagai AAD.
+# Baris lama disimpan sebagai TEXT Base64, jadi versi dibedakan dari tipe datanya.
+METADATA_V2 = 2
+SUITE_AES256_GCM = 1
+METADATA_SUITES = {SUITE_AES256_GCM: 'AES-256-GCM'}
+
+def is_metadata_envelope(encrypted_data):
+    """True jika metadata memakai envelope v2 (bukan Base64 tiga lapis)"""
+    return isinstance(encrypted_data, (bytes, bytearray, memoryview)) and \
+        len(encrypted_data) > 0 and encrypted_data[0] == METADATA_V2
+
+@timed('crypto.encrypt_metadata', 'bytes_encrypted')
+def encrypt_metadata(text, suite=SUITE_AES256_GCM, key=None):
+    """Metadata: AES-256-GCM satu lapis (AEAD) → envelope v2 (bytes)"""
+    if suite not in METADATA_SUITES:
+        raise ValueError(f"Suite metadata tidak dikenal: {suite}")
+    header = bytes([METADATA_V2, suite])
+    nonce = os.urandom(12)
+    ciphertext = get_aesgcm(key or DATA_KEY).encrypt(nonce, text.encode(), header)
+    return header + nonce + ciphertext
+
+@timed('crypto.decrypt_metadata', 'bytes_decrypted', measure='result')
+def decrypt_metadata(encrypted_data, key=None):
+    """Metadata: envelope v2 (AES-256-GCM) atau format lama tiga lapis → text"""
+    if not is_metadata_envelope(encrypted_data):
+        return decrypt_metadata_legacy(encrypted_data, key)
+    
+    data = bytes(encrypted_data)
+    suite = data[1]
+    if suite != SUITE_AES256_GCM:
+        raise ValueError(f"Suite metadata tidak dikenal: {suite}")
+    header, nonce, ciphertext = data[:2], data[2:14], data[14:]
+    return get_aesgcm(key or DATA_KEY).decrypt(nonce, ciphertext, header).decode()
+
 # === FILE ENCRYPTION (AES-CTR) ===
-def aes_ctr_encrypt(data):
+def aes_ctr_encrypt(data, key=None):
     """AES-128-CTR encryption → Base64"""
     # Nonce 8 bytes + Counter 8 bytes = 16 bytes total
     nonce = os.urandom(8)
 
     # Buat cipher AES-128-CTR
     # Format: nonce (8 bytes) akan digabung dengan counter (8 bytes) secara internal
-    cipher = AES.new(MASTER_KEY[:16], AES.MODE_CTR, nonce=nonce)
+    cipher = AES.new((key or DATA_KEY)[:16], AES.MODE_CTR, nonce=nonce)
     
     # Encrypt data (CTR mode tidak butuh padding)
     ciphertext = cipher.encrypt(data)
     
     return base64.b64encode(nonce + ciphertext).decode()
 
-def aes_ctr_decrypt(encrypted_data):
+def aes_ctr_decrypt(encrypted_data, key=None):
     """Base64 decode → AES-CTR decryption → bytes"""
     data = base64.b64decode(encrypted_data)
     
@@ -147,103 +218,658 @@ def aes_ctr_decrypt(encrypted_data):
     nonce, ciphertext = data[:8], data[8:]
     
     # Buat cipher AES-CTR dengan nonce yang sama
-    cipher = AES.new(MASTER_KEY[:16], AES.MODE_CTR, nonce=nonce)
+    cipher = AES.new((key or DATA_KEY)[:16], AES.MODE_CTR, nonce=nonce)
     
     # Decrypt data
     return cipher.decrypt(ciphertext)
 
-def encrypt_file(file_data):
-    """File: AES-128-CTR → Camellia CBC → Base64"""
+def encrypt_file_legacy(file_data, key=None):
+    """File (format lama): AES-128-CTR → Base64 → Camellia CBC → Base64"""
+    key = key or DATA_KEY
     # 1. AES-CTR encrypt
-    aes_encrypted = aes_ctr_encrypt(file_data)
+    aes_encrypted = aes_ctr_encrypt(file_data, key)
     # 2. Camellia CBC encrypt
-    return camellia_encrypt_bytes(aes_encrypted.encode())
+    return camellia_encrypt_bytes(aes_encrypted.encode(), key)
 
-def decrypt_file(encrypted_data):
-    """File: Base64 decode → Camellia CBC decrypt → AES-CTR decrypt"""
+def decrypt_file_legacy(encrypted_data, key=None):
+    """File (format lama): Base64 decode → Camellia CBC decrypt → AES-CTR decrypt"""
+    key = key or DATA_KEY
     # 1. Camellia CBC decrypt
-    camellia_decrypted = camellia_decrypt_bytes(encrypted_data).decode()
+    camellia_decrypted = camellia_decrypt_bytes(encrypted_data, key).decode()
     # 2. AES-CTR decrypt
-    return aes_ctr_decrypt(camellia_decrypted)
+    return aes_ctr_decrypt(camellia_decrypted, key)
+
+# === STREAMING FILE ENCRYPTION (binary, chunked) ===
+# Format v1: MAGIC (4) | version (1) | AES-CTR nonce (8) | Camellia IV (16) | Camellia-CBC(AES-CTR(file))
+# Format v2 (seekable): MAGIC (4) | version (1) | chunk size (4) | AES-CTR nonce (8)
+#   | frame*: panjang ciphertext (4) | Camellia IV (16) | Camellia-CBC(AES-CTR(chunk))
+#   | penanda akhir frame (4 byte nol) | index: per chunk offset frame (8) + panjang plaintext (4)
+#   | trailer: offset index (8) | jumlah chunk (4) | INDEX_MAGIC (4)
+# AES-CTR tetap satu keystream (counter chunk i = i * chunk size / 16); CBC di-reset per chunk
+# sehingga satu chunk bisa didekripsi sendiri.
+# MAGIC diawali byte 0x00 yang tidak pernah muncul di Base64, jadi baris lama tetap terdeteksi.
+FILE_MAGIC = b'\x00ACF'
+FILE_FORMAT_V1 = 1
+FILE_FORMAT_V2 = 2
+FILE_HEADER_SIZE = len(FILE_MAGIC) + 1 + 8 + 16
+FILE_HEADER_SIZE_V2 = len(FILE_MAGIC) + 1 + 4 + 8
+INDEX_MAGIC = b'AIDX'
+INDEX_ENTRY = struct.Struct('>QI')
+INDEX_TRAILER = struct.Struct('>QI4s')
+CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+def is_stream_format(encrypted_data):
+    """True jika data memakai format binary (bukan Base64 lama)"""
+    return isinstance(encrypted_data, (bytes, bytearray, memoryview)) and \
+        bytes(encrypted_data[:len(FILE_MAGIC)]) == FILE_MAGIC
+
+def _read_exact(reader, size):
+    """Baca tepat size byte (atau kurang jika EOF)"""
+    # Jalur umum: satu read() sudah lengkap → tanpa salinan tambahan
+    first = reader.read(size)
+    if len(first) == size or not first:
+        return first
+    buf = bytearray(first)
+    while len(buf) < size:
+        chunk = reader.read(size - len(buf))
+        if not chunk:
+            break
+        buf += chunk
+    return bytes(buf)
+
+def encrypt_file_stream(reader, writer, chunk_size=CHUNK_SIZE, key=None, version=FILE_FORMAT_V2):
+    """
+    File stream: AES-128-CTR → Camellia CBC → binary (tanpa Base64)
+    reader/writer: objek file-like (read/write). Memori puncak O(chunk_size).
+    version: FILE_FORMAT_V2 (seekable, default) atau FILE_FORMAT_V1.
+    Return jumlah byte yang ditulis.
+    """
+    if version == FILE_FORMAT_V2:
+        return _encrypt_file_stream_v2(reader, writer, chunk_size, key)
+    if version != FILE_FORMAT_V1:
+        raise ValueError(f"Versi format file tidak dikenal: {version}")
+
+    nonce = os.urandom(8)
+    iv = os.urandom(16)
+    key = key or DATA_KEY
+    aes = AES.new(key[:16], AES.MODE_CTR, nonce=nonce)
+    encryptor = Cipher(algorithms.Camellia(key), modes.CBC(iv)).encryptor()
+    padder = padding.PKCS7(128).padder()
+    
+    header = FILE_MAGIC + bytes([FILE_FORMAT_V1]) + nonce + iv
+    writer.write(header)
+    written = len(header)
+    
+    while True:
+        chunk = reader.read(chunk_size)
+        if not chunk:
+            break
+        out = encryptor.update(padder.update(aes.encrypt(chunk)))
+        writer.write(out)
+        written += len(out)
+    
+    out = encryptor.update(padder.finalize()) + encryptor.finalize()
+    writer.write(out)
+    return written + len(out)
+
+def _encrypt_chunk_v2(aes_key, camellia_key, nonce, chunk_index, chunk_size, chunk):
+    """
+    Satu frame v2: AES-CTR (counter sesuai posisi chunk) → Camellia-CBC dengan IV sendiri.
+    Low-copy: AES menulis ke buffer ber-padding, Camellia menulis langsung ke buffer frame.
+    """
+    aes = AES.new(aes_key, AES.MODE_CTR, nonce=nonce,
+                  initial_value=chunk_index * (chunk_size // 16))
+    iv = os.urandom(16)
+    pad = 16 - len(chunk) % 16
+    ct_len = len(chunk) + pad
+    
+    # PKCS7 manual (hasil identik dengan padding.PKCS7)
+    padded = bytearray(ct_len)
+    aes.encrypt(chunk, output=memoryview(padded)[:len(chunk)])
+    padded[len(chunk):] = bytes([pad]) * pad
+    
+    # update_into butuh ruang len(data) + block_size - 1; sisa dipotong setelah view dilepas
+    frame = bytearray(20 + ct_len + 15)
+    frame[:4] = struct.pack('>I', ct_len)
+    frame[4:20] = iv
+    encryptor = Cipher(algorithms.Camellia(camellia_key), modes.CBC(iv)).encryptor()
+    with memoryview(frame) as view:
+        encryptor.update_into(padded, view[20:])
+    encryptor.finalize()
+    del frame[20 + ct_len:]
+    return frame
+
+def _decrypt_chunk_v2(aes_key, camellia_key, nonce, chunk_index, chunk_size, iv, ct):
+    decryptor = Cipher(algorithms.Camellia(camellia_key), modes.CBC(iv)).decryptor()
+    unpadder = padding.PKCS7(128).unpadder()
+    padded = decryptor.update(ct) + decryptor.finalize()
+    aes = AES.new(aes_key, AES.MODE_CTR, nonce=nonce,
+                  initial_value=chunk_index * (chunk_size // 16))
+    return aes.decrypt(unpadder.update(padded) + unpadder.finalize())
+
+def _encrypt_file_stream_v2(reader, writer, chunk_size, key):
+    """Format v2: frame per chunk + index di akhir (lihat komentar format di atas)"""
+    if chunk_size <= 0 or chunk_size % 16:
+        raise ValueError("chunk_size harus kelipatan 16")
+    key = key or DATA_KEY
+    nonce = os.urandom(8)
+    
+    header = FILE_MAGIC + bytes([FILE_FORMAT_V2]) + struct.pack('>I', chunk_size) + nonce
+    writer.write(header)
+    written = len(header)
+    
+    index = []
+    while True:
+        chunk = _read_exact(reader, chunk_size)
+        if not chunk:
+            break
+        frame = _encrypt_chunk_v2(key[:16], key, nonce, len(index), chunk_size, chunk)
+        index.append(INDEX_ENTRY.pack(written, len(chunk)))
+        writer.write(frame)
+        written += len(frame)
+        if len(chunk) < chunk_size:
+            break
+    
+    # Penanda akhir frame, lalu index + trailer
+    index_offset = written + 4
+    tail = b'\x00\x00\x00\x00' + b''.join(index) + \
+        INDEX_TRAILER.pack(index_offset, len(index), INDEX_MAGIC)
+    writer.write(tail)
+    return written + len(tail)
+
+def decrypt_file_stream(reader, writer, chunk_size=CHUNK_SIZE, key=None):
+    """
+    Kebalikan encrypt_file_stream. Baris lama (Base64) tetap didukung,
+    tetapi harus dibaca utuh karena formatnya tidak bisa di-stream.
+    Return jumlah byte plaintext yang ditulis.
+    """
+    head = _read_exact(reader, FILE_HEADER_SIZE)
+    if not is_stream_format(head):
+        # Format lama: Base64 → Camellia → Base64 → AES-CTR
+        legacy = head + reader.read()
+        plaintext = decrypt_file_legacy(legacy, key)
+        writer.write(plaintext)
+        return len(plaintext)
+    
+    version = head[len(FILE_MAGIC)]
+    if version == FILE_FORMAT_V2:
+        return _decrypt_file_stream_v2(head, reader, writer, key)
+    if version != FILE_FORMAT_V1:
+        raise ValueError(f"Versi format file tidak dikenal: {version}")
+    nonce = head[len(FILE_MAGIC) + 1:len(FILE_MAGIC) + 9]
+    iv = head[len(FILE_MAGIC) + 9:FILE_HEADER_SIZE]
+    
+    key = key or DATA_KEY
+    aes = AES.new(key[:16], AES.MODE_CTR, nonce=nonce)
+    decryptor = Cipher(algorithms.Camellia(key), modes.CBC(iv)).decryptor()
+    unpadder = padding.PKCS7(128).unpadder()
+    
+    written = 0
+    while True:
+        chunk = reader.read(chunk_size)
+        if not chunk:
+            break
+        out = aes.decrypt(unpadder.update(decryptor.update(chunk)))
+        writer.write(out)
+        written += len(out)
+    
+    out = aes.decrypt(unpadder.update(decryptor.finalize()) + unpadder.finalize())
+    writer.write(out)
+    return written + len(out)
+
+def _parse_header_v2(head):
+    chunk_size = struct.unpack('>I', head[len(FILE_MAGIC) + 1:len(FILE_MAGIC) + 5])[0]
+    nonce = bytes(head[len(FILE_MAGIC) + 5:FILE_HEADER_SIZE_V2])
+    return chunk_size, nonce
+
+def _decrypt_file_stream_v2(head, reader, writer, key):
+    """Dekripsi berurutan format v2 (head = FILE_HEADER_SIZE byte pertama yang sudah dibaca)"""
+    key = key or DATA_KEY
+    chunk_size, nonce = _parse_header_v2(head)
+    # Header v2 lebih pendek dari FILE_HEADER_SIZE: sisa head sudah masuk frame pertama
+    stream = BytesIO(head[FILE_HEADER_SIZE_V2:])
+    
+    def read(size):
+        data = _read_exact(stream, size)
+        if len(data) < size:
+            data += _read_exact(reader, size - len(data))
+        return data
+    
+    written = 0
+    chunk_index = 0
+    while True:
+        frame_len = read(4)
+        if len(frame_len) < 4:
+            raise ValueError("Data file terenkripsi rusak")
+        ct_len = struct.unpack('>I', frame_len)[0]
+        if ct_len == 0:
+            break
+        iv = read(16)
+        ct = read(ct_len)
+        if len(ct) < ct_len:
+            raise ValueError("Data file terenkripsi rusak")
+        out = _decrypt_chunk_v2(key[:16], key, nonce, chunk_index, chunk_size, iv, ct)
+        writer.write(out)
+        written += len(out)
+        chunk_index += 1
+    return written
+
+def read_chunk_index(reader):
+    """
+    Index format v2 dari reader seekable.
+    Return (chunk_size, nonce, [(offset plaintext, offset frame, panjang plaintext), ...]).
+    """
+    reader.seek(0)
+    head = _read_exact(reader, FILE_HEADER_SIZE_V2)
+    if not is_stream_format(head) or head[len(FILE_MAGIC)] != FILE_FORMAT_V2:
+        raise ValueError("Bukan format file v2 (seekable)")
+    chunk_size, nonce = _parse_header_v2(head)
+    
+    reader.seek(-INDEX_TRAILER.size, os.SEEK_END)
+    index_offset, count, magic = INDEX_TRAILER.unpack(_read_exact(reader, INDEX_TRAILER.size))
+    if magic != INDEX_MAGIC:
+        raise ValueError("Index file terenkripsi rusak")
+    reader.seek(index_offset)
+    raw = _read_exact(reader, count * INDEX_ENTRY.size)
+    
+    entries = []
+    plain_offset = 0
+    for frame_offset, plain_len in INDEX_ENTRY.iter_unpack(raw):
+        entries.append((plain_offset, frame_offset, plain_len))
+        plain_offset += plain_len
+    return chunk_size, nonce, entries
+
+def _decrypt_range_v2(reader, offset, length, key):
+    key = key or DATA_KEY
+    chunk_size, nonce, entries = read_chunk_index(reader)
+    end = offset + length
+    
+    out = bytearray()
+    for chunk_index, (plain_offset, frame_offset, plain_len) in enumerate(entries):
+        if plain_offset + plain_len <= offset:
+            continue
+        if plain_offset >= end:
+            break
+        # Hanya chunk yang beririsan dengan range yang dibaca & didekripsi
+        reader.seek(frame_offset)
+        ct_len = struct.unpack('>I', _read_exact(reader, 4))[0]
+        iv = _read_exact(reader, 16)
+        ct = _read_exact(reader, ct_len)
+        chunk = _decrypt_chunk_v2(key[:16], key, nonce, chunk_index, chunk_size, iv, ct)
+        out += chunk[max(offset - plain_offset, 0):end - plain_offset]
+    return bytes(out)
+
+def _decrypt_range_v1(reader, offset, length, key):
+    """
+    Format v1 juga bisa diakses acak: blok CBC cukup butuh blok ciphertext sebelumnya,
+    AES-CTR cukup counter blok awal. Yang didekripsi hanya blok yang mencakup range.
+    """
+    key = key or DATA_KEY
+    reader.seek(0)
+    head = _read_exact(reader, FILE_HEADER_SIZE)
+    nonce = head[len(FILE_MAGIC) + 1:len(FILE_MAGIC) + 9]
+    iv = head[len(FILE_MAGIC) + 9:FILE_HEADER_SIZE]
+    
+    body_len = reader.seek(0, os.SEEK_END) - FILE_HEADER_SIZE
+    if body_len < 16 or body_len % 16:
+        raise ValueError("Data file terenkripsi rusak")
+    # Blok terakhir + blok sebelumnya (untuk body 1 blok: IV di header, posisinya bersambung)
+    reader.seek(FILE_HEADER_SIZE + body_len - 32)
+    tail = _read_exact(reader, 32)
+    decryptor = Cipher(algorithms.Camellia(key), modes.CBC(tail[:16])).decryptor()
+    last_block = decryptor.update(tail[16:32]) + decryptor.finalize()
+    size = body_len - last_block[-1]
+    
+    end = min(offset + length, size)
+    if offset >= end:
+        return b''
+    first_block = offset // 16
+    last = (end - 1) // 16
+    if first_block == 0:
+        prev = iv
+    else:
+        reader.seek(FILE_HEADER_SIZE + (first_block - 1) * 16)
+        prev = _read_exact(reader, 16)
+    reader.seek(FILE_HEADER_SIZE + first_block * 16)
+    ct = _read_exact(reader, (last - first_block + 1) * 16)
+    
+    decryptor = Cipher(algorithms.Camellia(key), modes.CBC(prev)).decryptor()
+    padded = decryptor.update(ct) + decryptor.finalize()
+    aes = AES.new(key[:16], AES.MODE_CTR, nonce=nonce, initial_value=first_block)
+    plain = aes.decrypt(padded)
+    start = offset - first_block * 16
+    return plain[start:start + end - offset]
+
+@timed('crypto.decrypt_file_range', 'bytes_decrypted', measure='result')
+def decrypt_file_range(reader, offset, length, key=None):
+    """
+    Dekripsi sebagian file: length byte plaintext mulai dari offset.
+    reader: file-like seekable berisi data terenkripsi.
+    v2/v1: hanya chunk/blok yang mencakup range; format lama (Base64): dekripsi penuh.
+    """
+    if offset < 0 or length < 0:
+        raise ValueError("offset dan length tidak boleh negatif")
+    reader.seek(0)
+    head = _read_exact(reader, len(FILE_MAGIC) + 1)
+    if not is_stream_format(head):
+        reader.seek(0)
+        return decrypt_file_legacy(reader.read(), key)[offset:offset + length]
+    if length == 0:
+        return b''
+    version = head[len(FILE_MAGIC)]
+    if version == FILE_FORMAT_V2:
+        return _decrypt_range_v2(reader, offset, length, key)
+    if version == FILE_FORMAT_V1:
+        return _decrypt_range_v1(reader, offset, length, key)
+    raise ValueError(f"Versi format file tidak dikenal: {version}")
+
+def file_plaintext_size(encrypted_data, key=None):
+    """
+    Ukuran plaintext file terenkripsi.
+    Format v2: dibaca dari index. Format v1: cukup dekripsi blok CBC terakhir untuk membaca padding.
+    Format lama (Base64): harus didekripsi penuh.
+    """
+    if not is_stream_format(encrypted_data):
+        return len(decrypt_file_legacy(encrypted_data, key))
+    if encrypted_data[len(FILE_MAGIC)] == FILE_FORMAT_V2:
+        # Format v2: jumlah panjang plaintext di index, tanpa dekripsi
+        _, _, entries = read_chunk_index(BytesIO(encrypted_data))
+        return sum(entry[2] for entry in entries)
+    
+    body_len = len(encrypted_data) - FILE_HEADER_SIZE
+    if body_len < 16 or body_len % 16:
+        raise ValueError("Data file terenkripsi rusak")
+    iv = bytes(encrypted_data[FILE_HEADER_SIZE - 16:FILE_HEADER_SIZE])
+    prev = iv if body_len == 16 else bytes(encrypted_data[-32:-16])
+    decryptor = Cipher(algorithms.Camellia(key or DATA_KEY), modes.CBC(prev)).decryptor()
+    last_block = decryptor.update(bytes(encrypted_data[-16:])) + decryptor.finalize()
+    return body_len - last_block[-1]
+
+@timed('crypto.encrypt_file', 'bytes_encrypted')
+def encrypt_file(file_data, key=None):
+    """File: AES-128-CTR → Camellia CBC → binary stream format (bytes)"""
+    out = BytesIO()
+    encrypt_file_stream(BytesIO(file_data), out, key=key)
+    return out.getvalue()
+
+@timed('crypto.decrypt_file', 'bytes_decrypted', measure='result')
+def decrypt_file(encrypted_data, key=None):
+    """File: deteksi format → binary stream (v1/v2) atau Base64 lama → bytes"""
+    if not is_stream_format(encrypted_data):
+        return decrypt_file_legacy(encrypted_data, key)
+    out = BytesIO()
+    decrypt_file_stream(BytesIO(encrypted_data), out, key=key)
+    return out.getvalue()
 
 # === TRUE BIT PLANE SLICING WATERMARKING ===
+def watermark_to_bits(watermark_text):
+    """Watermark text → array bit uint8 (MSB dulu per karakter) + null terminator"""
+    try:
+        # Jalur cepat: semua karakter < 256 → 1 byte per karakter
+        raw = watermark_text.encode('latin-1')
+        bits = np.unpackbits(np.frombuffer(raw + b'\x00', dtype=np.uint8))
+    except UnicodeEncodeError:
+        # Karakter > 255 menghasilkan lebih dari 8 bit (format '08b'), ikuti format lama
+        watermark_bin = ''.join(format(ord(c), '08b') for c in watermark_text) + '00000000'
+        bits = np.frombuffer(watermark_bin.encode(), dtype=np.uint8) - ord('0')
+    return bits
+
+def embed_bits_bitplane(flat, bits, bit_planes):
+    """
+    Tulis array bit ke flat pixel array (in-place) secara vectorized.
+    Bit ke-j dari tiap pixel masuk ke bit_planes[j]; pixel diisi berurutan.
+    """
+    n_planes = len(bit_planes)
+    if n_planes == 0:
+        return flat
+    
+    # Kapasitas terbatas: bit yang tidak muat dipotong (sama seperti loop lama)
+    bits = bits[:len(flat) * n_planes]
+    
+    for j, bit_pos in enumerate(bit_planes):
+        plane_bits = bits[j::n_planes]
+        n = len(plane_bits)
+        if n == 0:
+            continue
+        mask = np.uint8(0xFF ^ (1 << bit_pos))
+        target = flat[:n]
+        np.bitwise_and(target, mask, out=target)
+        np.bitwise_or(target, plane_bits.astype(np.uint8) << np.uint8(bit_pos), out=target)
+    return flat
+
+# === KONFIGURASI WATERMARK PER ARTWORK ===
+# Disimpan di artworks.watermark_config (JSON): versi format, bit planes, panjang payload (bit)
+WATERMARK_FORMAT_V1 = 1
+
+# Preset upload: lebih banyak bit plane → kapasitas per pixel lebih besar, perubahan visual lebih besar
+WATERMARK_PRESETS = {
+    'lsb': {'label': "⚡ LSB Only (tercepat, perubahan minimal)", 'bit_planes': [0]},
+    'balanced': {'label': "⚖️ Seimbang (bit 0–1)", 'bit_planes': [0, 1]},
+    'capacity': {'label': "📦 Kapasitas (bit 0–2)", 'bit_planes': [0, 1, 2]},
+}
+DEFAULT_WATERMARK_PRESET = 'lsb'
+
+def dump_watermark_config(bit_planes, payload_len):
+    """Config watermark → JSON untuk kolom watermark_config"""
+    return json.dumps({'version': WATERMARK_FORMAT_V1, 'bit_planes': list(bit_planes),
+                       'payload_len': int(payload_len)})
+
+def parse_watermark_config(config):
+    """JSON watermark_config → dict (None untuk baris lama tanpa config)"""
+    if not config:
+        return None
+    config = json.loads(config)
+    if config.get('version') != WATERMARK_FORMAT_V1:
+        raise ValueError(f"Versi config watermark tidak dikenal: {config.get('version')}")
+    return config
+
+# === TILED ACCESS (memori terbatas untuk gambar besar) ===
+# Payload watermark hanya menempati prefix pixel (urutan baris), jadi cukup baris teratas
+# yang dibaca/ditulis. Gambar RGB tidak dikonversi (tanpa salinan penuh).
+PNG_COMPRESS_LEVEL = int(os.environ.get('ARTCRYPT_PNG_COMPRESS_LEVEL', '6'))
+
+def _open_image(image):
+    """Path/file-like/bytes → PIL Image (belum dikonversi)"""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = BytesIO(image)
+    return Image.open(image)
+
+def _rows_for(img, n_values):
+    """Jumlah baris teratas yang memuat n_values byte (R,G,B per pixel)"""
+    return min(img.height, -(-n_values // (img.width * 3)))
+
+def _row_strip(img, top, rows):
+    """Baris [top, top+rows) sebagai array uint8 datar (RGB); hanya strip yang dikonversi"""
+    strip = img.crop((0, top, img.width, min(top + rows, img.height)))
+    if strip.mode != 'RGB':
+        strip = strip.convert('RGB')
+    return np.asarray(strip, dtype=np.uint8).reshape(-1)
+
+def iter_image_strips(img, first_rows=1):
+    """Strip baris dari atas dengan tinggi yang membesar (1, 2, 4, ... baris)"""
+    top = 0
+    rows = first_rows
+    while top < img.height:
+        yield _row_strip(img, top, rows)
+        top += rows
+        rows *= 2
+
+@timed('watermark.embed')
+def embed_watermark_with_config(image_file, watermark_text, bit_planes=[0], compress_level=None):
+    """
+    Embed watermark di bit planes pilihan.
+    Hanya baris teratas yang memuat payload yang disalin ke array dan ditulis balik (paste).
+    Return (PNG bytes, JSON config) — config disimpan agar ekstraksi tidak perlu menebak.
+    """
+    img = _open_image(image_file)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    else:
+        img.load()
+    
+    bits = watermark_to_bits(watermark_text)
+    capacity = img.width * img.height * 3
+    n_planes = len(bit_planes)
+    
+    if n_planes:
+        rows = _rows_for(img, -(-len(bits) // n_planes))
+        strip = np.array(img.crop((0, 0, img.width, rows)), dtype=np.uint8)
+        # reshape = view: embed langsung menulis ke strip
+        embed_bits_bitplane(strip.reshape(-1), bits, bit_planes)
+        img.paste(Image.fromarray(strip), (0, 0))
+    # Panjang payload tanpa null terminator, dibatasi kapasitas gambar
+    payload_len = min(len(bits) - 8, capacity * n_planes)
+    
+    # Seperti sebelumnya: metadata sumber (ICC, EXIF, ...) tidak ikut disimpan
+    img.info = {}
+    img_byte_arr = BytesIO()
+    img.save(img_byte_arr, format='PNG',
+             compress_level=PNG_COMPRESS_LEVEL if compress_level is None else compress_level)
+    return img_byte_arr.getvalue(), dump_watermark_config(bit_planes, payload_len)
+
 def embed_watermark_bitplane(image_file, watermark_text, bit_planes=[0, 1, 2]):
     """
     TRUE Bit Plane Slicing - Embed watermark in multiple bit planes
     bit_planes: list of bit positions (0-7) to use for embedding
     """
-    img = Image.open(image_file).convert('RGB')
-    arr = np.array(img, dtype=np.uint8)
-    
-    # Convert watermark to binary
-    watermark_bin = ''.join(format(ord(c), '08b') for c in watermark_text)
-    watermark_bin += '00000000'  # Null terminator
+    return embed_watermark_with_config(image_file, watermark_text, bit_planes)[0]
+
+def iter_bitplane_bits(flat, bit_planes, chunk_pixels=64):
+    """
+    Generator bit (array uint8) dari flat pixel array, dibaca per chunk yang membesar.
+    Urutan bit sama dengan embed: per pixel, bit_planes sesuai urutan.
+    """
+    planes = np.asarray(bit_planes, dtype=np.uint8)
+    if planes.size == 0:
+        return
+    start = 0
+    while start < len(flat):
+        end = min(start + chunk_pixels, len(flat))
+        yield ((flat[start:end, None] >> planes) & 1).astype(np.uint8).ravel()
+        start = end
+        chunk_pixels *= 2
+
+class BitTextDecoder:
+    """Decoder bit → teks inkremental: kumpulkan bit per byte sampai null terminator / max_len"""
     
-    # Embed in selected bit planes
-    flat = arr.flatten()
-    watermark_index = 0
+    def __init__(self, max_len=None):
+        self.max_len = max_len
+        self.chars = bytearray()
+        self.leftover = np.empty(0, dtype=np.uint8)
+        self.done = False
     
-    for i in range(len(flat)):
-        if watermark_index >= len(watermark_bin):
-            break
-            
-        current_pixel = flat[i]
+    def feed(self, chunk):
+        """Tambah bit; return True jika teks sudah lengkap"""
+        bits = np.concatenate((self.leftover, chunk)) if self.leftover.size else chunk
+        n_full = (len(bits) // 8) * 8
+        self.leftover = bits[n_full:]
+        packed = np.packbits(bits[:n_full])
         
-        for bit_pos in bit_planes:
-            if watermark_index >= len(watermark_bin):
-                break
-                
-            # Clear the target bit
-            mask = 0xFF ^ (1 << bit_pos)
-            current_pixel = current_pixel & mask
-            
-            # Set the bit from watermark
-            bit_value = int(watermark_bin[watermark_index])
-            current_pixel = current_pixel | (bit_value << bit_pos)
-            watermark_index += 1
+        zeros = np.flatnonzero(packed == 0)
+        if zeros.size:
+            packed = packed[:zeros[0]]
+        self.chars += packed.tobytes()
         
-        flat[i] = current_pixel
+        if zeros.size or (self.max_len is not None and len(self.chars) >= self.max_len):
+            self.done = True
+        return self.done
     
-    watermarked_arr = flat.reshape(arr.shape)
-    watermarked_img = Image.fromarray(watermarked_arr)
-    
-    img_byte_arr = BytesIO()
-    watermarked_img.save(img_byte_arr, format='PNG')
-    return img_byte_arr.getvalue()
+    def text(self):
+        # Byte terakhir yang tidak lengkap diabaikan
+        chars = self.chars if self.max_len is None else self.chars[:self.max_len]
+        return chars.decode('latin-1')
 
-def extract_watermark_bitplane(image_data, bit_planes=[0, 1, 2]):
+def extract_bits_to_text(bit_chunks, max_len=None):
+    """Kumpulkan bit per byte (np.packbits) sampai null terminator / max_len"""
+    decoder = BitTextDecoder(max_len)
+    for chunk in bit_chunks:
+        if decoder.feed(chunk):
+            break
+    return decoder.text()
+
+@timed('watermark.extract')
+def extract_watermark_bitplane(image_data, bit_planes=[0, 1, 2], max_len=None):
     """
     Extract watermark from multiple bit planes
     bit_planes: list of bit positions (0-7) used for embedding
+    max_len: optional batas jumlah karakter yang dibaca
+    Hanya prefix pixel yang dibutuhkan yang dibaca; berhenti di null terminator.
+    """
+    img = _open_image(image_data)
+    bit_chunks = (bits for strip in iter_image_strips(img)
+                  for bits in iter_bitplane_bits(strip, bit_planes))
+    return extract_bits_to_text(bit_chunks, max_len)
+
+@timed('watermark.extract_exact')
+def extract_watermark_exact(image_data, config):
     """
-    img = Image.open(BytesIO(image_data)).convert('RGB')
-    arr = np.array(img, dtype=np.uint8)
+    Ekstraksi dengan config tersimpan: baca tepat payload_len bit dari prefix pixel
+    yang dibutuhkan (tanpa mencari null terminator).
+    """
+    if isinstance(config, str):
+        config = parse_watermark_config(config)
+    bit_planes = config['bit_planes']
+    payload_len = config['payload_len']
+    
+    img = _open_image(image_data)
+    n_pixels = -(-payload_len // len(bit_planes))
+    flat = _row_strip(img, 0, _rows_for(img, n_pixels))
     
-    flat = arr.flatten()
-    binary_str = ''
+    planes = np.asarray(bit_planes, dtype=np.uint8)
+    bits = ((flat[:n_pixels, None] >> planes) & 1).astype(np.uint8).ravel()[:payload_len]
+    return np.packbits(bits[:(len(bits) // 8) * 8]).tobytes().decode('latin-1')
+
+def extract_stored_watermark(image_data, watermark_config=None, max_len=None):
+    """Ekstraksi untuk artwork tersimpan: config (jika ada) atau LSB + null terminator (baris lama)"""
+    config = parse_watermark_config(watermark_config)
+    if config is None:
+        return extract_watermark_from_bytes(image_data, max_len=max_len)
+    return extract_watermark_exact(image_data, config)
+
+# === VERIFIKASI 1:N ===
+# Konfigurasi bit plane yang dicoba saat mencari pemilik gambar yang dicurigai (semua preset upload)
+WATERMARK_BIT_PLANE_CONFIGS = tuple(p['bit_planes'] for p in WATERMARK_PRESETS.values())
+WATERMARK_MAX_LEN = 1024
+
+@timed('watermark.extract_candidates')
+def extract_watermark_candidates(image_data, configs=WATERMARK_BIT_PLANE_CONFIGS,
+                                 max_len=WATERMARK_MAX_LEN):
+    """
+    Ekstrak watermark untuk beberapa konfigurasi bit plane dalam satu pass pixel (per strip baris):
+    bit semua plane yang dibutuhkan dihitung sekali per chunk, lalu dibagikan ke tiap decoder.
+    Return dict {tuple(bit_planes): teks}.
+    """
+    img = _open_image(image_data)
     
-    for pixel in flat:
-        for bit_pos in bit_planes:
-            bit_value = (pixel >> bit_pos) & 1
-            binary_str += str(bit_value)
+    planes = sorted({p for config in configs for p in config})
+    column = {p: i for i, p in enumerate(planes)}
+    plane_arr = np.asarray(planes, dtype=np.uint8)
+    decoders = [(tuple(config), [column[p] for p in config], BitTextDecoder(max_len))
+                for config in configs if config]
     
-    # Convert binary to text
-    chars = []
-    for i in range(0, len(binary_str), 8):
-        byte = binary_str[i:i+8]
-        if len(byte) < 8 or byte == '00000000':
+    for flat in iter_image_strips(img):
+        start = 0
+        chunk_pixels = 64
+        while start < len(flat) and not all(d.done for _, _, d in decoders):
+            end = min(start + chunk_pixels, len(flat))
+            bits = ((flat[start:end, None] >> plane_arr) & 1).astype(np.uint8)
+            for _, columns, decoder in decoders:
+                if not decoder.done:
+                    decoder.feed(bits[:, columns].ravel())
+            start = end
+            chunk_pixels *= 2
+        if all(d.done for _, _, d in decoders):
             break
-        chars.append(chr(int(byte, 2)))
     
-    return ''.join(chars)
+    return {config: decoder.text() for config, _, decoder in decoders}
 
 # === COMPATIBILITY FUNCTIONS ===
 def embed_watermark(image_file, watermark_text):
     """Default watermark using LSB (bit plane 0) for compatibility"""
     return embed_watermark_bitplane(image_file, watermark_text, bit_planes=[0])
 
-def extract_watermark_from_bytes(image_data, bit_planes=None):
+def extract_watermark_from_bytes(image_data, bit_planes=None, max_len=None):
     """Extraction with customizable bit planes"""
     if bit_planes is None:
         bit_planes = [0]  # Default to LSB for compatibility
-    return extract_watermark_bitplane(image_data, bit_planes)
\ No newline at end of file
+    return extract_watermark_bitplane(image_data, bit_planes, max_len=max_len)
\ No newline at end of file
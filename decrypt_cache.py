@@ -0,0 +1,152 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+from crypto_utils import decrypt_metadata, decrypt_file
+from key_manager import artwork_key
+
+META_CACHE_MB = float(os.environ.get('ARTCRYPT_META_CACHE_MB', '8'))
+FILE_CACHE_MB = float(os.environ.get('ARTCRYPT_FILE_CACHE_MB', '256'))
+FILE_CACHE_USER_MB = float(os.environ.get('ARTCRYPT_FILE_CACHE_USER_MB', '64'))
+
+def _sizeof(value):
+    """Perkiraan ukuran nilai cache (byte)"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    return sys.getsizeof(value)
+
+class ByteLRUCache:
+    """
+    LRU cache thread-safe dengan batas byte (bukan hanya jumlah entri).
+    Key: (user_id, art_id, field). Setiap user punya batas byte sendiri sehingga
+    satu user tidak bisa mengusir seluruh cache user lain.
+    """
+
+    def __init__(self, max_bytes, max_bytes_per_user=None):
+        self.max_bytes = max_bytes
+        self.max_bytes_per_user = max_bytes_per_user or max_bytes
+        self._entries = OrderedDict()   # key → (value, size)
+        self._user_bytes = {}
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        size = _sizeof(value) if size is None else size
+        user_id = key[0]
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            # Nilai lebih besar dari budget tidak di-cache
+            if size > self.max_bytes or size > self.max_bytes_per_user:
+                return
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            self._user_bytes[user_id] = self._user_bytes.get(user_id, 0) + size
+
+            # Evict LRU milik user yang sama dulu, lalu LRU global
+            if self._user_bytes[user_id] > self.max_bytes_per_user:
+                for old_key in [k for k in self._entries if k[0] == user_id]:
+                    if self._user_bytes[user_id] <= self.max_bytes_per_user:
+                        break
+                    self._remove(old_key)
+                    self.evictions += 1
+            while self.total_bytes > self.max_bytes:
+                old_key = next(iter(self._entries))
+                self._remove(old_key)
+                self.evictions += 1
+
+    def _remove(self, key):
+        value, size = self._entries.pop(key)
+        self.total_bytes -= size
+        user_id = key[0]
+        self._user_bytes[user_id] -= size
+        if self._user_bytes[user_id] <= 0:
+            del self._user_bytes[user_id]
+
+    def invalidate(self, user_id, art_id):
+        """Hapus semua entri (semua field) milik satu artwork"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == user_id and k[1] == art_id]:
+                self._remove(key)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == user_id]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._user_bytes.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+# Cache global per proses (dipakai bersama oleh semua sesi Streamlit)
+metadata_cache = ByteLRUCache(int(META_CACHE_MB * 1024 * 1024))
+file_cache = ByteLRUCache(int(FILE_CACHE_MB * 1024 * 1024),
+                          int(FILE_CACHE_USER_MB * 1024 * 1024))
+
+def cached_decrypt_metadata(user_id, art_id, field, encrypted_data, wrapped_key=None):
+    """decrypt_metadata dengan cache per (user, artwork, field)"""
+    cache_key = (user_id, art_id, field)
+    value = metadata_cache.get(cache_key)
+    if value is None:
+        value = decrypt_metadata(encrypted_data, artwork_key(user_id, wrapped_key))
+        metadata_cache.put(cache_key, value)
+    return value
+
+def cached_decrypt_blob(user_id, art_id, field, load_encrypted, wrapped_key=None):
+    """
+    decrypt_file dengan cache per (user, artwork, field) — file asli atau turunan (thumb/preview).
+    load_encrypted: callable yang mengambil data terenkripsi, hanya dipanggil saat miss;
+    boleh return None (data tidak ada) → hasil None, tidak di-cache.
+    """
+    cache_key = (user_id, art_id, field)
+    value = file_cache.get(cache_key)
+    if value is None:
+        encrypted = load_encrypted()
+        if encrypted is None:
+            return None
+        value = decrypt_file(encrypted, artwork_key(user_id, wrapped_key))
+        file_cache.put(cache_key, value)
+    return value
+
+def cached_decrypt_file(user_id, art_id, load_encrypted, wrapped_key=None):
+    """
+    decrypt_file dengan cache per (user, artwork).
+    load_encrypted: callable yang mengambil data terenkripsi, hanya dipanggil saat miss.
+    """
+    return cached_decrypt_blob(user_id, art_id, 'file', load_encrypted, wrapped_key)
+
+def invalidate_artwork(user_id, art_id):
+    """Dipanggil saat artwork dihapus/diubah"""
+    metadata_cache.invalidate(user_id, art_id)
+    file_cache.invalidate(user_id, art_id)
+
+def cache_stats():
+    return {'metadata': metadata_cache.stats(), 'file': file_cache.stats()}
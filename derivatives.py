@@ -0,0 +1,117 @@
+import argparse
+import os
+from io import BytesIO
+from PIL import Image
+from connection import get_connection, transaction, init_db
+from crypto_utils import encrypt_file, decrypt_file
+from blob_store import get_blob_store, load_encrypted_file, release_blob
+from key_manager import artwork_key
+from decrypt_cache import cached_decrypt_blob
+
+# Sisi terpanjang (pixel) per jenis turunan
+DERIVATIVE_SIZES = {'preview': 1024, 'thumb': 256}
+DERIVATIVE_QUALITY = int(os.environ.get('ARTCRYPT_DERIVATIVE_QUALITY', '80'))
+
+def render_derivatives(image_data):
+    """Gambar (bytes atau file-like) → {jenis: JPEG bytes}; turunan kecil dibuat dari turunan besar"""
+    img = Image.open(image_data if hasattr(image_data, 'read') else BytesIO(image_data))
+    # JPEG: decode langsung di skala yang lebih kecil (tanpa decode resolusi penuh)
+    largest = max(DERIVATIVE_SIZES.values())
+    img.draft('RGB', (largest, largest))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    rendered = {}
+    for kind, size in sorted(DERIVATIVE_SIZES.items(), key=lambda item: -item[1]):
+        img.thumbnail((size, size))
+        out = BytesIO()
+        img.save(out, format='JPEG', quality=DERIVATIVE_QUALITY)
+        rendered[kind] = out.getvalue()
+    return rendered
+
+def build_derivatives(image_data, key, store=None):
+    """
+    Render + enkripsi (data key artwork) + tulis ke blob store.
+    Return list dict {kind, blob_ref, blob_size} (aman dijalankan di worker process).
+    """
+    store = store or get_blob_store()
+    derivatives = []
+    try:
+        for kind, data in render_derivatives(image_data).items():
+            encrypted = encrypt_file(data, key=key)
+            derivatives.append({'kind': kind, 'blob_ref': store.put(encrypted),
+                                'blob_size': len(encrypted)})
+    except BaseException:
+        # Gagal di tengah: blob turunan yang sudah ditulis tidak punya pemilik
+        for d in derivatives:
+            release_blob(d['blob_ref'], store)
+        raise
+    return derivatives
+
+def save_derivatives(conn, art_id, derivatives):
+    """Simpan referensi turunan (dalam transaksi milik pemanggil). Return blob lama yang diganti."""
+    old_refs = delete_derivatives(conn, art_id)
+    conn.executemany('''
+        INSERT INTO artwork_derivatives (artwork_id, kind, blob_ref, blob_size)
+        VALUES (?, ?, ?, ?)
+    ''', [(art_id, d['kind'], d['blob_ref'], d['blob_size']) for d in derivatives])
+    return old_refs
+
+def delete_derivatives(conn, art_id):
+    """Hapus baris turunan satu artwork. Return blob_ref-nya (di-release setelah commit)."""
+    refs = [row[0] for row in conn.execute(
+        "SELECT blob_ref FROM artwork_derivatives WHERE artwork_id = ?", (art_id,))]
+    conn.execute("DELETE FROM artwork_derivatives WHERE artwork_id = ?", (art_id,))
+    return refs
+
+def release_blobs(blob_refs):
+    """release_blob untuk banyak referensi (dipanggil setelah commit)"""
+    for blob_ref in blob_refs:
+        release_blob(blob_ref)
+
+def load_derivative(user_id, art_id, kind, wrapped_key=None):
+    """Turunan terdekripsi (di-cache) atau None jika belum dibuat (baris lama sebelum backfill)"""
+    def load_encrypted():
+        with get_connection() as conn:
+            row = conn.execute('''
+                SELECT blob_ref FROM artwork_derivatives WHERE artwork_id = ? AND kind = ?
+            ''', (art_id, kind)).fetchone()
+        return get_blob_store().get(row[0]) if row else None
+    return cached_decrypt_blob(user_id, art_id, kind, load_encrypted, wrapped_key)
+
+def backfill_derivatives(batch_size=50):
+    """Buat turunan untuk gambar lama yang belum punya. Return jumlah artwork."""
+    count = 0
+    last_id = 0
+    while True:
+        with get_connection() as conn:
+            rows = conn.execute('''
+                SELECT id, user_id, wrapped_key, file_data, blob_ref FROM artworks a
+                WHERE id > ? AND file_type LIKE 'image%'
+                  AND NOT EXISTS (SELECT 1 FROM artwork_derivatives d WHERE d.artwork_id = a.id)
+                ORDER BY id LIMIT ?
+            ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            return count
+
+        for art_id, user_id, wrapped_key, file_data, blob_ref in rows:
+            try:
+                key = artwork_key(user_id, wrapped_key)
+                image = decrypt_file(load_encrypted_file(file_data, blob_ref), key)
+                derivatives = build_derivatives(image, key)
+            except Exception as e:
+                print(f"  ⚠️ ID {art_id}: {e}")
+                continue
+            with transaction() as conn:
+                old_refs = save_derivatives(conn, art_id, derivatives)
+            release_blobs(old_refs)
+            count += 1
+        last_id = rows[-1][0]
+        print(f"  🖼️ {count} artwork (sampai ID {last_id})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill thumbnail & preview terenkripsi untuk gambar lama")
+    parser.add_argument('--batch-size', type=int, default=50)
+    args = parser.parse_args()
+    init_db()
+    print(f"✅ Turunan dibuat untuk {backfill_derivatives(args.batch_size)} artwork")
@@ -0,0 +1,155 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from cryptography.hazmat.primitives import hashes, hmac
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap, aes_key_unwrap
+
+# Key bawaan (development). Production: set ARTCRYPT_MASTER_KEY / ARTCRYPT_MASTER_KEY_FILE.
+LEGACY_KEY = b'0123456789ABCDEF0123456789ABCDEF'  # 32 bytes
+
+KEY_CACHE_SIZE = int(os.environ.get('ARTCRYPT_KEY_CACHE_SIZE', '1024'))
+
+def load_key(value):
+    """Key 32 byte dari hex (64 karakter) atau bytes mentah"""
+    if isinstance(value, str):
+        value = bytes.fromhex(value.strip())
+    if len(value) != 32:
+        raise ValueError("Key harus 32 bytes")
+    return value
+
+def load_key_file(path):
+    """Baca key dari file: 32 byte mentah atau teks hex"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    return raw if len(raw) == 32 else load_key(raw.decode())
+
+def _key_from_env(name, default):
+    """Key dari env NAME (hex) atau NAME_FILE, selain itu default"""
+    if os.environ.get(name):
+        return load_key(os.environ[name])
+    if os.environ.get(name + '_FILE'):
+        return load_key_file(os.environ[name + '_FILE'])
+    return default
+
+# === KEY HIERARCHY ===
+# MASTER_KEY  → (HKDF per user) → KEK user → (AES Key Wrap) → data key per artwork
+# AUTH_KEY    → kredensial user (username/password), terpisah agar rotasi master tidak memutus login
+# DATA_KEY    → key baris artwork lama yang belum punya wrapped_key
+MASTER_KEY = _key_from_env('ARTCRYPT_MASTER_KEY', LEGACY_KEY)
+AUTH_KEY = _key_from_env('ARTCRYPT_AUTH_KEY', LEGACY_KEY)
+DATA_KEY = _key_from_env('ARTCRYPT_DATA_KEY', LEGACY_KEY)
+
+# Format wrapped key: version (1) | key id master (4) | AES-KW(data key) (40)
+WRAPPED_KEY_V1 = 1
+
+def key_id(key):
+    """Identitas pendek (4 byte) sebuah master key"""
+    return hashlib.sha256(b'artcrypt-key-id:' + key).digest()[:4]
+
+def _old_master_keys():
+    """Master key lama untuk rotasi: ARTCRYPT_OLD_MASTER_KEYS (hex, dipisah koma)"""
+    values = os.environ.get('ARTCRYPT_OLD_MASTER_KEYS', '')
+    return [load_key(v) for v in values.split(',') if v.strip()]
+
+# Keyring: key id → master key (aktif + lama)
+KEYRING = {key_id(k): k for k in [*_old_master_keys(), MASTER_KEY]}
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def user_kek(user_id, master_key=None):
+    """KEK per user = HKDF-SHA256(master key, info=artcrypt/user/<id>)"""
+    return HKDF(
+        algorithm=hashes.SHA256(), length=32, salt=None,
+        info=f'artcrypt/user/{user_id}'.encode(),
+    ).derive(master_key or MASTER_KEY)
+
+def wrap_data_key(user_id, data_key, master_key=None):
+    """Data key → AES Key Wrap dengan KEK user → wrapped key (bytes)"""
+    master_key = master_key or MASTER_KEY
+    wrapped = aes_key_wrap(user_kek(user_id, master_key), data_key)
+    return bytes([WRAPPED_KEY_V1]) + key_id(master_key) + wrapped
+
+def new_data_key(user_id):
+    """Buat data key acak untuk satu artwork. Return (data_key, wrapped_key)."""
+    data_key = os.urandom(32)
+    return data_key, wrap_data_key(user_id, data_key)
+
+class _BoundedCache:
+    """LRU sederhana thread-safe untuk data key yang sudah di-unwrap"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+_data_key_cache = _BoundedCache(KEY_CACHE_SIZE)
+
+def wrapped_key_id(wrapped_key):
+    return bytes(wrapped_key[1:5])
+
+def unwrap_data_key(user_id, wrapped_key):
+    """Wrapped key → data key (di-cache). Master key dipilih dari keyring via key id."""
+    wrapped_key = bytes(wrapped_key)
+    cache_key = (user_id, wrapped_key)
+    data_key = _data_key_cache.get(cache_key)
+    if data_key is not None:
+        return data_key
+
+    if wrapped_key[0] != WRAPPED_KEY_V1:
+        raise ValueError(f"Versi wrapped key tidak dikenal: {wrapped_key[0]}")
+    master_key = KEYRING.get(wrapped_key_id(wrapped_key))
+    if master_key is None:
+        raise ValueError("Master key untuk wrapped key ini tidak tersedia")
+    data_key = aes_key_unwrap(user_kek(user_id, master_key), wrapped_key[5:])
+    _data_key_cache.put(cache_key, data_key)
+    return data_key
+
+def artwork_key(user_id, wrapped_key):
+    """Key untuk data artwork: data key (jika ada wrapped key) atau None (= DATA_KEY lama)"""
+    if not wrapped_key:
+        return None
+    return unwrap_data_key(user_id, wrapped_key)
+
+def needs_rewrap(wrapped_key):
+    """True jika wrapped key masih dibungkus master key lama"""
+    return bool(wrapped_key) and wrapped_key_id(wrapped_key) != key_id(MASTER_KEY)
+
+def rewrap_data_key(user_id, wrapped_key):
+    """Rotasi master key: unwrap dengan key lama → wrap dengan master key aktif"""
+    return wrap_data_key(user_id, unwrap_data_key(user_id, wrapped_key))
+
+# === CACHED CIPHER CONTEXTS ===
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def get_aesgcm(key):
+    """AESGCM dengan key schedule yang di-cache per key"""
+    return AESGCM(key)
+
+@lru_cache(maxsize=64)
+def _base_hmac(key, algorithm_name):
+    algorithm = {'sha256': hashes.SHA256, 'sha384': hashes.SHA384}[algorithm_name]()
+    return hmac.HMAC(key, algorithm)
+
+def hmac_for(key, algorithm_name):
+    """HMAC siap pakai: salinan state ter-key (ipad/opad) yang sudah di-cache"""
+    return _base_hmac(key, algorithm_name).copy()
@@ -0,0 +1,201 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Instrumentasi aktif hanya jika ARTCRYPT_METRICS=1 (dibaca saat import).
+# Nonaktif: decorator mengembalikan fungsi asli dan timer() adalah context manager kosong.
+ENABLED = os.environ.get('ARTCRYPT_METRICS') == '1'
+SLOW_MS = float(os.environ.get('ARTCRYPT_SLOW_MS', '100'))
+SLOW_LOG_SIZE = 200
+TRACE_LIMIT = 500
+# Batas bucket histogram (ms) untuk export Prometheus
+BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class _NullTimer:
+    """Timer saat metrics nonaktif: tanpa alokasi, tanpa clock"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class MetricsRegistry:
+    """Statistik per operasi (count, total, max, histogram), counter byte, dan log operasi lambat"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ops = {}
+        self.counters = {}
+        self.slow = deque(maxlen=SLOW_LOG_SIZE)
+
+    def observe(self, name, elapsed_ms, detail=None):
+        with self._lock:
+            op = self.ops.get(name)
+            if op is None:
+                op = self.ops[name] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                       'buckets': [0] * len(BUCKETS_MS)}
+            op['count'] += 1
+            op['total_ms'] += elapsed_ms
+            op['max_ms'] = max(op['max_ms'], elapsed_ms)
+            for i, bound in enumerate(BUCKETS_MS):
+                if elapsed_ms <= bound:
+                    op['buckets'][i] += 1
+                    break
+            if elapsed_ms >= SLOW_MS:
+                self.slow.append({'time': time.strftime('%H:%M:%S'), 'op': name,
+                                  'ms': round(elapsed_ms, 3), 'detail': detail})
+
+    def add(self, counter, value):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'ops': {name: dict(op, buckets=list(op['buckets']),
+                                   mean_ms=op['total_ms'] / op['count'])
+                        for name, op in self.ops.items()},
+                'counters': dict(self.counters),
+                'slow': list(self.slow),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.ops.clear()
+            self.counters.clear()
+            self.slow.clear()
+
+registry = MetricsRegistry()
+
+# Trace per request (per run script Streamlit): list span di context aktif
+_current_trace = contextvars.ContextVar('artcrypt_trace', default=None)
+
+@contextmanager
+def trace():
+    """with trace() as spans: ... → semua operasi ter-timer di context ini dicatat ke spans"""
+    spans = []
+    token = _current_trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _current_trace.reset(token)
+
+class _Timer:
+    __slots__ = ('name', 'detail', 'start')
+
+    def __init__(self, name, detail):
+        self.name = name
+        self.detail = detail
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed_ms = (time.perf_counter() - self.start) * 1000
+        registry.observe(self.name, elapsed_ms, self.detail)
+        spans = _current_trace.get()
+        if spans is not None and len(spans) < TRACE_LIMIT:
+            spans.append({'op': self.name, 'ms': round(elapsed_ms, 3), 'detail': self.detail})
+        return False
+
+def timer(name, detail=None):
+    """Context manager timing: with timer('sql.select', sql): ..."""
+    if not ENABLED:
+        return _NULL_TIMER
+    return _Timer(name, detail)
+
+def count(counter, value=1):
+    if ENABLED:
+        registry.add(counter, value)
+
+def _size(value):
+    if isinstance(value, (bytes, bytearray, memoryview, str)):
+        return len(value)
+    return 0
+
+def timed(name, bytes_counter=None, measure='arg', arg_index=0):
+    """
+    Decorator timing (+ counter byte opsional: ukuran argumen ke-arg_index atau hasil).
+    Saat metrics nonaktif fungsi dikembalikan apa adanya (tanpa overhead).
+    """
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Timer(name, None):
+                result = fn(*args, **kwargs)
+            if bytes_counter:
+                registry.add(bytes_counter, _size(result if measure == 'result' else args[arg_index]))
+            return result
+        return wrapper
+    return decorator
+
+# === EXPORT ===
+def _metric_name(name):
+    return ''.join(c if c.isalnum() else '_' for c in name)
+
+def export_prometheus(snapshot=None):
+    """Snapshot → format teks Prometheus (histogram per operasi + counter)"""
+    snapshot = snapshot or registry.snapshot()
+    lines = ['# TYPE artcrypt_op_duration_ms histogram']
+    for name, op in sorted(snapshot['ops'].items()):
+        cumulative = 0
+        for bound, n in zip(BUCKETS_MS, op['buckets']):
+            cumulative += n
+            lines.append(f'artcrypt_op_duration_ms_bucket{{op="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'artcrypt_op_duration_ms_bucket{{op="{name}",le="+Inf"}} {op["count"]}')
+        lines.append(f'artcrypt_op_duration_ms_sum{{op="{name}"}} {op["total_ms"]:.3f}')
+        lines.append(f'artcrypt_op_duration_ms_count{{op="{name}"}} {op["count"]}')
+    for counter, value in sorted(snapshot['counters'].items()):
+        metric = f'artcrypt_{_metric_name(counter)}_total'
+        lines.append(f'# TYPE {metric} counter')
+        lines.append(f'{metric} {value}')
+    return '\n'.join(lines) + '\n'
+
+def export_json(snapshot=None):
+    return json.dumps(snapshot or registry.snapshot(), indent=2)
+
+def write_metrics_file(path):
+    """Tulis snapshot secara atomik: .json → JSON, selain itu teks Prometheus"""
+    content = export_json() if path.endswith('.json') else export_prometheus()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+def start_exporter(path=None, interval=None):
+    """
+    Thread background yang menulis ARTCRYPT_METRICS_FILE setiap ARTCRYPT_METRICS_INTERVAL detik
+    (mis. untuk textfile collector node_exporter). Tidak melakukan apa-apa jika nonaktif.
+    """
+    global _exporter
+    path = path or os.environ.get('ARTCRYPT_METRICS_FILE')
+    interval = interval or float(os.environ.get('ARTCRYPT_METRICS_INTERVAL', '15'))
+    if not ENABLED or not path:
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            def loop():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        write_metrics_file(path)
+                    except OSError as e:
+                        print(f"⚠️ Gagal menulis metrics: {e}")
+            _exporter = threading.Thread(target=loop, name='artcrypt-metrics', daemon=True)
+            _exporter.start()
+    return _exporter
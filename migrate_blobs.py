@@ -0,0 +1,92 @@
+import argparse
+import threading
+from connection import get_connection, transaction, init_db
+from blob_store import get_blob_store, release_blob
+
+# Baris lama dengan file_data inline: kolom setelah file_data (blob_ref, blob_size, wrapped_key, ...)
+# hanya bisa dibaca dengan menelusuri overflow page BLOB-nya, jadi galeri/dashboard melambat
+# sampai semua file dipindahkan ke blob store.
+INLINE_CONDITION = "blob_ref IS NULL AND file_data IS NOT NULL"
+
+def count_inline_rows():
+    with get_connection() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM artworks WHERE {INLINE_CONDITION}").fetchone()[0]
+
+def migrate_blobs(batch_size=20, vacuum=False, stop_event=None, verbose=False):
+    """
+    Pindahkan artworks.file_data inline ke blob store, simpan hanya referensi + ukuran.
+    Blob ditulis di luar transaksi; kunci tulis hanya dipegang sebentar per baris (app tetap bisa menulis).
+    verbose: cetak progres per baris (CLI; thread background app cukup ringkasan akhir).
+    """
+    store = get_blob_store()
+    moved = 0
+    total_bytes = 0
+    last_id = 0
+    while stop_event is None or not stop_event.is_set():
+        # Ambil id saja dulu (tanpa blob) agar memori tetap kecil
+        with get_connection() as conn:
+            ids = [row[0] for row in conn.execute(f'''
+                SELECT id FROM artworks WHERE id > ? AND {INLINE_CONDITION}
+                ORDER BY id LIMIT ?
+            ''', (last_id, batch_size))]
+        if not ids:
+            break
+
+        for art_id in ids:
+            with get_connection() as conn:
+                row = conn.execute(f"SELECT file_data FROM artworks WHERE id = ? AND {INLINE_CONDITION}",
+                                   (art_id,)).fetchone()
+            if row is None:
+                continue
+            file_data = row[0].encode() if isinstance(row[0], str) else row[0]
+            key = store.put(file_data)
+            with transaction() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                cursor = conn.execute('''
+                    UPDATE artworks SET blob_ref = ?, blob_size = ?, file_data = NULL
+                    WHERE id = ? AND blob_ref IS NULL
+                ''', (key, len(file_data), art_id))
+            if cursor.rowcount == 0:
+                # Baris dihapus/diganti (mis. re-encrypt) sejak dibaca: blob ini tidak dipakai
+                release_blob(key, store)
+                continue
+            moved += 1
+            total_bytes += len(file_data)
+            if verbose:
+                print(f"  ID {art_id}: {len(file_data):,} bytes → {key[:16]}...")
+        last_id = ids[-1]
+
+    if vacuum:
+        print("🧹 VACUUM database...")
+        with get_connection() as conn:
+            conn.execute("VACUUM")
+
+    print(f"✅ {moved} artwork dipindahkan ({total_bytes / (1024 * 1024):.2f} MB)")
+    return moved
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def start_background_migration(batch_size=20):
+    """Migrasi di thread daemon (sekali per proses) jika masih ada baris inline. Return thread atau None."""
+    global _worker
+    with _worker_lock:
+        if _worker is not None and _worker.is_alive():
+            return _worker
+        if count_inline_rows() == 0:
+            return None
+        _worker = threading.Thread(target=migrate_blobs, args=(batch_size,),
+                                   name="blob-migration", daemon=True)
+        _worker.start()
+        return _worker
+
+def migration_running():
+    return _worker is not None and _worker.is_alive()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrasi file_data inline ke blob store")
+    parser.add_argument('--batch-size', type=int, default=20)
+    parser.add_argument('--vacuum', action='store_true', help="VACUUM database setelah migrasi")
+    args = parser.parse_args()
+    init_db()
+    migrate_blobs(batch_size=args.batch_size, vacuum=args.vacuum, verbose=True)
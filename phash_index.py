@@ -0,0 +1,278 @@
+import argparse
+import os
+import threading
+from functools import lru_cache
+from io import BytesIO
+from itertools import combinations
+import numpy as np
+from PIL import Image
+import metrics
+from metrics import timed
+from connection import get_connection, transaction, init_db
+from crypto_utils import encrypt_metadata, decrypt_metadata, decrypt_file
+from blob_store import load_encrypted_file
+from key_manager import AUTH_KEY, artwork_key, hmac_for
+
+# pHash 64 bit: DCT 32x32 grayscale → koefisien frekuensi rendah 8x8 dibandingkan median.
+# Tahan resize/kompresi ulang (watermark LSB tidak), jarak = Hamming distance.
+HASH_BITS = 64
+DCT_SIZE = 32
+LOW_FREQ = 8
+PHASH_MAX_DISTANCE = int(os.environ.get('ARTCRYPT_PHASH_MAX_DISTANCE', '10'))
+PHASH_TOP_K = 5
+# Potongan multi-index (4 × 16 bit): radius 10 → tetangga <= 2 bit per potongan
+MIH_CHUNKS = 4
+
+def _dct_matrix(n):
+    """Matriks DCT-II ortonormal (DCT 2D = M @ X @ M.T, tanpa SciPy)"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.sqrt(2 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+_DCT = _dct_matrix(DCT_SIZE)
+
+@timed('phash.compute')
+def perceptual_hash(image_data):
+    """Gambar (bytes atau file-like) → pHash 64 bit (int)"""
+    img = Image.open(image_data if hasattr(image_data, 'read') else BytesIO(image_data))
+    # JPEG: decode langsung di skala kecil (cukup untuk 32x32)
+    img.draft('L', (DCT_SIZE * 2, DCT_SIZE * 2))
+    pixels = np.asarray(img.convert('L').resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS), dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:LOW_FREQ, :LOW_FREQ].ravel()
+    # Median tanpa koefisien DC (rata-rata kecerahan)
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+# === BLINDING ===
+# Bentuk yang bisa dicari: permutasi bit ber-key lalu XOR mask ber-key (keduanya dari AUTH_KEY).
+# Hamming distance antar hash tetap sama, tetapi pHash asli tidak tersimpan di DB
+# (salinan asli hanya di phash_encrypted, terenkripsi data key artwork).
+def _blind_digest(label):
+    h = hmac_for(AUTH_KEY, 'sha256')
+    h.update(b'phash-blind:' + label)
+    return h.finalize()
+
+_blind_params = None
+
+def _get_blind_params():
+    global _blind_params
+    if _blind_params is None:
+        permutation = sorted(range(HASH_BITS), key=lambda bit: _blind_digest(b'perm:%d' % bit))
+        mask = int.from_bytes(_blind_digest(b'mask')[:HASH_BITS // 8], 'big')
+        _blind_params = (permutation, mask)
+    return _blind_params
+
+def blind_hash(value):
+    """pHash → nilai index (int 64 bit); hamming(blind(a), blind(b)) == hamming(a, b)"""
+    permutation, mask = _get_blind_params()
+    blinded = 0
+    for dst, src in enumerate(permutation):
+        if value >> src & 1:
+            blinded |= 1 << dst
+    return blinded ^ mask
+
+def encode_index(value):
+    return value.to_bytes(HASH_BITS // 8, 'big')
+
+def decode_index(data):
+    return int.from_bytes(data, 'big')
+
+def phash_columns(image_data, key):
+    """Gambar → (phash_encrypted, phash_index) siap disimpan (aman di worker process)"""
+    value = perceptual_hash(image_data)
+    return encrypt_metadata(f'{value:016x}', key=key), encode_index(blind_hash(value))
+
+def suspect_hash(image_data):
+    """Gambar yang dicurigai → nilai index (CPU saja, tanpa DB)"""
+    return blind_hash(perceptual_hash(image_data))
+
+# === MULTI-INDEX HASHING ===
+@lru_cache(maxsize=None)
+def _flip_masks(bits, radius):
+    """Semua mask XOR dengan <= radius bit aktif dalam potongan selebar bits"""
+    return [sum(1 << b for b in flipped)
+            for r in range(radius + 1) for flipped in combinations(range(bits), r)]
+
+class MultiIndexHash:
+    """
+    Multi-index hashing: hash 64 bit dibagi `chunks` potongan, tiap potongan punya dict potongan → hash.
+    Pigeonhole: jika hamming(a, b) <= r, minimal satu potongan berjarak <= r // chunks, jadi kandidat
+    cukup diambil dari bucket tetangga potongan query (bukan scan semua hash), lalu dicek jarak penuh.
+    """
+
+    def __init__(self, chunks=MIH_CHUNKS):
+        self.chunks = chunks
+        self.bits = HASH_BITS // chunks
+        self.tables = [{} for _ in range(chunks)]
+        self.items = {}  # hash → [item] (hash identik disimpan sekali)
+        self.size = 0
+
+    def _parts(self, value):
+        mask = (1 << self.bits) - 1
+        return [(value >> (i * self.bits)) & mask for i in range(self.chunks)]
+
+    def add(self, value, item):
+        self.size += 1
+        items = self.items.get(value)
+        if items is not None:
+            items.append(item)
+            return
+        self.items[value] = [item]
+        for table, part in zip(self.tables, self._parts(value)):
+            table.setdefault(part, []).append(value)
+
+    def nearest(self, value, k=PHASH_TOP_K, max_distance=PHASH_MAX_DISTANCE, accept=None, stats=None):
+        """
+        k item terdekat dengan jarak <= max_distance → list (jarak, item) terurut.
+        accept: filter item (mis. pemilik). stats: dict yang diisi jumlah hash kandidat ('candidates').
+        """
+        masks = _flip_masks(self.bits, max_distance // self.chunks)
+        seen = set()
+        found = []
+        for table, part in zip(self.tables, self._parts(value)):
+            for mask in masks:
+                for candidate in table.get(part ^ mask, ()):
+                    if candidate in seen:
+                        continue
+                    seen.add(candidate)
+                    distance = hamming(value, candidate)
+                    if distance > max_distance:
+                        continue
+                    found.extend((distance, item) for item in self.items[candidate]
+                                 if accept is None or accept(item))
+        if stats is not None:
+            stats['candidates'] = len(seen)
+        return sorted(found)[:k]
+
+def brute_force_nearest(entries, value, k=PHASH_TOP_K, max_distance=PHASH_MAX_DISTANCE, accept=None):
+    """Pembanding (benchmark/cek): scan linear semua (hash, item)"""
+    found = [(hamming(value, h), item) for h, item in entries if accept is None or accept(item)]
+    return sorted((d, item) for d, item in found if d <= max_distance)[:k]
+
+# === INDEX IN-MEMORY ===
+class PhashIndex:
+    """Multi-index semua artwork ber-phash_index, disegarkan dari DB sebelum setiap pencarian"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.hashes = MultiIndexHash()
+        self.max_id = 0
+        self.version = None  # (inserts, changes) dari tabel phash_version
+
+    def _load(self, conn, after_id):
+        for art_id, owner_id, value in conn.execute('''
+            SELECT id, user_id, phash_index FROM artworks
+            WHERE phash_index IS NOT NULL AND id > ? ORDER BY id
+        ''', (after_id,)):
+            self.hashes.add(decode_index(value), (art_id, owner_id))
+            self.max_id = art_id
+
+    def refresh(self, conn):
+        """
+        Versi dari phash_version (dijaga trigger, satu baris): upload baru (inserts) ditambahkan
+        inkremental, update/hapus/backfill (changes) → bangun ulang.
+        """
+        version = tuple(conn.execute("SELECT inserts, changes FROM phash_version WHERE id = 1").fetchone())
+        with self.lock:
+            if version == self.version:
+                return
+            # Versi dibaca sebelum memuat: perubahan bersamaan paling buruk dimuat ulang di pencarian berikutnya
+            if self.version is None or version[1] != self.version[1]:
+                self._reset()
+                self._load(conn, 0)
+            else:
+                self._load(conn, self.max_id)
+            self.version = version
+
+    def nearest(self, value, user_id=None, k=PHASH_TOP_K, max_distance=PHASH_MAX_DISTANCE):
+        accept = None if user_id is None else (lambda item: item[1] == user_id)
+        with self.lock:
+            return self.hashes.nearest(value, k, max_distance, accept)
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_phash_index():
+    """PhashIndex bersama per proses (dibangun saat pertama dipakai)"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = PhashIndex()
+        return _index
+
+def find_similar(conn, value, user_id=None, k=PHASH_TOP_K, max_distance=PHASH_MAX_DISTANCE):
+    """Nilai index gambar yang dicurigai → artwork termirip (list dict, terdekat dulu)"""
+    index = get_phash_index()
+    with metrics.timer('phash.search'):
+        index.refresh(conn)
+        found = index.nearest(value, user_id, k, max_distance)
+    return [
+        {'artwork_id': art_id, 'user_id': owner_id, 'distance': distance,
+         'similarity': round(1 - distance / HASH_BITS, 3)}
+        for distance, (art_id, owner_id) in found
+    ]
+
+def match_similar(image_data, user_id=None, k=PHASH_TOP_K, max_distance=PHASH_MAX_DISTANCE):
+    """Verifikasi 1:N tanpa watermark: gambar (boleh di-resize/kompresi ulang) → karya asli termirip"""
+    value = suspect_hash(image_data)
+    with get_connection() as conn:
+        return find_similar(conn, value, user_id, k, max_distance)
+
+# === BACKFILL ===
+def backfill_phash(batch_size=50, rebuild=False):
+    """
+    Isi phash_encrypted/phash_index gambar lama. rebuild=True: hitung ulang phash_index semua
+    gambar dari phash_encrypted (mis. setelah rotasi AUTH_KEY), tanpa dekripsi file.
+    Return jumlah artwork.
+    """
+    count = 0
+    last_id = 0
+    pending = "" if rebuild else "AND phash_index IS NULL"
+    while True:
+        with get_connection() as conn:
+            rows = conn.execute(f'''
+                SELECT id, user_id, wrapped_key, phash_encrypted FROM artworks
+                WHERE id > ? AND file_type LIKE 'image%' {pending}
+                ORDER BY id LIMIT ?
+            ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            return count
+
+        updates = []
+        for art_id, user_id, wrapped_key, phash_enc in rows:
+            try:
+                key = artwork_key(user_id, wrapped_key)
+                if phash_enc is not None:
+                    value = int(decrypt_metadata(phash_enc, key), 16)
+                else:
+                    # file_data hanya dibaca untuk baris yang belum punya pHash
+                    with get_connection() as conn:
+                        file_data, blob_ref = conn.execute(
+                            "SELECT file_data, blob_ref FROM artworks WHERE id = ?", (art_id,)).fetchone()
+                    value = perceptual_hash(decrypt_file(load_encrypted_file(file_data, blob_ref), key))
+                    phash_enc = encrypt_metadata(f'{value:016x}', key=key)
+                updates.append((phash_enc, encode_index(blind_hash(value)), art_id))
+            except Exception as e:
+                print(f"  ⚠️ ID {art_id}: {e}")
+        with transaction() as conn:
+            conn.executemany("UPDATE artworks SET phash_encrypted = ?, phash_index = ? WHERE id = ?", updates)
+        count += len(updates)
+        last_id = rows[-1][0]
+        print(f"  🧬 {count} artwork (sampai ID {last_id})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill perceptual hash (pencarian gambar mirip) untuk gambar lama")
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Hitung ulang phash_index semua gambar dari phash_encrypted (setelah rotasi AUTH_KEY)")
+    args = parser.parse_args()
+    init_db()
+    print(f"✅ pHash dibuat untuk {backfill_phash(args.batch_size, args.rebuild)} artwork")
@@ -0,0 +1,131 @@
+import argparse
+import re
+import unicodedata
+from connection import get_connection, transaction, init_db
+from crypto_utils import decrypt_metadata
+from key_manager import AUTH_KEY, artwork_key, hmac_for
+
+# Blind index pencarian: token = HMAC(AUTH_KEY, user | jenis | term) terpotong 16 byte.
+# DB hanya menyimpan token; term plaintext tidak pernah ditulis.
+TOKEN_BYTES = 16
+TRIGRAM_MIN_LEN = 3
+SEARCH_LIMIT = 200
+_WORD_RE = re.compile(r'\w+')
+
+def normalize_text(text):
+    """Lowercase (casefold) + buang diakritik (é → e) + NFKC"""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return unicodedata.normalize('NFKC', stripped).casefold()
+
+def words(text):
+    return _WORD_RE.findall(normalize_text(text))
+
+def trigrams(word):
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+def search_token(user_id, kind, term):
+    """Token blind index per user (kata 'w' atau trigram 't'); user berbeda → token berbeda"""
+    h = hmac_for(AUTH_KEY, 'sha256')
+    h.update(f'search:{user_id}:{kind}:{term}'.encode())
+    return h.finalize()[:TOKEN_BYTES]
+
+def index_tokens(user_id, *texts):
+    """Token untuk judul/deskripsi: setiap kata + trigram kata (pencarian sebagian kata)"""
+    terms = set()
+    for text in texts:
+        for word in words(text):
+            terms.add(('w', word))
+            terms.update(('t', gram) for gram in trigrams(word))
+    return sorted({search_token(user_id, kind, term) for kind, term in terms})
+
+def query_tokens(user_id, query):
+    """
+    Token yang HARUS dimiliki artwork: kata pendek (< 3 huruf) → token kata persis,
+    selain itu semua trigram kata (cocok juga untuk potongan kata, mis. 'lukis' → 'melukis').
+    """
+    tokens = set()
+    for word in words(query):
+        if len(word) < TRIGRAM_MIN_LEN:
+            tokens.add(search_token(user_id, 'w', word))
+        else:
+            tokens.update(search_token(user_id, 't', gram) for gram in trigrams(word))
+    return sorted(tokens)
+
+def matches_query(query, *texts):
+    """Cek ulang plaintext hasil dekripsi (trigram bisa menghasilkan kandidat palsu)"""
+    haystack = [words(text) for text in texts]
+    for word in words(query):
+        if len(word) < TRIGRAM_MIN_LEN:
+            found = any(word in text_words for text_words in haystack)
+        else:
+            found = any(word in w for text_words in haystack for w in text_words)
+        if not found:
+            return False
+    return True
+
+def save_search_tokens(conn, art_id, tokens):
+    """Ganti token satu artwork (dalam transaksi milik pemanggil)"""
+    delete_search_tokens(conn, art_id)
+    conn.executemany("INSERT OR IGNORE INTO artwork_search_tokens (token, artwork_id) VALUES (?, ?)",
+                     [(token, art_id) for token in tokens])
+
+def delete_search_tokens(conn, art_id):
+    conn.execute("DELETE FROM artwork_search_tokens WHERE artwork_id = ?", (art_id,))
+
+def find_candidates(conn, user_id, query, limit=SEARCH_LIMIT):
+    """ID artwork milik user yang memiliki semua token query (lookup index, tanpa dekripsi)"""
+    tokens = query_tokens(user_id, query)
+    if not tokens:
+        return []
+    # Mulai dari token (primary key) lalu cek pemilik: biaya sebanding jumlah posting, bukan jumlah karya
+    rows = conn.execute(f'''
+        SELECT c.artwork_id FROM (
+            SELECT artwork_id FROM artwork_search_tokens
+            WHERE token IN ({', '.join('?' * len(tokens))})
+            GROUP BY artwork_id HAVING COUNT(*) = ?
+        ) c JOIN artworks a ON a.id = c.artwork_id AND a.user_id = ?
+        ORDER BY c.artwork_id DESC LIMIT ?
+    ''', (*tokens, len(tokens), user_id, limit))
+    return [row[0] for row in rows]
+
+def search_artworks(user_id, query, limit=SEARCH_LIMIT):
+    """Pencarian: kandidat dari blind index → list id (urut terbaru), belum diverifikasi"""
+    with get_connection() as conn:
+        return find_candidates(conn, user_id, query, limit)
+
+def backfill_search_index(batch_size=200):
+    """Buat token untuk artwork lama yang belum terindeks. Return jumlah artwork."""
+    count = 0
+    last_id = 0
+    while True:
+        with get_connection() as conn:
+            rows = conn.execute('''
+                SELECT id, user_id, wrapped_key, title_encrypted, description_encrypted FROM artworks a
+                WHERE id > ? AND NOT EXISTS (SELECT 1 FROM artwork_search_tokens t WHERE t.artwork_id = a.id)
+                ORDER BY id LIMIT ?
+            ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            return count
+
+        indexed = []
+        for art_id, user_id, wrapped_key, title_enc, desc_enc in rows:
+            try:
+                key = artwork_key(user_id, wrapped_key)
+                indexed.append((art_id, index_tokens(user_id, decrypt_metadata(title_enc, key),
+                                                     decrypt_metadata(desc_enc, key) if desc_enc else '')))
+            except Exception as e:
+                print(f"  ⚠️ ID {art_id}: {e}")
+        with transaction() as conn:
+            for art_id, tokens in indexed:
+                save_search_tokens(conn, art_id, tokens)
+        count += len(indexed)
+        last_id = rows[-1][0]
+        print(f"  🔎 {count} artwork (sampai ID {last_id})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill blind index pencarian judul/deskripsi untuk karya lama")
+    parser.add_argument('--batch-size', type=int, default=200)
+    args = parser.parse_args()
+    init_db()
+    print(f"✅ Index pencarian dibuat untuk {backfill_search_index(args.batch_size)} artwork")
@@ -0,0 +1,71 @@
+import argparse
+import threading
+from connection import get_connection, transaction, init_db
+from crypto_utils import decrypt_metadata, encrypt_metadata
+from key_manager import artwork_key
+
+# Kolom metadata terenkripsi yang di-upgrade ke envelope v2
+METADATA_COLUMNS = ('title_encrypted', 'description_encrypted', 'watermark_data')
+
+def upgrade_metadata_batch(batch_size=100, after_id=0):
+    """
+    Re-encrypt satu batch baris lama (TEXT Base64 tiga lapis) ke envelope v2 (BLOB).
+    Return (jumlah baris, id terakhir) — id terakhir None jika tidak ada lagi.
+    """
+    with get_connection() as conn:
+        rows = conn.execute(f'''
+            SELECT id, user_id, wrapped_key, {", ".join(METADATA_COLUMNS)} FROM artworks
+            WHERE id > ? AND ({" OR ".join(f"typeof({c}) = 'text'" for c in METADATA_COLUMNS)})
+            ORDER BY id LIMIT ?
+        ''', (after_id, batch_size)).fetchall()
+    if not rows:
+        return 0, None
+
+    updates = []
+    for art_id, user_id, wrapped_key, *values in rows:
+        try:
+            key = artwork_key(user_id, wrapped_key)
+            upgraded = [encrypt_metadata(decrypt_metadata(v, key), key=key) if isinstance(v, str) else v
+                        for v in values]
+        except Exception as e:
+            print(f"  ⚠️ ID {art_id}: {e}")
+            continue
+        # Update hanya jika nilai lama belum berubah (aman jika baris diedit bersamaan)
+        updates.append((*upgraded, art_id, *values))
+
+    set_clause = ", ".join(f"{c} = ?" for c in METADATA_COLUMNS)
+    where_clause = " AND ".join(f"{c} IS ?" for c in METADATA_COLUMNS)
+    with transaction() as conn:
+        conn.executemany(f"UPDATE artworks SET {set_clause} WHERE id = ? AND {where_clause}", updates)
+    return len(updates), rows[-1][0]
+
+def upgrade_all_metadata(batch_size=100, stop_event=None):
+    """Upgrade seluruh tabel per batch. Return jumlah baris yang di-upgrade."""
+    total = 0
+    last_id = 0
+    while stop_event is None or not stop_event.is_set():
+        count, last_id = upgrade_metadata_batch(batch_size, last_id)
+        if last_id is None:
+            break
+        total += count
+    return total
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def start_background_upgrade(batch_size=100):
+    """Jalankan upgrade di thread daemon (sekali per proses). Return thread."""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=upgrade_all_metadata, args=(batch_size,),
+                                       name="metadata-upgrade", daemon=True)
+            _worker.start()
+        return _worker
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upgrade metadata lama ke envelope v2 (AES-256-GCM)")
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args()
+    init_db()
+    print(f"✅ {upgrade_all_metadata(args.batch_size)} artwork di-upgrade")
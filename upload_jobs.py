@@ -0,0 +1,313 @@
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+from io import BytesIO
+from connection import get_connection, transaction, init_db
+from crypto_utils import encrypt_metadata, decrypt_metadata
+from blob_store import get_blob_store
+from key_manager import AUTH_KEY, new_data_key, artwork_key, get_aesgcm, hmac_for
+from upload_pipeline import process_upload, insert_artworks, release_result_blobs, count_stage
+
+# Job upload: form hanya menaruh input (terenkripsi) ke antrian, worker process yang memproses
+JOB_WORKERS = int(os.environ.get('ARTCRYPT_JOB_WORKERS', '2'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('ARTCRYPT_JOB_MAX_ATTEMPTS', '3'))
+JOB_LEASE_SECONDS = float(os.environ.get('ARTCRYPT_JOB_LEASE', '600'))
+JOB_POLL_INTERVAL = 1.0
+RETRY_BASE_SECONDS = 5  # backoff: 5 s, 10 s, 20 s, ...
+# Input > batas ini di-spool ke file temp di worker (bukan RAM)
+SPOOL_MAX_BYTES = int(float(os.environ.get('ARTCRYPT_UPLOAD_SPOOL_MB', '32')) * 1024 * 1024)
+
+# Input antrian: header (prefix nonce 8 | ukuran chunk 4) | per chunk: ciphertext + tag GCM (16)
+# Nonce chunk = prefix | index; AAD = index | flag chunk terakhir (chunk tidak bisa ditukar/dipotong)
+INPUT_AAD = b'artcrypt-job-input'
+STAGE_CHUNK_SIZE = 1024 * 1024
+STAGE_HEADER = struct.Struct('>8sI')
+STAGE_CHUNK_AAD = struct.Struct('>I?')
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# Job yang tidak lagi menghalangi submit ulang dengan idempotency key yang sama
+_STALE_JOB = (f"status = '{JOB_FAILED}' OR (status = '{JOB_DONE}' "
+              f"AND artwork_id NOT IN (SELECT id FROM artworks))")
+
+def idempotency_key_for(user_id, title, description, file_type, file_data, bit_planes=None):
+    """HMAC-SHA256 isi upload → hex; submit ulang yang identik (rerun/klik ganda) tidak membuat job baru"""
+    h = hmac_for(AUTH_KEY, 'sha256')
+    h.update(b'upload-job:' + json.dumps([user_id, title, description, file_type, bit_planes]).encode())
+    h.update(file_data)
+    return h.finalize().hex()
+
+def _stage_nonce(prefix, index):
+    return prefix + struct.pack('>I', index)
+
+def stage_input(data, key, writer, chunk_size=STAGE_CHUNK_SIZE):
+    """
+    File mentah → AES-256-GCM per chunk (data key artwork) → writer; tanpa plaintext di disk.
+    data: bytes-like, dipotong via memoryview (tanpa salinan plaintext).
+    """
+    aesgcm = get_aesgcm(key)
+    prefix = os.urandom(8)
+    writer.write(STAGE_HEADER.pack(prefix, chunk_size))
+    view = memoryview(data).cast('B')
+    index = 0
+    offset = 0
+    while True:
+        chunk = view[offset:offset + chunk_size]
+        offset += len(chunk)
+        last = offset >= len(view)
+        writer.write(aesgcm.encrypt(_stage_nonce(prefix, index), chunk,
+                                    INPUT_AAD + STAGE_CHUNK_AAD.pack(index, last)))
+        if last:
+            return
+        index += 1
+
+def unstage_input(reader, key, writer):
+    """Kebalikan stage_input secara streaming: reader (blob) → plaintext per chunk → writer"""
+    aesgcm = get_aesgcm(key)
+    prefix, chunk_size = STAGE_HEADER.unpack(reader.read(STAGE_HEADER.size))
+    frame_size = chunk_size + 16
+    frame = reader.read(frame_size)
+    index = 0
+    while True:
+        # Baca satu frame ke depan untuk tahu apakah ini chunk terakhir
+        next_frame = reader.read(frame_size) if len(frame) == frame_size else b''
+        last = not next_frame
+        writer.write(aesgcm.decrypt(_stage_nonce(prefix, index), frame,
+                                    INPUT_AAD + STAGE_CHUNK_AAD.pack(index, last)))
+        if last:
+            return
+        frame = next_frame
+        index += 1
+
+def enqueue_upload(user_id, title, description, file_type, file_data, bit_planes=None,
+                   idempotency_key=None, max_attempts=JOB_MAX_ATTEMPTS):
+    """
+    Masukkan upload ke antrian (cepat: tanpa watermark/enkripsi berlapis). Return (job_id, created).
+    Job dengan idempotency key yang sama yang masih aktif, atau selesai dan artwork-nya masih ada,
+    dikembalikan apa adanya (created=False).
+    """
+    idempotency_key = idempotency_key or idempotency_key_for(
+        user_id, title, description, file_type, file_data, bit_planes)
+    with get_connection() as conn:
+        row = conn.execute(f'''
+            SELECT id FROM upload_jobs WHERE user_id = ? AND idempotency_key = ? AND NOT ({_STALE_JOB})
+        ''', (user_id, idempotency_key)).fetchone()
+    if row:
+        return row[0], False
+
+    # Data key artwork dibuat sekarang: metadata & input antrian sudah terenkripsi dengan key yang sama
+    data_key, wrapped_key = new_data_key(user_id)
+    store = get_blob_store()
+    stages = {}
+    input_ref, staged_size = store.put_with(lambda writer: stage_input(file_data, data_key, writer))
+    count_stage(stages, 'stage_input', staged_size)
+    try:
+        with transaction() as conn:
+            # Job gagal / artwork sudah dihapus: key yang sama boleh di-submit ulang
+            conn.execute(f"DELETE FROM upload_jobs WHERE user_id = ? AND idempotency_key = ? AND {_STALE_JOB}",
+                         (user_id, idempotency_key))
+            cursor = conn.execute('''
+                INSERT INTO upload_jobs (user_id, idempotency_key, status, file_type, title_encrypted,
+                                         description_encrypted, wrapped_key, bit_planes, input_ref,
+                                         input_size, stage_bytes, max_attempts, run_after,
+                                         created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                ON CONFLICT (user_id, idempotency_key) DO NOTHING
+            ''', (user_id, idempotency_key, JOB_QUEUED, file_type,
+                  encrypt_metadata(title, key=data_key), encrypt_metadata(description, key=data_key),
+                  wrapped_key, json.dumps(bit_planes) if bit_planes else None, input_ref,
+                  memoryview(file_data).nbytes, json.dumps(stages), max_attempts, time.time()))
+            job_id = cursor.lastrowid if cursor.rowcount else None
+            if job_id is None:
+                # Kalah balapan dengan submit identik lain
+                job_id = conn.execute("SELECT id FROM upload_jobs WHERE user_id = ? AND idempotency_key = ?",
+                                      (user_id, idempotency_key)).fetchone()[0]
+    except BaseException:
+        store.delete(input_ref)
+        raise
+    if cursor.rowcount == 0:
+        store.delete(input_ref)
+        return job_id, False
+    return job_id, True
+
+def claim_job(worker_id, now=None):
+    """
+    Ambil satu job secara atomik (satu UPDATE ... RETURNING): antrian yang sudah waktunya,
+    atau job running yang lease-nya habis (worker mati). Return dict job atau None.
+    """
+    now = now or time.time()
+    with transaction() as conn:
+        row = conn.execute('''
+            UPDATE upload_jobs
+            SET status = ?, attempts = attempts + 1, locked_by = ?, locked_at = ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM upload_jobs
+                WHERE (status = ? AND run_after <= ?) OR (status = ? AND locked_at < ?)
+                ORDER BY id LIMIT 1
+            )
+            RETURNING id, user_id, file_type, title_encrypted, description_encrypted,
+                      wrapped_key, bit_planes, input_ref, input_size, stage_bytes, attempts, max_attempts
+        ''', (JOB_RUNNING, worker_id, now, JOB_QUEUED, now, JOB_RUNNING, now - JOB_LEASE_SECONDS)).fetchone()
+    if row is None:
+        return None
+    keys = ('id', 'user_id', 'file_type', 'title_encrypted', 'description_encrypted',
+            'wrapped_key', 'bit_planes', 'input_ref', 'input_size', 'stage_bytes', 'attempts', 'max_attempts')
+    return dict(zip(keys, row))
+
+def run_job(job):
+    """
+    Pipeline crypto_utils untuk satu job → hasil process_upload (belum di-INSERT).
+    Input didekripsi per chunk ke spool: memori untuk input kecil, file temp untuk input besar.
+    """
+    user_id = job['user_id']
+    data_key = artwork_key(user_id, job['wrapped_key'])
+    stages = json.loads(job['stage_bytes'] or '{}')
+    on_disk = (job['input_size'] or 0) > SPOOL_MAX_BYTES
+    with (tempfile.TemporaryFile() if on_disk else BytesIO()) as spool:
+        with get_blob_store().open(job['input_ref']) as reader:
+            unstage_input(reader, data_key, spool)
+        count_stage(stages, 'spool_disk' if on_disk else 'spool_memory', spool.tell())
+        return process_upload(user_id, decrypt_metadata(job['title_encrypted'], data_key),
+                              decrypt_metadata(job['description_encrypted'], data_key),
+                              job['file_type'], spool,
+                              json.loads(job['bit_planes']) if job['bit_planes'] else None,
+                              keys=(data_key, job['wrapped_key']), stages=stages)
+
+def complete_job(job, worker_id, result):
+    """INSERT artwork + tandai job selesai dalam satu transaksi. Return artwork_id, None jika lease hilang."""
+    with transaction() as conn:
+        art_id = insert_artworks(conn, job['user_id'], [result])[0]
+        cursor = conn.execute('''
+            UPDATE upload_jobs SET status = ?, artwork_id = ?, stage_bytes = ?, error = NULL,
+                                   locked_by = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = ? AND locked_by = ?
+        ''', (JOB_DONE, art_id, json.dumps(result['stage_bytes']), job['id'], JOB_RUNNING, worker_id))
+        if cursor.rowcount == 0:
+            # Job sudah diambil alih worker lain (lease habis): batalkan INSERT
+            conn.rollback()
+            art_id = None
+    if art_id is None:
+        release_result_blobs([result])
+        return None
+    get_blob_store().delete(job['input_ref'])
+    return art_id
+
+def fail_job(job, worker_id, error):
+    """Jadwalkan ulang dengan backoff, atau tandai gagal permanen jika percobaan habis"""
+    final = job['attempts'] >= job['max_attempts']
+    with transaction() as conn:
+        cursor = conn.execute('''
+            UPDATE upload_jobs SET status = ?, error = ?, run_after = ?, locked_by = NULL,
+                                   updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = ? AND locked_by = ?
+        ''', (JOB_FAILED if final else JOB_QUEUED, error,
+              time.time() + RETRY_BASE_SECONDS * 2 ** (job['attempts'] - 1),
+              job['id'], JOB_RUNNING, worker_id))
+    if final and cursor.rowcount:
+        get_blob_store().delete(job['input_ref'])
+
+def process_next_job(worker_id):
+    """Klaim → proses → simpan satu job. Return False jika antrian kosong."""
+    job = claim_job(worker_id)
+    if job is None:
+        return False
+    if job['attempts'] > job['max_attempts']:
+        # Diambil ulang setelah lease habis, tetapi percobaan sudah habis
+        fail_job(dict(job, attempts=job['max_attempts']), worker_id, "Worker berhenti saat memproses job")
+        return True
+    try:
+        result = run_job(job)
+    except Exception as e:
+        fail_job(job, worker_id, str(e))
+        return True
+    try:
+        complete_job(job, worker_id, result)
+    except Exception as e:
+        release_result_blobs([result])
+        fail_job(job, worker_id, str(e))
+    return True
+
+def run_worker(poll_interval=JOB_POLL_INTERVAL, stop_event=None):
+    """Loop worker: proses job selama ada, tidur poll_interval saat antrian kosong"""
+    init_db()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    while stop_event is None or not stop_event.is_set():
+        try:
+            if process_next_job(worker_id):
+                continue
+        except Exception as e:
+            # Error database sementara (mis. locked): coba lagi di putaran berikutnya
+            print(f"⚠️ Worker {worker_id}: {e}")
+        time.sleep(poll_interval)
+
+def fetch_jobs(user_id, limit=20):
+    """Job terbaru milik user untuk polling status (tanpa input file)"""
+    with get_connection() as conn:
+        rows = conn.execute('''
+            SELECT id, status, file_type, title_encrypted, wrapped_key, input_size, stage_bytes,
+                   attempts, max_attempts, artwork_id, error, created_at, updated_at
+            FROM upload_jobs WHERE user_id = ? ORDER BY id DESC LIMIT ?
+        ''', (user_id, limit)).fetchall()
+    jobs = []
+    for (job_id, status, file_type, title_enc, wrapped_key, input_size, stage_bytes,
+         attempts, max_attempts, art_id, error, created_at, updated_at) in rows:
+        try:
+            title = decrypt_metadata(title_enc, artwork_key(user_id, wrapped_key))
+        except Exception:
+            title = "[Gagal dekripsi]"
+        jobs.append({'id': job_id, 'status': status, 'title': title, 'file_type': file_type,
+                     'input_size': input_size, 'stage_bytes': json.loads(stage_bytes or '{}'),
+                     'attempts': attempts, 'max_attempts': max_attempts,
+                     'artwork_id': art_id, 'error': error,
+                     'created_at': created_at, 'updated_at': updated_at})
+    return jobs
+
+def job_counts():
+    """Jumlah job per status (seluruh antrian)"""
+    with get_connection() as conn:
+        return dict(conn.execute("SELECT status, COUNT(*) FROM upload_jobs GROUP BY status").fetchall())
+
+def purge_finished_jobs(days=7):
+    """Hapus job selesai/gagal yang lebih lama dari N hari. Return jumlah baris."""
+    with transaction() as conn:
+        cursor = conn.execute('''
+            DELETE FROM upload_jobs
+            WHERE status IN (?, ?) AND updated_at < datetime('now', ?)
+        ''', (JOB_DONE, JOB_FAILED, f'-{days} days'))
+        return cursor.rowcount
+
+_workers = []
+_workers_lock = threading.Lock()
+
+def start_workers(count=JOB_WORKERS):
+    """Jalankan worker process lokal (sekali per proses; worker mati dijalankan ulang). Return list process."""
+    with _workers_lock:
+        _workers[:] = [p for p in _workers if p.is_alive()]
+        for _ in range(count - len(_workers)):
+            process = multiprocessing.Process(target=run_worker, name="upload-worker", daemon=True)
+            process.start()
+            _workers.append(process)
+        return list(_workers)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker antrian upload ArtCrypt")
+    parser.add_argument('--workers', type=int, default=JOB_WORKERS)
+    parser.add_argument('--purge-days', type=int, help="Hapus job selesai/gagal lebih lama dari N hari lalu keluar")
+    args = parser.parse_args()
+    init_db()
+    if args.purge_days is not None:
+        print(f"🧹 {purge_finished_jobs(args.purge_days)} job dihapus")
+    else:
+        print(f"⚙️ {args.workers} worker upload berjalan (Ctrl+C untuk berhenti)")
+        for process in start_workers(args.workers):
+            process.join()
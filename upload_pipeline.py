@@ -0,0 +1,169 @@
+import os
+from concurrent.futures import as_completed
+from io import BytesIO
+from connection import transaction
+import metrics
+from crypto_utils import (encrypt_metadata, encrypt_file_stream, embed_watermark_with_config,
+                          watermark_lookup_hash, WATERMARK_PRESETS, DEFAULT_WATERMARK_PRESET)
+from blob_store import get_blob_store, release_blob
+from key_manager import new_data_key
+from derivatives import build_derivatives, save_derivatives
+from search_index import index_tokens, save_search_tokens
+from phash_index import phash_columns
+
+def watermark_text_for(user_id, title):
+    """Teks watermark standar ArtCrypt"""
+    return f"ArtCrypt-{user_id}-{title}"
+
+def count_stage(stages, stage, nbytes):
+    """Catat byte yang disalin/ditulis satu tahap upload (dict hasil + counter metrics upload_<stage>_bytes)"""
+    stages[stage] = stages.get(stage, 0) + nbytes
+    metrics.count(f'upload_{stage}_bytes', nbytes)
+
+def _stream_size(reader):
+    """Ukuran file-like seekable; posisi dikembalikan ke awal"""
+    size = reader.seek(0, os.SEEK_END)
+    reader.seek(0)
+    return size
+
+def process_upload(user_id, title, description, file_type, file_data, bit_planes=None, keys=None, stages=None):
+    """
+    Tahap CPU-berat satu file (aman dijalankan di worker process):
+    enkripsi metadata → thumbnail/preview, pHash & watermark (gambar) → enkripsi file → tulis ke blob store.
+    file_data: bytes atau file-like seekable (mis. spool job queue; tidak dibaca utuh ke memori).
+    bit_planes: bit plane watermark (default: preset DEFAULT_WATERMARK_PRESET).
+    keys: (data_key, wrapped_key) yang sudah ada (job queue); default data key baru.
+    stages: dict byte per tahap yang ikut diisi (juga dikembalikan sebagai 'stage_bytes').
+    Payload akhir (asli atau hasil watermark) ditentukan dulu, lalu dienkripsi SEKALI secara
+    streaming langsung ke blob store (ciphertext tidak ditampung di memori).
+    Return dict siap di-INSERT (tanpa ciphertext file, hanya referensi blob).
+    """
+    # Data key acak per artwork, disimpan terbungkus KEK user
+    data_key, wrapped_key = keys or new_data_key(user_id)
+    title_enc = encrypt_metadata(title, key=data_key)
+    desc_enc = encrypt_metadata(description, key=data_key)
+    stages = {} if stages is None else stages
+    # BytesIO(bytes) berbagi buffer (tanpa salinan)
+    source = file_data if hasattr(file_data, 'read') else BytesIO(file_data)
+    source.seek(0)
+
+    # Watermark for images
+    watermark = None
+    watermark_lookup = None
+    watermark_config = None
+    phash_enc = None
+    phash_index = None
+    derivatives = []
+    payload = source
+    try:
+        if file_type.startswith('image'):
+            # Thumbnail & preview dari file asli (JPEG bisa di-decode langsung di skala kecil)
+            derivatives = build_derivatives(source, data_key)
+            count_stage(stages, 'derivatives', sum(d['blob_size'] for d in derivatives))
+            source.seek(0)
+            # pHash dari file asli: index gambar mirip (verifikasi saat watermark rusak)
+            phash_enc, phash_index = phash_columns(source, data_key)
+            source.seek(0)
+            watermark_text = watermark_text_for(user_id, title)
+            watermarked, watermark_config = embed_watermark_with_config(
+                source, watermark_text,
+                bit_planes or WATERMARK_PRESETS[DEFAULT_WATERMARK_PRESET]['bit_planes'])
+            count_stage(stages, 'watermark', len(watermarked))
+            payload = BytesIO(watermarked)
+            watermark = encrypt_metadata(watermark_text, key=data_key)
+            watermark_lookup = watermark_lookup_hash(watermark_text)
+
+        file_size = _stream_size(payload)
+        with metrics.timer('upload.encrypt_file'):
+            blob_ref, blob_size = get_blob_store().put_with(
+                lambda writer: encrypt_file_stream(payload, writer, key=data_key))
+        count_stage(stages, 'encrypt', blob_size)
+    except BaseException:
+        # Tahap setelah turunan gagal (pHash/watermark/enkripsi): turunan yang sudah ditulis
+        # tidak punya pemilik, hapus agar retry job tidak menumpuk blob yatim
+        for d in derivatives:
+            release_blob(d['blob_ref'])
+        raise
+    metrics.count('bytes_encrypted', file_size)
+
+    return {
+        'title_encrypted': title_enc,
+        'description_encrypted': desc_enc,
+        'file_type': file_type,
+        'watermark_data': watermark,
+        'watermark_lookup': watermark_lookup,
+        'watermark_config': watermark_config,
+        'phash_encrypted': phash_enc,
+        'phash_index': phash_index,
+        'blob_ref': blob_ref,
+        'blob_size': blob_size,
+        'file_size': file_size,
+        'wrapped_key': wrapped_key,
+        'derivatives': derivatives,
+        'search_tokens': index_tokens(user_id, title, description),
+        'stage_bytes': stages,
+    }
+
+def insert_artworks(conn, user_id, results):
+    """INSERT hasil process_upload + turunan & token pencarian (dalam transaksi milik pemanggil). Return list id artwork."""
+    art_ids = []
+    for r in results:
+        cursor = conn.execute('''
+            INSERT INTO artworks (user_id, title_encrypted, description_encrypted,
+                                file_type, watermark_data, watermark_lookup, watermark_config,
+                                phash_encrypted, phash_index,
+                                blob_ref, blob_size, file_size, wrapped_key, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (user_id, r['title_encrypted'], r['description_encrypted'], r['file_type'],
+              r['watermark_data'], r['watermark_lookup'], r['watermark_config'],
+              r.get('phash_encrypted'), r.get('phash_index'), r['blob_ref'],
+              r['blob_size'], r['file_size'], r['wrapped_key']))
+        save_derivatives(conn, cursor.lastrowid, r['derivatives'])
+        save_search_tokens(conn, cursor.lastrowid, r.get('search_tokens', []))
+        art_ids.append(cursor.lastrowid)
+    return art_ids
+
+def release_result_blobs(results):
+    """Bersihkan blob file & turunan yang sudah ditulis worker tetapi gagal disimpan"""
+    for r in results:
+        for blob_ref in [r['blob_ref'], *(d['blob_ref'] for d in r['derivatives'])]:
+            release_blob(blob_ref)
+
+def run_batch_upload(user_id, items, executor, progress=None):
+    """
+    Upload banyak file: tahap CPU-berat paralel di process pool milik pemanggil
+    (mis. CLI import; app memakai antrian upload_jobs), lalu semua hasil di-INSERT dalam satu transaksi.
+    items: list dict {name, title, description, file_type, data, bit_planes (opsional)}
+    progress: callback(done, total, name, error) dipanggil per file selesai.
+    Return (jumlah tersimpan, {name: pesan error}).
+    """
+    futures = {
+        executor.submit(process_upload, user_id, item['title'], item['description'],
+                        item['file_type'], item['data'], item.get('bit_planes')): item['name']
+        for item in items
+    }
+
+    results = []
+    errors = {}
+    for done, future in enumerate(as_completed(futures), start=1):
+        name = futures[future]
+        try:
+            results.append(future.result())
+            error = None
+        except Exception as e:
+            error = str(e)
+            errors[name] = error
+        if progress:
+            progress(done, len(futures), name, error)
+
+    if not results:
+        return 0, errors
+
+    try:
+        with transaction() as conn:
+            insert_artworks(conn, user_id, results)
+    except Exception:
+        # Batch gagal disimpan: bersihkan blob yang sudah ditulis worker
+        release_result_blobs(results)
+        raise
+    return len(results), errors
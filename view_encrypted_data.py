@@ -1,56 +1,248 @@
+import argparse
+import csv
+import json
+import os
 import sqlite3
-import base64
+import time
+from concurrent.futures import ProcessPoolExecutor
+from connection import DB_PATH
+from crypto_utils import decrypt_metadata
+from key_manager import artwork_key
 
-def view_encrypted_data():
-    conn = sqlite3.connect('artcrypt.db')
-    cursor = conn.cursor()
-    
+# Baris diambil per batch (fetchmany): memori tetap datar berapa pun ukuran database
+FETCH_SIZE = 500
+PREFIX_CHARS = 50
+MB = 1024 * 1024
+
+def _prefix_sql(column):
+    """Prefix tampilan dihitung di SQL: TEXT Base64 → 50 karakter, BLOB (envelope v2) → hex 25 byte"""
+    return (f"CASE typeof({column}) WHEN 'blob' THEN hex(substr({column}, 1, {PREFIX_CHARS // 2})) "
+            f"ELSE substr({column}, 1, {PREFIX_CHARS}) END")
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+def _column(present, name, fallback='NULL'):
+    """Kolom hasil migrasi belum ada di DB lama (dibuka read-only, tanpa init_db) → fallback"""
+    return name if name in present else fallback
+
+def _size_expr(present):
+    return f"COALESCE({_column(present, 'blob_size')}, length(file_data), 0)"
+
+def artwork_query(conn):
+    """SELECT daftar artwork sesuai kolom yang ada; file_data tidak pernah diambil (ukuran via length())"""
+    present = _columns(conn, 'artworks')
+    return f'''
+        SELECT id, user_id, file_type,
+               CASE WHEN {_column(present, 'blob_ref')} IS NOT NULL THEN 'blob'
+                    WHEN file_data IS NOT NULL THEN 'inline' ELSE 'none' END,
+               {_size_expr(present)}, {_column(present, 'file_size')},
+               length(title_encrypted), {_prefix_sql('title_encrypted')},
+               length(description_encrypted), {_prefix_sql('description_encrypted')},
+               length(watermark_data), {_prefix_sql('watermark_data')},
+               {_column(present, 'created_at')}
+        FROM artworks ORDER BY id
+    '''
+ARTWORK_FIELDS = ('id', 'user_id', 'file_type', 'storage', 'encrypted_size', 'plaintext_size',
+                  'title_len', 'title_prefix', 'description_len', 'description_prefix',
+                  'watermark_len', 'watermark_prefix', 'created_at')
+
+def user_query(conn):
+    present = _columns(conn, 'users')
+    return f'''
+        SELECT id, length(username_encrypted), {_prefix_sql('username_encrypted')},
+               length(password_encrypted), {_column(present, 'username_lookup')} IS NOT NULL
+        FROM users ORDER BY id
+    '''
+USER_FIELDS = ('id', 'username_len', 'username_prefix', 'password_len', 'has_lookup')
+
+def open_db(path=DB_PATH):
+    """Koneksi read-only (tanpa migrasi skema / init_db)"""
+    return sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+
+def iter_rows(conn, sql, params=(), size=FETCH_SIZE):
+    """Generator baris, diambil per batch fetchmany"""
+    cursor = conn.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield from rows
+
+def iter_artworks(conn):
+    return (dict(zip(ARTWORK_FIELDS, row)) for row in iter_rows(conn, artwork_query(conn)))
+
+def iter_users(conn):
+    return (dict(zip(USER_FIELDS, row)) for row in iter_rows(conn, user_query(conn)))
+
+def summarize(conn):
+    """Agregat total, per user, dan per tipe file — semuanya dihitung di SQL"""
+    present = _columns(conn, 'artworks')
+    size_expr = _size_expr(present)
+    file_size = _column(present, 'file_size')
+    blob_ref = _column(present, 'blob_ref')
+    totals = conn.execute(f'''
+        SELECT COUNT(*), COALESCE(SUM({size_expr}), 0), COALESCE(SUM({file_size}), 0),
+               SUM({blob_ref} IS NOT NULL), SUM({blob_ref} IS NULL AND file_data IS NOT NULL),
+               SUM(watermark_data IS NOT NULL), SUM({_column(present, 'wrapped_key')} IS NULL),
+               SUM(typeof(title_encrypted) = 'text')
+        FROM artworks
+    ''').fetchone()
+    summary = dict(zip(('artworks', 'encrypted_bytes', 'plaintext_bytes', 'in_blob_store', 'inline',
+                        'watermarked', 'legacy_key', 'legacy_metadata'), (v or 0 for v in totals)))
+    summary['users'] = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    # Satu scan via index (user_id, file_type): tanpa temp B-tree yang ikut menampung file_data.
+    # Hasilnya kecil (user × tipe), lalu dilipat menjadi agregat per user dan per tipe.
+    per_user = {}
+    per_type = {}
+    for user_id, file_type, count, encrypted, plaintext, inline in iter_rows(conn, f'''
+        SELECT user_id, file_type, COUNT(*), SUM({size_expr}), COALESCE(SUM({file_size}), 0),
+               SUM({blob_ref} IS NULL AND file_data IS NOT NULL)
+        FROM artworks GROUP BY user_id, file_type
+    '''):
+        user = per_user.setdefault(user_id, {'user_id': user_id, 'artworks': 0, 'encrypted_bytes': 0,
+                                             'plaintext_bytes': 0, 'images': 0, 'inline': 0})
+        kind = per_type.setdefault(file_type, {'file_type': file_type, 'artworks': 0,
+                                               'encrypted_bytes': 0, 'plaintext_bytes': 0})
+        for agg in (user, kind):
+            agg['artworks'] += count
+            agg['encrypted_bytes'] += encrypted
+            agg['plaintext_bytes'] += plaintext
+        user['inline'] += inline
+        if (file_type or '').startswith('image'):
+            user['images'] += count
+    summary['per_user'] = sorted(per_user.values(), key=lambda row: (row['user_id'] is None, row['user_id'] or 0))
+    summary['per_type'] = sorted(per_type.values(), key=lambda row: -row['artworks'])
+    return summary
+
+# === SAMPLE DECRYPTION ===
+def _decrypt_sample(row):
+    """Worker: dekripsi metadata satu artwork (hanya kolom metadata kecil, tanpa file)"""
+    art_id, user_id, wrapped_key, title_enc, desc_enc, watermark_enc = row
+    sample = {'id': art_id, 'user_id': user_id}
+    try:
+        key = artwork_key(user_id, wrapped_key)
+        sample['title'] = decrypt_metadata(title_enc, key)
+        sample['description'] = decrypt_metadata(desc_enc, key)
+        sample['watermark'] = decrypt_metadata(watermark_enc, key) if watermark_enc else None
+    except Exception as e:
+        sample['error'] = str(e)
+    return sample
+
+def decrypt_samples(conn, count, workers=None):
+    """Dekripsi metadata count artwork acak secara paralel (process pool)"""
+    if count <= 0:
+        return []
+    ids = [row[0] for row in conn.execute("SELECT id FROM artworks ORDER BY random() LIMIT ?", (count,))]
+    wrapped_key = _column(_columns(conn, 'artworks'), 'wrapped_key')
+    rows = [conn.execute(f'''
+        SELECT id, user_id, {wrapped_key}, title_encrypted, description_encrypted, watermark_data
+        FROM artworks WHERE id = ?
+    ''', (art_id,)).fetchone() for art_id in sorted(ids)]
+    if len(rows) <= 1 or workers == 1:
+        return [_decrypt_sample(row) for row in rows]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_decrypt_sample, rows))
+
+# === OUTPUT ===
+def print_report(conn, summary, samples, show_rows=True):
     print("🔐 DATA TERENKRIPSI DI DATABASE")
     print("=" * 70)
-    
-    # Tampilkan tabel users
-    print("\n👥 TABEL USERS:")
+
+    if show_rows:
+        print("\n👥 TABEL USERS:")
+        print("-" * 70)
+        for user in iter_users(conn):
+            print(f"ID: {user['id']}")
+            print(f"  Username (prefix): {user['username_prefix']}...")
+            print(f"  Panjang Username: {user['username_len']} karakter")
+            print(f"  Panjang Password: {user['password_len']} karakter")
+            print(f"  Lookup HMAC: {'✅' if user['has_lookup'] else '❌'}")
+            print()
+
+        print("\n🎨 TABEL ARTWORKS:")
+        print("-" * 70)
+        for art in iter_artworks(conn):
+            size = art['encrypted_size']
+            print(f"ID: {art['id']}, User ID: {art['user_id']}, Tipe: {art['file_type']}, Simpan: {art['storage']}")
+            print(f"  Title Enc: {art['title_prefix']}... ({art['title_len']})")
+            print(f"  Desc Enc: {art['description_prefix']}... ({art['description_len']})")
+            print(f"  File Size: {size:,} bytes ({size / MB:.2f} MB)")
+            if art['watermark_len']:
+                print(f"  Watermark: {art['watermark_prefix']}... ({art['watermark_len']})")
+            print()
+
+    print("\n👤 PER USER:")
     print("-" * 70)
-    cursor.execute("SELECT * FROM users")
-    users = cursor.fetchall()
-    
-    for user in users:
-        user_id, username_enc, password_enc = user
-        print(f"ID: {user_id}")
-        print(f"  Username (Base64): {username_enc}")
-        print(f"  Password (Base64): {password_enc}")
-        print(f"  Panjang Username: {len(username_enc)} karakter")
-        print(f"  Panjang Password: {len(password_enc)} karakter")
-        print()
-    
-    # Tampilkan tabel artworks dengan ukuran MB
-    print("\n🎨 TABEL ARTWORKS:")
+    for row in summary['per_user']:
+        print(f"  User {row['user_id']}: {row['artworks']} karya, {row['encrypted_bytes'] / MB:.2f} MB "
+              f"terenkripsi, {row['images']} gambar, {row['inline']} inline")
+
+    print("\n📁 PER TIPE FILE:")
     print("-" * 70)
-    cursor.execute("SELECT * FROM artworks")
-    artworks = cursor.fetchall()
-    
-    total_size_bytes = 0
-    
-    for art in artworks:
-        art_id, user_id, title_enc, desc_enc, file_data, file_type, watermark = art
-        file_size_bytes = len(file_data) if file_data else 0
-        file_size_mb = file_size_bytes / (1024 * 1024)
-        total_size_bytes += file_size_bytes
-        
-        print(f"ID: {art_id}, User ID: {user_id}, Tipe: {file_type}")
-        print(f"  Title Enc: {title_enc[:50]}...")
-        print(f"  Desc Enc: {desc_enc[:50]}...")
-        print(f"  File Size: {file_size_bytes:,} bytes ({file_size_mb:.2f} MB)")
-        if watermark:
-            print(f"  Watermark: {watermark[:50]}...")
-        print()
-    
-    # Summary
-    total_size_mb = total_size_bytes / (1024 * 1024)
-    print(f"📊 TOTAL SEMUA FILE: {total_size_bytes:,} bytes ({total_size_mb:.2f} MB)")
-    print(f"📈 TOTAL ARTWORKS: {len(artworks)}")
-    
-    conn.close()
+    for row in summary['per_type']:
+        print(f"  {row['file_type']}: {row['artworks']} karya, {row['encrypted_bytes'] / MB:.2f} MB")
+
+    if samples:
+        print("\n🔓 CONTOH DEKRIPSI METADATA:")
+        print("-" * 70)
+        for sample in samples:
+            if 'error' in sample:
+                print(f"  ID {sample['id']}: ❌ {sample['error']}")
+            else:
+                print(f"  ID {sample['id']}: {sample['title']!r} | {sample['description'][:PREFIX_CHARS]!r}"
+                      f" | watermark: {sample['watermark']!r}")
+
+    total = summary['encrypted_bytes']
+    print(f"\n📊 TOTAL SEMUA FILE: {total:,} bytes ({total / MB:.2f} MB)")
+    print(f"📈 TOTAL ARTWORKS: {summary['artworks']} ({summary['in_blob_store']} blob store, "
+          f"{summary['inline']} inline)")
+    print(f"👥 TOTAL USERS: {summary['users']}")
+
+def write_json(path, conn, summary, samples):
+    """Laporan JSON; daftar artwork ditulis per baris (tidak dikumpulkan di memori)"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{\n"generated_at": %s,\n' % json.dumps(time.strftime('%Y-%m-%d %H:%M:%S')))
+        f.write('"summary": %s,\n' % json.dumps(summary))
+        f.write('"samples": %s,\n' % json.dumps(samples))
+        f.write('"artworks": [')
+        for i, art in enumerate(iter_artworks(conn)):
+            f.write(('\n' if i == 0 else ',\n') + json.dumps(art))
+        f.write('\n]\n}\n')
+    print(f"📄 Laporan JSON disimpan: {path}")
+
+def write_csv(path, conn):
+    """Satu baris per artwork (streaming)"""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=ARTWORK_FIELDS)
+        writer.writeheader()
+        for art in iter_artworks(conn):
+            writer.writerow(art)
+    print(f"📄 Laporan CSV disimpan: {path}")
+
+def view_encrypted_data(db_path=DB_PATH, sample=0, workers=None, json_path=None, csv_path=None,
+                        show_rows=True):
+    conn = open_db(db_path)
+    try:
+        summary = summarize(conn)
+        samples = decrypt_samples(conn, sample, workers)
+        print_report(conn, summary, samples, show_rows)
+        if json_path:
+            write_json(json_path, conn, summary, samples)
+        if csv_path:
+            write_csv(csv_path, conn)
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
-    view_encrypted_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Analisis data terenkripsi di database (streaming, tanpa membaca file)")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--sample', type=int, default=0, help="Jumlah artwork acak yang metadata-nya didekripsi")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Process untuk dekripsi sampel")
+    parser.add_argument('--json', dest='json_path', help="Ekspor laporan JSON")
+    parser.add_argument('--csv', dest='csv_path', help="Ekspor daftar artwork CSV")
+    parser.add_argument('--summary-only', action='store_true', help="Hanya agregat, tanpa daftar per baris")
+    args = parser.parse_args()
+    view_encrypted_data(args.db, args.sample, args.workers, args.json_path, args.csv_path,
+                        not args.summary_only)
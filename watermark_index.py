@@ -0,0 +1,38 @@
+from connection import get_connection
+from crypto_utils import (extract_watermark_candidates, watermark_lookup_hash,
+                          WATERMARK_BIT_PLANE_CONFIGS)
+
+def candidate_lookups(image_data, configs=WATERMARK_BIT_PLANE_CONFIGS):
+    """
+    Ekstrak watermark sekali (semua konfigurasi bit plane dalam satu pass)
+    → {lookup hash: (bit_planes, teks)}. Aman dijalankan di worker process (tanpa DB).
+    """
+    lookups = {}
+    for bit_planes, text in extract_watermark_candidates(image_data, configs).items():
+        if text:
+            lookups.setdefault(watermark_lookup_hash(text), (bit_planes, text))
+    return lookups
+
+def find_by_lookups(conn, lookups, user_id=None):
+    """Cari artwork via index watermark_lookup. Return list dict (tanpa dekripsi watermark_data)."""
+    if not lookups:
+        return []
+    hashes = list(lookups)
+    query = f'''
+        SELECT id, user_id, watermark_lookup FROM artworks
+        WHERE watermark_lookup IN ({', '.join('?' * len(hashes))})
+    '''
+    if user_id is not None:
+        query += " AND user_id = ?"
+        hashes.append(user_id)
+    return [
+        {'artwork_id': art_id, 'user_id': owner_id,
+         'bit_planes': list(lookups[lookup][0]), 'watermark': lookups[lookup][1]}
+        for art_id, owner_id, lookup in conn.execute(query + " ORDER BY id", hashes)
+    ]
+
+def match_watermark(image_data, user_id=None):
+    """Verifikasi 1:N: gambar yang dicurigai → daftar artwork dengan watermark yang sama"""
+    lookups = candidate_lookups(image_data)
+    with get_connection() as conn:
+        return find_by_lookups(conn, lookups, user_id)